@@ -1,13 +1,44 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, request, send_file
 from flask_cors import CORS
+import base64
+import datetime
+import gzip
+import itertools
+import json
 import sqlite3
 import os
 import random
 import time
-from werkzeug.utils import secure_filename
+
+from db import (
+    current_generation,
+    get_db,
+    read_generation,
+)
+from cache import cached_response, response_cache
+from catalogue import current_catalogue, diagnosis_comment
+from events import KEEP_ALIVE, FeedFull, event_feed
+import geo
+from image_store import (
+    UploadTooLarge,
+    save_upload,
+    schedule_thumbnail,
+    thumbnail_failed,
+    thumbnail_path,
+)
+from intake import IntakeBusy, intake_writer, store_patients
+from responses import compress_response, dumps, encode_list_items, jsonify
+import metrics
+import migrations
+import outbreaks
+import search
+import trends
 
 app = Flask(__name__)
 CORS(app)
+app.after_request(compress_response)
+# Per-route timing and SQL tracing at /metrics, when TIB_AI_METRICS=1
+metrics.install(app)
 
 # Configure upload folder
 UPLOAD_FOLDER = "uploads"
@@ -17,132 +48,49 @@ app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 # Create uploads directory if it doesn't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-# Database setup
-DB_PATH = "tib_ai.db"
-
 
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    # Create Patient table
-    cursor.execute(
-        """
-    CREATE TABLE IF NOT EXISTS Patient (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        age INTEGER NOT NULL,
-        gender TEXT NOT NULL,
-        location TEXT NOT NULL,
-        temperature_f REAL,
-        pregnancy_status TEXT,
-        blood_pressure TEXT,
-        blood_glucose REAL,
-        image_path TEXT,
-        symptoms TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    """
-    )
-
-    # Create Severity table
-    cursor.execute(
-        """
-    CREATE TABLE IF NOT EXISTS Severity (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        level INTEGER NOT NULL,
-        name TEXT NOT NULL
-    )
-    """
-    )
-
-    # Create Disease table
-    cursor.execute(
-        """
-    CREATE TABLE IF NOT EXISTS Disease (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL
-    )
-    """
-    )
-
-    # Create Resultant table
-    cursor.execute(
-        """
-    CREATE TABLE IF NOT EXISTS Resultant (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        patient_id INTEGER NOT NULL,
-        severity_id INTEGER NOT NULL,
-        disease_id INTEGER NOT NULL,
-        confidence_score REAL NOT NULL,
-        comment TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (patient_id) REFERENCES Patient (id),
-        FOREIGN KEY (severity_id) REFERENCES Severity (id),
-        FOREIGN KEY (disease_id) REFERENCES Disease (id)
-    )
-    """
-    )
-
-    # Insert initial data if tables are empty
-    cursor.execute("SELECT COUNT(*) FROM Severity")
-    if cursor.fetchone()[0] == 0:
-        severity_data = [
-            (1, "Critical"),
-            (2, "Urgent"),
-            (3, "Medium"),
-            (4, "Low"),
-            (5, "Minimal"),
-        ]
-        cursor.executemany(
-            "INSERT INTO Severity (level, name) VALUES (?, ?)", severity_data
-        )
-
-    cursor.execute("SELECT COUNT(*) FROM Disease")
-    if cursor.fetchone()[0] == 0:
-        disease_data = [
-            (1, "Dengue"),
-            (2, "Measles"),
-            (3, "Skin infection"),
-            (4, "Diarrhea"),
-            (5, "Tuberculosis"),
-        ]
-        cursor.executemany("INSERT INTO Disease (id, name) VALUES (?, ?)", disease_data)
+    """Apply any pending schema migrations; a single version read when current"""
+    with get_db() as conn:
+        migrations.migrate(conn)
 
-    conn.commit()
-    conn.close()
 
-
-# Initialize database
-init_db()
+# Migrate the database; serve.py does this once before forking its workers
+# and sets TIB_AI_INIT_DB=0 for them
+if os.environ.get("TIB_AI_INIT_DB", "1") != "0":
+    init_db()
 
 
 def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def generate_triage_data():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    # Get severity data from database
-    cursor.execute("SELECT level, name FROM Severity ORDER BY level")
-    severity_data = cursor.fetchall()
-
-    # Get count of patients by severity from resultant table
-    cursor.execute(
+def generate_triage_data(cursor, disease_id=None):
+    # Get count of patients by severity from the summary table
+    if disease_id is None:
+        cursor.execute(
+            """
+        SELECT s.level, s.name, COALESCE(SUM(rs.case_count), 0)
+        FROM Severity s
+        LEFT JOIN ResultantSummary rs ON rs.severity_id = s.id
+        GROUP BY s.id
+        ORDER BY s.level
         """
-    SELECT s.level, s.name, COUNT(r.id) 
-    FROM Severity s
-    LEFT JOIN Resultant r ON r.severity_id = s.id
-    GROUP BY s.id
-    ORDER BY s.level
-    """
-    )
+        )
+    else:
+        cursor.execute(
+            """
+            SELECT s.level, s.name, COALESCE(SUM(rs.case_count), 0)
+            FROM Severity s
+            LEFT JOIN ResultantSummary rs
+                ON rs.severity_id = s.id AND rs.disease_id = ?
+            GROUP BY s.id
+            ORDER BY s.level
+            """,
+            (disease_id,)
+        )
     result = cursor.fetchall()
 
-    conn.close()
-
     colors = [ "#1890FF","#52C41A", "#FFEC3D", "#FAAD14","#FF4D4F"]
 
     # Transform the result into the required format
@@ -156,23 +104,19 @@ def generate_triage_data():
     ]
 
 
-def generate_region_data():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
+def generate_region_data(cursor):
     # Get counts by location
     cursor.execute(
         """
-    SELECT p.location, COUNT(p.id) as count, 
+    SELECT rs.location, SUM(rs.case_count) as count,
            MAX(s.level) as severity_level, s.name as severity_name
-    FROM Patient p
-    JOIN Resultant r ON p.id = r.patient_id
-    JOIN Severity s ON r.severity_id = s.id
-    GROUP BY p.location
+    FROM ResultantSummary rs
+    JOIN Severity s ON rs.severity_id = s.id
+    WHERE rs.case_count > 0
+    GROUP BY rs.location
     """
     )
     result = cursor.fetchall()
-    conn.close()
 
     # Process the data
     regions = {}
@@ -193,56 +137,60 @@ def generate_region_data():
 
 
 @app.route("/api/triage-data")
+@cached_response
 def get_triage_data():
-    return jsonify(generate_triage_data())
+    with get_db() as conn:
+        return jsonify(generate_triage_data(conn.cursor()))
 
 
 @app.route("/api/triage-data/<int:disease_id>")
+@cached_response
 def get_disease_triage_data(disease_id):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        with get_db() as conn:
+            return jsonify(generate_triage_data(conn.cursor(), disease_id))
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
 
-        # Get severity data from database
-        cursor.execute("SELECT level, name FROM Severity ORDER BY level")
-        severity_data = cursor.fetchall()
 
-        # Get count of patients by severity for specific disease
-        cursor.execute(
-            """
-            SELECT s.level, s.name, COUNT(r.id) 
-            FROM Severity s
-            LEFT JOIN (
-                SELECT * FROM Resultant 
-                WHERE disease_id = ?
-            ) r ON r.severity_id = s.id
-            GROUP BY s.id
-            ORDER BY s.level
-            """,
-            (disease_id,)
-        )
-        result = cursor.fetchall()
+@app.route("/api/region-data")
+@cached_response
+def get_region_data():
+    with get_db() as conn:
+        return jsonify(generate_region_data(conn.cursor()))
 
-        conn.close()
 
-        colors = ["#1890FF", "#52C41A", "#FFEC3D", "#FAAD14", "#FF4D4F"]
+def triage(snapshot, symptoms):
+    """Return (disease_id, severity_id, confidence_score, comment) for a patient.
 
-        # Transform the result into the required format
-        return jsonify([
-            {
-                "level": name,
-                "count": count if count > 0 else 0,
-                "color": colors[i % len(colors)],
-            }
-            for i, (_, name, count) in enumerate(result)
-        ])
-    except Exception as e:
-        return jsonify({"success": False, "error": str(e)}), 500
+    snapshot is the Catalogue to triage against.
+    """
+    # Pick the disease whose symptoms match best, or a random one if none do
+    ranking = snapshot.symptom_index.rank(symptoms)
+    if ranking:
+        disease_id, _, matched_symptoms = ranking[0]
+    else:
+        disease_id = random.choice(list(snapshot.diseases))
+        matched_symptoms = []
+    disease = snapshot.diseases[disease_id]
+
+    # Set a higher severity level for high-risk conditions such as Dengue or TB
+    if disease.high_risk:
+        levels = range(1, 4)  # Higher severity (1-3)
+    else:
+        levels = range(2, 6)  # Lower severity (2-5)
+    severity = random.choice(
+        [s for s in snapshot.severities.values() if s.level in levels]
+        or list(snapshot.severities.values())
+    )
 
+    # Generate high confidence score (90% - 99%)
+    confidence_score = round(random.uniform(0.90, 0.99), 2)
 
-@app.route("/api/region-data")
-def get_region_data():
-    return jsonify(generate_region_data())
+    # Generate a detailed comment based on the disease and symptoms
+    comment = diagnosis_comment(disease, severity, confidence_score, matched_symptoms)
+
+    return disease_id, severity.id, confidence_score, comment
 
 
 @app.route("/api/patients", methods=["POST"])
@@ -255,366 +203,784 @@ def add_patient():
         if "image" in request.files:
             file = request.files["image"]
             if file.filename != "" and allowed_file(file.filename):
-                # Generate a unique filename to prevent collisions
-                filename = secure_filename(f"{int(time.time())}_{file.filename}")
-                file_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-                file.save(file_path)
-                image_path = file_path
-
-        # Connect to database
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-
-        # Insert patient data
-        cursor.execute(
-            """
-        INSERT INTO Patient (
-            name, age, gender, location, temperature_f, 
-            pregnancy_status, blood_pressure, blood_glucose, 
-            image_path, symptoms
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-            (
-                data.get("name"),
-                data.get("age"),
-                data.get("gender"),
-                data.get("location"),
-                data.get("temperature_f"),
-                data.get("pregnancy_status", "N/A"),
-                data.get("blood_pressure"),
-                data.get("blood_glucose"),
-                image_path,
-                data.get("symptoms"),
+                # Stored under its content hash, so repeated uploads share a file
+                extension = file.filename.rsplit(".", 1)[1]
+                try:
+                    image_path = save_upload(
+                        file.stream, extension, app.config["UPLOAD_FOLDER"]
+                    )
+                except UploadTooLarge as e:
+                    return jsonify({"success": False, "error": str(e)}), 413
+                schedule_thumbnail(image_path)
+
+        patient = (
+            data.get("name"),
+            data.get("age"),
+            data.get("gender"),
+            data.get("location"),
+            data.get("temperature_f"),
+            data.get("pregnancy_status", "N/A"),
+            data.get("blood_pressure"),
+            data.get("blood_glucose"),
+            image_path,
+            data.get("symptoms"),
+        )
+        snapshot = current_catalogue()
+        diagnosis = triage(snapshot, data.get("symptoms", ""))
+
+        # Stored by the intake writer together with other waiting patients;
+        # the response is built from the values in hand, without reading back
+        try:
+            patient_id = intake_writer.submit(patient, diagnosis)
+        except IntakeBusy as e:
+            return jsonify({"success": False, "error": str(e)}), 503
+
+        disease_id, severity_id, confidence_score, comment = diagnosis
+        severity = snapshot.severities[severity_id]
+        return (
+            jsonify(
+                {
+                    "success": True,
+                    "patient_id": patient_id,
+                    "diagnosis": {
+                        "disease": snapshot.diseases[disease_id].name,
+                        "severity": severity.name,
+                        "confidence": confidence_score,
+                        "comment": comment,
+                        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                        "recommendedAction": severity.recommended_action,
+                    },
+                }
             ),
+            201,
         )
 
-        patient_id = cursor.lastrowid
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
 
-        # Randomly assign a disease but ensure high confidence (>90%)
-        disease_id = random.randint(1, 5)
-        
-        # Map of disease IDs to names and common symptoms
-        disease_info = {
-            1: {
-                "name": "Dengue", 
-                "symptoms": ["high fever", "severe headache", "pain behind the eyes", "joint and muscle pain", "rash"],
-                "precautions": "Rest, stay hydrated, and take acetaminophen for pain. Avoid aspirin and ibuprofen."
-            },
-            2: {
-                "name": "Measles", 
-                "symptoms": ["fever", "dry cough", "runny nose", "sore throat", "inflamed eyes", "rash"],
-                "precautions": "Rest, stay hydrated, and use humidifier for cough. Isolation recommended."
-            },
-            3: {
-                "name": "Skin infection", 
-                "symptoms": ["redness", "swelling", "warmth", "pain", "pus or drainage"],
-                "precautions": "Keep area clean and dry. Apply prescribed topical medications. Cover with sterile bandage."
-            },
-            4: {
-                "name": "Diarrhea", 
-                "symptoms": ["loose watery stools", "abdominal cramps", "nausea", "bloating", "dehydration"],
-                "precautions": "Stay hydrated with water and electrolyte solutions. Eat mild foods like rice and bananas."
-            },
-            5: {
-                "name": "Tuberculosis", 
-                "symptoms": ["persistent cough", "chest pain", "weight loss", "night sweats", "fatigue"],
-                "precautions": "Complete isolation and full course of prescribed antibiotics. Regular medical follow-up."
-            }
-        }
-        
-        # Map severity levels
-        severity_levels = {
-            1: "Critical",
-            2: "Urgent",
-            3: "Medium",
-            4: "Low",
-            5: "Minimal"
-        }
-        
-        # Set a higher severity level for specific high-risk conditions
-        if disease_id in [1, 5]:  # Dengue or TB
-            severity_id = random.randint(1, 3)  # Higher severity (1-3)
-        else:
-            severity_id = random.randint(2, 5)  # Lower severity (2-5)
-        
-        # Generate high confidence score (90% - 99%)
-        confidence_score = round(random.uniform(0.90, 0.99), 2)
-        
-        # Generate a detailed comment based on the disease and symptoms
-        disease_name = disease_info[disease_id]["name"]
-        severity_name = severity_levels[severity_id]
-        matched_symptoms = []
-        
-        # Analyze reported symptoms to add to report
-        reported_symptoms = data.get("symptoms", "").lower()
-        for symptom in disease_info[disease_id]["symptoms"]:
-            if symptom in reported_symptoms:
-                matched_symptoms.append(symptom)
-        
-        # Generate detailed comment
-        if matched_symptoms:
-            symptom_text = ", ".join(matched_symptoms)
-            comment = f"AI detected {disease_name} with {confidence_score*100:.1f}% confidence based on symptoms: {symptom_text}. Severity: {severity_name}. {disease_info[disease_id]['precautions']}"
-        else:
-            comment = f"AI detected {disease_name} with {confidence_score*100:.1f}% confidence. Severity: {severity_name}. {disease_info[disease_id]['precautions']}"
 
-        # Insert into Resultant table
-        cursor.execute(
-            """
-        INSERT INTO Resultant (
-            patient_id, severity_id, disease_id, confidence_score, comment
-        ) VALUES (?, ?, ?, ?, ?)
-        """,
-            (
-                patient_id,
-                severity_id,
-                disease_id,
-                confidence_score,
-                comment,
-            ),
-        )
+# Largest number of patients accepted by one POST /api/patients/batch
+PATIENT_BATCH_MAX = 500
+PATIENT_REQUIRED_FIELDS = ["name", "age", "gender", "location"]
+NDJSON_MIMETYPES = {"application/x-ndjson", "application/jsonl"}
 
-        conn.commit()
 
-        # Get the disease and severity info to return
-        cursor.execute(
-            """
-        SELECT d.name, s.name, r.confidence_score, r.comment
-        FROM Resultant r
-        JOIN Disease d ON r.disease_id = d.id
-        JOIN Severity s ON r.severity_id = s.id
-        WHERE r.patient_id = ?
-        """,
-            (patient_id,),
-        )
+def read_patient_batch(req):
+    """Return the records of a JSON array or NDJSON body as (record, error) pairs.
 
-        result = cursor.fetchone()
-        conn.close()
+    An NDJSON line that is not valid JSON only fails its own record.
+    """
+    if req.mimetype in NDJSON_MIMETYPES:
+        records = []
+        for line in req.stream:
+            if not line.strip():
+                continue
+            try:
+                records.append((json.loads(line), None))
+            except ValueError as e:
+                records.append((None, f"Invalid JSON: {e}"))
+        return records
+
+    body = req.get_json(silent=True)
+    if not isinstance(body, list):
+        raise ValueError("Expected a JSON array or an NDJSON stream of patients")
+    return [(record, None) for record in body]
+
+
+def validate_patient(record):
+    """Return the Patient column values for one batch record"""
+    if not isinstance(record, dict):
+        raise ValueError("Patient must be a JSON object")
+
+    missing = [f for f in PATIENT_REQUIRED_FIELDS if record.get(f) in (None, "")]
+    if missing:
+        raise ValueError(f"Missing fields: {', '.join(missing)}")
 
-        # Create a more detailed diagnosis response
-        disease_name = result[0]
-        severity_name = result[1]
-        confidence = result[2]
-        comment = result[3]
-        
-        return (
-            jsonify(
-                {
+    try:
+        age = int(record["age"])
+    except (TypeError, ValueError):
+        raise ValueError("age must be an integer")
+
+    return (
+        record["name"],
+        age,
+        record["gender"],
+        record["location"],
+        record.get("temperature_f"),
+        record.get("pregnancy_status", "N/A"),
+        record.get("blood_pressure"),
+        record.get("blood_glucose"),
+        None,  # image_path; batches carry no images
+        record.get("symptoms") or "",
+    )
+
+
+@app.route("/api/patients/batch", methods=["POST"])
+def add_patients_batch():
+    """Triage and store many patients in one transaction.
+
+    Results come back in request order. Records that fail validation get an
+    error entry and do not stop the others from being stored.
+    """
+    try:
+        try:
+            records = read_patient_batch(request)
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+
+        if len(records) > PATIENT_BATCH_MAX:
+            return (
+                jsonify(
+                    {
+                        "success": False,
+                        "error": f"At most {PATIENT_BATCH_MAX} patients per batch",
+                    }
+                ),
+                413,
+            )
+
+        # One catalogue for the whole batch
+        snapshot = current_catalogue()
+
+        results = [None] * len(records)
+        accepted = []
+        for index, (record, error) in enumerate(records):
+            if error is None:
+                try:
+                    patient = validate_patient(record)
+                except ValueError as e:
+                    error = str(e)
+            if error is not None:
+                results[index] = {"index": index, "success": False, "error": error}
+                continue
+            accepted.append((index, patient, triage(snapshot, patient[-1])))
+
+        if accepted:
+            with get_db() as conn:
+                patient_ids = store_patients(
+                    conn.cursor(), [(patient, diagnosis) for _, patient, diagnosis in accepted]
+                )
+            event_feed.wake()
+
+            date = time.strftime("%Y-%m-%d %H:%M:%S")
+            for patient_id, (index, _, diagnosis) in zip(patient_ids, accepted):
+                disease_id, severity_id, confidence, comment = diagnosis
+                severity = snapshot.severities[severity_id]
+                results[index] = {
+                    "index": index,
                     "success": True,
                     "patient_id": patient_id,
                     "diagnosis": {
-                        "disease": disease_name,
-                        "severity": severity_name,
+                        "disease": snapshot.diseases[disease_id].name,
+                        "severity": severity.name,
                         "confidence": confidence,
                         "comment": comment,
-                        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
-                        "recommendedAction": get_recommended_action(severity_name)
+                        "date": date,
+                        "recommendedAction": severity.recommended_action,
                     },
                 }
-            ),
-            201,
+
+        return jsonify(
+            {
+                "success": True,
+                "accepted": len(accepted),
+                "rejected": len(records) - len(accepted),
+                "results": results,
+            }
         )
 
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
-def get_recommended_action(severity):
-    """Generate recommended action based on severity level"""
-    if severity == "Critical":
-        return "Seek immediate emergency medical attention"
-    elif severity == "Urgent":
-        return "Seek medical care within 24 hours"
-    elif severity == "Medium":
-        return "Schedule doctor appointment within 3-5 days"
-    elif severity == "Low":
-        return "Home care with over-the-counter medications, seek medical attention if symptoms worsen"
-    else:  # Minimal
-        return "Home care and rest, monitor symptoms"
 
+# Columns that can be requested from GET /api/patients with ?fields=
+PATIENT_COLUMNS = {
+    "id": "p.id",
+    "name": "p.name",
+    "age": "p.age",
+    "gender": "p.gender",
+    "location": "p.location",
+    "temperature_f": "p.temperature_f",
+    "pregnancy_status": "p.pregnancy_status",
+    "blood_pressure": "p.blood_pressure",
+    "blood_glucose": "p.blood_glucose",
+    "image_path": "p.image_path",
+    "symptoms": "p.symptoms",
+    "created_at": "p.created_at",
+    "disease": "d.name",
+    "severity": "s.name",
+    "confidence_score": "r.confidence_score",
+}
+# The Patient/Resultant join with either table as the outer loop. Without
+# ANALYZE statistics SQLite often picks the wrong one, so CROSS JOIN pins it.
+PATIENTS_BY_PATIENT = "Patient p {hint} CROSS JOIN Resultant r ON p.id = r.patient_id"
+PATIENTS_BY_RESULT = "Resultant r CROSS JOIN Patient p ON p.id = r.patient_id"
+# ?sort= keys: the sort column, the column that breaks its ties and the
+# join with the table holding them outermost. An index serves each sort in
+# order, so a page read in sort order reads only its own rows.
+PATIENT_SORTS = {
+    "created_at": ("p.created_at", "p.id", PATIENTS_BY_PATIENT),
+    "age": ("p.age", "p.id", PATIENTS_BY_PATIENT),
+    "name": ("p.name", "p.id", PATIENTS_BY_PATIENT),
+    "location": ("p.location", "p.id", PATIENTS_BY_PATIENT),
+    "confidence_score": ("r.confidence_score", "r.patient_id", PATIENTS_BY_RESULT),
+}
+DEFAULT_PATIENT_SORT = ("created_at", True)
+PATIENTS_PAGE_SIZE = 100
+PATIENTS_MAX_PAGE_SIZE = 1000
+# ?format= shapes: one object per patient (the default), one array per
+# patient under "columns" names, or one array per column
+PATIENT_FORMATS = ("objects", "rows", "columns")
+# Rows read and encoded together while streaming a page
+PATIENTS_ENCODE_BATCH = 250
+
+
+def parse_int(value, name, low=None, high=None):
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer")
+    if (low is not None and value < low) or (high is not None and value > high):
+        raise ValueError(f"{name} must be between {low} and {high}")
+    return value
 
-@app.route("/api/patients", methods=["GET"])
-def get_patients():
+
+def parse_int_arg(args, name, default=None, low=None, high=None):
+    value = args.get(name)
+    if value is None or value == "":
+        return default
+    return parse_int(value, name, low, high)
+
+
+def encode_cursor(sort_value, patient_id, total=None):
+    raw = json.dumps([sort_value, patient_id, total]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """Return (sort value, patient id, total) from a cursor.
+
+    The total counted for the first page rides along in the cursor; it is
+    None in cursors from before it did.
+    """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        sort_value, patient_id, *total = json.loads(
+            base64.urlsafe_b64decode(cursor.encode("ascii"))
+        )
+        total = int(total[0]) if total and total[0] is not None else None
+        return sort_value, int(patient_id), total
+    except (ValueError, TypeError, UnicodeError):
+        raise ValueError("Invalid cursor")
 
-        cursor.execute(
-            """
-        SELECT p.*, d.name as disease, s.name as severity, r.confidence_score
-        FROM Patient p
-        JOIN Resultant r ON p.id = r.patient_id
+
+def parse_day(value, name):
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a YYYY-MM-DD date")
+
+
+def parse_text(value, name):
+    return value
+
+
+def parse_age(value, name):
+    return parse_int(value, name, 0, 150)
+
+
+def parse_day_start(value, name):
+    return str(parse_day(value, name))
+
+
+def parse_day_end(value, name):
+    # The first moment after the day, so the whole day is included
+    return str(parse_day(value, name) + datetime.timedelta(days=1))
+
+
+# GET /api/patients filters: (SQL condition, parser of the query parameter).
+# Text filters ignore case, as idx_patient_filters does
+PATIENT_FILTERS = {
+    "disease_id": ("r.disease_id = ?", parse_int),
+    "severity_id": ("r.severity_id = ?", parse_int),
+    "location": ("p.location = ? COLLATE NOCASE", parse_text),
+    "gender": ("p.gender = ? COLLATE NOCASE", parse_text),
+    "pregnancy_status": ("p.pregnancy_status = ? COLLATE NOCASE", parse_text),
+    "age_min": ("p.age >= ?", parse_age),
+    "age_max": ("p.age <= ?", parse_age),
+    "created_from": ("p.created_at >= ?", parse_day_start),
+    "created_to": ("p.created_at < ?", parse_day_end),
+}
+# Filters that ResultantSummary can count, as conditions on its columns
+SUMMARY_FILTERS = {
+    "disease_id": "disease_id = ?",
+    "severity_id": "severity_id = ?",
+    "location": "location = ? COLLATE NOCASE",
+}
+# Filters read through idx_patient_filters, which covers every Patient
+# filter. SQLite would rather take idx_patient_age for an age range and
+# read each row it finds from the table.
+FILTER_INDEX_FILTERS = {"gender", "pregnancy_status", "age_min", "age_max"}
+
+
+def parse_patient_filters(args):
+    """Return {filter name: SQL parameter} for the filters present in args"""
+    filters = {}
+    for name, (_, parse) in PATIENT_FILTERS.items():
+        value = args.get(name)
+        if value is not None and value != "":
+            filters[name] = parse(value, name)
+    return filters
+
+
+def parse_patient_sort(args):
+    """Return (sort key, descending) from the sort and order parameters"""
+    key = args.get("sort", DEFAULT_PATIENT_SORT[0])
+    if key not in PATIENT_SORTS:
+        raise ValueError(f"sort must be one of {', '.join(PATIENT_SORTS)}")
+    order = args.get("order", "desc")
+    if order not in ("asc", "desc"):
+        raise ValueError("order must be asc or desc")
+    return key, order == "desc"
+
+
+def parse_patient_page_args(args):
+    """Validate the limit, cursor, fields, format, filter and sort query parameters"""
+    limit = parse_int_arg(args, "limit", PATIENTS_PAGE_SIZE, 1, PATIENTS_MAX_PAGE_SIZE)
+
+    cursor = args.get("cursor")
+    after = decode_cursor(cursor) if cursor else None
+
+    page_format = args.get("format", "objects")
+    if page_format not in PATIENT_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(PATIENT_FORMATS)}")
+
+    return (
+        limit,
+        after,
+        parse_patient_fields(args),
+        page_format,
+        parse_patient_filters(args),
+        parse_patient_sort(args),
+    )
+
+
+def parse_patient_fields(args):
+    """Validate the fields query parameter; all columns when it is absent"""
+    fields = [f.strip() for f in args.get("fields", "").split(",") if f.strip()]
+    unknown = [f for f in fields if f not in PATIENT_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields or list(PATIENT_COLUMNS)
+
+
+def select_patient_page(cursor, limit, after, fields, filters=None, sort=DEFAULT_PATIENT_SORT,
+                        total=None):
+    """Run the keyset query for one page of patients, newest first by default.
+
+    filters maps PATIENT_FILTERS names to their parsed values, and sort is
+    a (PATIENT_SORTS key, descending) pair. total is the number of patients
+    the filters match, when it is known. Each row holds the requested
+    fields followed by the row's sort value and id, which make up the
+    cursor for the next page.
+    """
+    filters = filters or {}
+    key, descending = sort
+    sort_column, tie_column, tables = PATIENT_SORTS[key]
+    columns = ", ".join(f"{PATIENT_COLUMNS[f]} AS {f}" for f in fields)
+
+    conditions = [PATIENT_FILTERS[name][0] for name in filters]
+    direction = "DESC" if descending else "ASC"
+    order = f"{sort_column} {direction}, {tie_column} {direction}"
+    hint = ""
+    if not filters or (total is not None and reads_in_sort_order(cursor, limit, total)):
+        # Walk the sort index and stop after one page of matches; a unary +
+        # keeps SQLite off the filter indexes
+        conditions = [f"+{condition}" for condition in conditions]
+    else:
+        # Few matches: find them through the filter indexes, then sort them.
+        # Here the unary + keeps SQLite off the sort index.
+        order = f"+{sort_column} {direction}, +{tie_column} {direction}"
+        if any(condition.startswith("p.") for condition in conditions):
+            tables = PATIENTS_BY_PATIENT
+            hint = filter_index_hint(filters)
+        else:
+            tables = PATIENTS_BY_RESULT
+    parameters = list(filters.values())
+    if after:
+        conditions.append(f"({sort_column}, {tie_column}) {'<' if descending else '>'} (?, ?)")
+        parameters.extend(after[:2])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    cursor.execute(
+        f"""
+        SELECT {columns}, {sort_column}, {tie_column}
+        FROM {tables.format(hint=hint)}
         JOIN Disease d ON r.disease_id = d.id
         JOIN Severity s ON r.severity_id = s.id
-        ORDER BY p.created_at DESC
-        """
+        {where}
+        ORDER BY {order}
+        LIMIT ?
+        """,
+        (*parameters, limit),
+    )
+    return cursor
+
+
+def filter_index_hint(filters):
+    return "INDEXED BY idx_patient_filters" if filters.keys() & FILTER_INDEX_FILTERS else ""
+
+
+def reads_in_sort_order(cursor, limit, total):
+    """Whether a filtered page is cheaper read in sort order than sorted.
+
+    Walking the sort index reads about limit * patients / total rows to
+    fill a page; the filter indexes read all total matches, which must then
+    be sorted.
+    """
+    patients = count_patients(cursor, {})
+    return total * total > limit * patients
+
+
+def count_patients(cursor, filters):
+    """Return the exact number of patients matching filters.
+
+    Disease, severity and location filters are counted from
+    ResultantSummary, in time proportional to its groups. Its
+    empty-location group holds results whose patient is missing, which the
+    page query's join leaves out, so it is only used while that group is
+    empty. Other filters count the join through covering indexes, without
+    reading table rows.
+    """
+    if filters.keys() <= SUMMARY_FILTERS.keys():
+        conditions = [SUMMARY_FILTERS[name] for name in filters]
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        cursor.execute(
+            f"""
+            SELECT COALESCE(SUM(case_count), 0),
+                   COALESCE(SUM(case_count) FILTER (WHERE location = ''), 0)
+            FROM ResultantSummary
+            {where}
+            """,
+            tuple(filters.values()),
         )
+        total, unattached = cursor.fetchone()
+        if not unattached:
+            return total
 
-        patients = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+    conditions = [PATIENT_FILTERS[name][0] for name in filters]
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    cursor.execute(
+        f"""
+        SELECT COUNT(*)
+        FROM Patient p {filter_index_hint(filters)}
+        JOIN Resultant r ON p.id = r.patient_id
+        {where}
+        """,
+        tuple(filters.values()),
+    )
+    return cursor.fetchone()[0]
 
-        return jsonify(patients)
+
+def stream_patient_page(limit, after, fields, page_format="objects", filters=None,
+                        sort=DEFAULT_PATIENT_SORT):
+    """Yield one page of patients as JSON bytes.
+
+    Rows are read from the cursor and encoded in batches, so memory use
+    does not depend on the size of the table. The "rows" and "columns"
+    formats encode the row tuples as they are, without a dict per row. The
+    page ends with the number of matching patients, as counted for the
+    first page, and the cursor of its last row, or null when there are no
+    more rows.
+    """
+    with get_db() as conn:
+        # Counted once per listing and carried to later pages in the cursor
+        total = after[2] if after else None
+        if total is None:
+            total = count_patients(conn.cursor(), filters or {})
+        rows = select_patient_page(conn.cursor(), limit, after, fields, filters, sort, total)
+        width = len(fields)
+
+        if page_format == "columns":
+            # Every column must be complete before the next one starts
+            page = rows.fetchall()
+            last = page[-1][-2:] if page else None
+            values = list(zip(*page)) if page else [()] * width
+            yield b'{"columns":' + dumps(dict(zip(fields, values[:width])))
+            count = len(page)
+        else:
+            if page_format == "rows":
+                yield b'{"columns":' + dumps(fields) + b',"rows":['
+            else:
+                yield b'{"patients":['
+            count = 0
+            last = None
+            while True:
+                batch = rows.fetchmany(PATIENTS_ENCODE_BATCH)
+                if not batch:
+                    break
+                if page_format == "rows":
+                    items = [row[:width] for row in batch]
+                else:
+                    items = [dict(zip(fields, row)) for row in batch]
+                yield (b"," if count else b"") + encode_list_items(items)
+                count += len(batch)
+                last = batch[-1][-2:]
+            yield b"]"
+
+        next_cursor = encode_cursor(*last, total) if count == limit else None
+        yield b',"total":' + dumps(total) + b',"next_cursor":' + dumps(next_cursor) + b"}"
+
+
+@app.route("/api/patients", methods=["GET"])
+def get_patients():
+    try:
+        try:
+            limit, after, fields, page_format, filters, sort = parse_patient_page_args(
+                request.args
+            )
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+
+        # Run the query before the response starts so errors still give a 500
+        body = stream_patient_page(limit, after, fields, page_format, filters, sort)
+        first_chunk = next(body)
+
+        return Response(
+            itertools.chain([first_chunk], body), mimetype="application/json"
+        )
 
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
 
-@app.route("/api/stats", methods=["GET"])
-def get_stats():
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+# Ranked results are paged by offset, so deep pages rank every match again
+SEARCH_MAX_OFFSET = 10000
 
-        # Get total patients
-        cursor.execute("SELECT COUNT(*) FROM Patient")
-        total_patients = cursor.fetchone()[0]
 
-        # Get total diseases detected
-        cursor.execute("SELECT COUNT(*) FROM Disease")
-        total_diseases_detected = cursor.fetchone()[0]
+def parse_search_args(args):
+    """Validate the q, disease_id, severity_id, limit, offset and fields parameters"""
+    match = search.match_expression(args.get("q", ""))
+    disease_id = parse_int_arg(args, "disease_id")
+    severity_id = parse_int_arg(args, "severity_id")
+    limit = parse_int_arg(args, "limit", SEARCH_PAGE_SIZE, 1, SEARCH_MAX_PAGE_SIZE)
+    offset = parse_int_arg(args, "offset", 0, 0, SEARCH_MAX_OFFSET)
+    return match, disease_id, severity_id, limit, offset, parse_patient_fields(args)
 
-        # Get average confidence score
-        cursor.execute("SELECT AVG(confidence_score) FROM Resultant")
-        avg_confidence = cursor.fetchone()[0]
-        if avg_confidence:
-            accuracy = f"{int(avg_confidence * 100)}%"
-        else:
-            accuracy = "N/A"
 
-        # Get disease counts
-        cursor.execute(
-            """
-        SELECT d.id, d.name, COUNT(r.id) as count 
-        FROM Disease d
-        LEFT JOIN Resultant r ON d.id = r.disease_id
-        GROUP BY d.id
-        ORDER BY d.id
-        """
-        )
+def select_search_page(cursor, match, disease_id, severity_id, limit, offset, fields):
+    """Return one page of the patients matching an FTS5 query, best match first"""
+    columns = ", ".join(f"{PATIENT_COLUMNS[f]} AS {f}" for f in fields)
+    filters = ""
+    parameters = [match]
+    if disease_id is not None:
+        filters += " AND r.disease_id = ?"
+        parameters.append(disease_id)
+    if severity_id is not None:
+        filters += " AND r.severity_id = ?"
+        parameters.append(severity_id)
 
-        diseases = []
-        colors = ["#1890FF", "#52C41A", "#FAAD14", "#FF4D4F", "#722ED1"]
+    cursor.execute(
+        f"""
+        SELECT {columns}
+        FROM PatientSearch
+        JOIN Patient p ON p.id = PatientSearch.rowid
+        JOIN Resultant r ON p.id = r.patient_id
+        JOIN Disease d ON r.disease_id = d.id
+        JOIN Severity s ON r.severity_id = s.id
+        WHERE PatientSearch MATCH ?{filters}
+        ORDER BY PatientSearch.rank, p.id DESC
+        LIMIT ? OFFSET ?
+        """,
+        (*parameters, limit, offset),
+    )
+    return [dict(zip(fields, row)) for row in cursor.fetchall()]
 
-        for i, row in enumerate(cursor.fetchall()):
-            disease_id, name, count = row
-            diseases.append(
-                {
-                    "id": disease_id,
-                    "name": name,
-                    "count": count if count > 0 else random.randint(5, 50),
-                    "color": colors[i % len(colors)],
-                }
+
+@app.route("/api/patients/search", methods=["GET"])
+def search_patients():
+    try:
+        try:
+            match, disease_id, severity_id, limit, offset, fields = parse_search_args(
+                request.args
             )
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
 
-        # Generate trend data based on patient distribution by location
-        cursor.execute("""
-            SELECT location, COUNT(*) as count
-            FROM Patient
-            GROUP BY location
-            ORDER BY count DESC
-            LIMIT 3
-        """)
-        top_locations = cursor.fetchall()
-        
-        # Calculate trend data
-        if len(top_locations) > 0:
-            top_location, top_count = top_locations[0]
-            patientsTrend = f"{top_count} in {top_location}"
-        else:
-            patientsTrend = "Distribution data unavailable"
-            
-        # Calculate disease trend data
-        cursor.execute("""
-            SELECT d.name, COUNT(r.id) as count
-            FROM Disease d
-            JOIN Resultant r ON d.id = r.disease_id
-            GROUP BY d.name
-            ORDER BY count DESC
-            LIMIT 1
-        """)
-        top_disease = cursor.fetchone()
-        if top_disease:
-            diseasesTrend = f"Most common: {top_disease[0]} ({top_disease[1]} cases)"
-        else:
-            diseasesTrend = "Disease trend data unavailable"
-            
-        # Calculate accuracy trend by severity
-        cursor.execute("""
-            SELECT s.name, AVG(r.confidence_score) as avg_score
-            FROM Resultant r
-            JOIN Severity s ON r.severity_id = s.id
-            GROUP BY s.name
-            ORDER BY avg_score DESC
-            LIMIT 1
-        """)
-        top_accuracy = cursor.fetchone()
-        if top_accuracy:
-            accuracyTrend = f"Highest for {top_accuracy[0]}: {int(top_accuracy[1] * 100)}%"
-        else:
-            accuracyTrend = "Accuracy trend data unavailable"
+        with get_db() as conn:
+            patients = select_search_page(
+                conn.cursor(), match, disease_id, severity_id, limit, offset, fields
+            )
 
-        # Get data for histogram
-        labels = [d["name"] for d in diseases]
-        datasets = [
-            {
-                "label": "AI Detected",
-                "data": [int(d["count"] + 2) for d in diseases],
-                "backgroundColor": "#1890FF",
-            },
-            {
-                "label": "Non-AI Detected",
-                "data": [int(d["count"] * 0.8) for d in diseases],
-                "backgroundColor": "#52C41A",
-            },
-            {
-                "label": "Actual",
-                "data": [d["count"] for d in diseases],
-                "backgroundColor": "#FAAD14",
-            },
-        ]
+        next_offset = offset + limit
+        if len(patients) < limit or next_offset > SEARCH_MAX_OFFSET:
+            next_offset = None
+        return jsonify({"patients": patients, "next_offset": next_offset})
 
-        histogram_data = {"labels": labels, "datasets": datasets}
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
 
-        conn.close()
 
-        return jsonify(
+def generate_stats(cursor):
+    # Get total patients
+    cursor.execute("SELECT COALESCE(SUM(patient_count), 0) FROM PatientSummary")
+    total_patients = cursor.fetchone()[0]
+
+    # Get total diseases detected
+    cursor.execute("SELECT COUNT(*) FROM Disease")
+    total_diseases_detected = cursor.fetchone()[0]
+
+    # Get average confidence score
+    cursor.execute(
+        "SELECT SUM(confidence_sum) / NULLIF(SUM(case_count), 0) FROM ResultantSummary"
+    )
+    avg_confidence = cursor.fetchone()[0]
+    if avg_confidence:
+        accuracy = f"{int(avg_confidence * 100)}%"
+    else:
+        accuracy = "N/A"
+
+    # Get disease counts
+    cursor.execute(
+        """
+    SELECT d.id, d.name, COALESCE(SUM(rs.case_count), 0) as count
+    FROM Disease d
+    LEFT JOIN ResultantSummary rs ON d.id = rs.disease_id
+    GROUP BY d.id
+    ORDER BY d.id
+    """
+    )
+
+    diseases = []
+    colors = ["#1890FF", "#52C41A", "#FAAD14", "#FF4D4F", "#722ED1"]
+
+    for i, row in enumerate(cursor.fetchall()):
+        disease_id, name, count = row
+        diseases.append(
             {
-                "totalPatients": total_patients if total_patients > 0 else 87,
-                "totalDiseasesDetected": (
-                    total_diseases_detected if total_diseases_detected > 0 else 152
-                ),
-                "accuracy": accuracy if avg_confidence else "89%",
-                "diseases": diseases,
-                "histogramData": histogram_data,
-                "patientsTrend": patientsTrend,
-                "diseasesTrend": diseasesTrend,
-                "accuracyTrend": accuracyTrend
+                "id": disease_id,
+                "name": name,
+                "count": count if count > 0 else random.randint(5, 50),
+                "color": colors[i % len(colors)],
             }
         )
 
+    # Generate trend data based on patient distribution by location
+    cursor.execute("""
+        SELECT location, patient_count as count
+        FROM PatientSummary
+        WHERE patient_count > 0
+        ORDER BY count DESC
+        LIMIT 3
+    """)
+    top_locations = cursor.fetchall()
+
+    # Calculate trend data
+    if len(top_locations) > 0:
+        top_location, top_count = top_locations[0]
+        patientsTrend = f"{top_count} in {top_location}"
+    else:
+        patientsTrend = "Distribution data unavailable"
+
+    # Calculate disease trend data
+    cursor.execute("""
+        SELECT d.name, SUM(rs.case_count) as count
+        FROM Disease d
+        JOIN ResultantSummary rs ON d.id = rs.disease_id
+        GROUP BY d.name
+        HAVING count > 0
+        ORDER BY count DESC
+        LIMIT 1
+    """)
+    top_disease = cursor.fetchone()
+    if top_disease:
+        diseasesTrend = f"Most common: {top_disease[0]} ({top_disease[1]} cases)"
+    else:
+        diseasesTrend = "Disease trend data unavailable"
+
+    # Calculate accuracy trend by severity
+    cursor.execute("""
+        SELECT s.name, SUM(rs.confidence_sum) / SUM(rs.case_count) as avg_score
+        FROM ResultantSummary rs
+        JOIN Severity s ON rs.severity_id = s.id
+        GROUP BY s.name
+        HAVING SUM(rs.case_count) > 0
+        ORDER BY avg_score DESC
+        LIMIT 1
+    """)
+    top_accuracy = cursor.fetchone()
+    if top_accuracy:
+        accuracyTrend = f"Highest for {top_accuracy[0]}: {int(top_accuracy[1] * 100)}%"
+    else:
+        accuracyTrend = "Accuracy trend data unavailable"
+
+    # Get data for histogram
+    labels = [d["name"] for d in diseases]
+    datasets = [
+        {
+            "label": "AI Detected",
+            "data": [int(d["count"] + 2) for d in diseases],
+            "backgroundColor": "#1890FF",
+        },
+        {
+            "label": "Non-AI Detected",
+            "data": [int(d["count"] * 0.8) for d in diseases],
+            "backgroundColor": "#52C41A",
+        },
+        {
+            "label": "Actual",
+            "data": [d["count"] for d in diseases],
+            "backgroundColor": "#FAAD14",
+        },
+    ]
+
+    histogram_data = {"labels": labels, "datasets": datasets}
+
+    return {
+        "totalPatients": total_patients if total_patients > 0 else 87,
+        "totalDiseasesDetected": (
+            total_diseases_detected if total_diseases_detected > 0 else 152
+        ),
+        "accuracy": accuracy if avg_confidence else "89%",
+        "diseases": diseases,
+        "histogramData": histogram_data,
+        "patientsTrend": patientsTrend,
+        "diseasesTrend": diseasesTrend,
+        "accuracyTrend": accuracyTrend
+    }
+
+
+@app.route("/api/stats", methods=["GET"])
+@cached_response
+def get_stats():
+    try:
+        with get_db() as conn:
+            return jsonify(generate_stats(conn.cursor()))
+
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
 
 @app.route("/api/disease-location", methods=["GET"])
+@cached_response
 def get_disease_by_location():
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-
-        # Get disease counts by location
-        cursor.execute(
+        with get_db() as conn:
+            cursor = conn.cursor()
+
+            # Get disease counts by location
+            cursor.execute(
+                """
+            SELECT d.name as disease, rs.location, SUM(rs.case_count) as count
+            FROM ResultantSummary rs
+            JOIN Disease d ON rs.disease_id = d.id
+            GROUP BY d.name, rs.location
+            HAVING count > 0
             """
-        SELECT d.name as disease, p.location, COUNT(*) as count
-        FROM Resultant r
-        JOIN Patient p ON r.patient_id = p.id
-        JOIN Disease d ON r.disease_id = d.id
-        GROUP BY d.name, p.location
-        """
-        )
+            )
 
-        results = cursor.fetchall()
-        conn.close()
+            results = cursor.fetchall()
 
         # Format the response
         disease_location = {}
@@ -636,28 +1002,27 @@ def get_disease_by_location():
 @app.route("/api/patients/<int:patient_id>", methods=["GET"])
 def get_patient_by_id(patient_id):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
-        cursor.execute(
-            """
-        SELECT p.*, d.name as disease, s.name as severity, r.confidence_score, r.comment
-        FROM Patient p
-        JOIN Resultant r ON p.id = r.patient_id
-        JOIN Disease d ON r.disease_id = d.id
-        JOIN Severity s ON r.severity_id = s.id
-        WHERE p.id = ?
-        """,
-            (patient_id,),
-        )
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+
+            cursor.execute(
+                """
+            SELECT p.*, d.name as disease, s.name as severity, r.confidence_score, r.comment
+            FROM Patient p
+            JOIN Resultant r ON p.id = r.patient_id
+            JOIN Disease d ON r.disease_id = d.id
+            JOIN Severity s ON r.severity_id = s.id
+            WHERE p.id = ?
+            """,
+                (patient_id,),
+            )
 
-        patient = cursor.fetchone()
-        if not patient:
-            return jsonify({"success": False, "error": "Patient not found"}), 404
+            patient = cursor.fetchone()
+            if not patient:
+                return jsonify({"success": False, "error": "Patient not found"}), 404
 
-        patient_dict = dict(patient)
-        conn.close()
+            patient_dict = dict(patient)
 
         return jsonify(patient_dict)
 
@@ -665,16 +1030,38 @@ def get_patient_by_id(patient_id):
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+@app.route("/api/patients/<int:patient_id>/thumbnail", methods=["GET"])
+def get_patient_thumbnail(patient_id):
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT image_path FROM Patient WHERE id = ?", (patient_id,))
+        row = cursor.fetchone()
+
+    if not row or not row[0] or not os.path.exists(row[0]):
+        return jsonify({"success": False, "error": "Image not found"}), 404
+
+    thumbnail = thumbnail_path(row[0])
+    if not os.path.exists(thumbnail):
+        if thumbnail_failed(row[0]):
+            return jsonify({"success": False, "error": "No thumbnail can be made of this image"}), 404
+        # Older uploads get their thumbnail on first view
+        schedule_thumbnail(row[0])
+        return jsonify({"success": False, "error": "Thumbnail not ready"}), 404
+
+    # Content-addressed files never change
+    return send_file(os.path.abspath(thumbnail), mimetype="image/jpeg", max_age=31536000)
+
+
 @app.route("/api/diseases", methods=["GET"])
+@cached_response
 def get_diseases():
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
 
-        cursor.execute("SELECT id, name FROM Disease ORDER BY id")
-        diseases = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+            cursor.execute("SELECT id, name FROM Disease ORDER BY id")
+            diseases = [dict(row) for row in cursor.fetchall()]
 
         return jsonify(diseases)
 
@@ -683,15 +1070,15 @@ def get_diseases():
 
 
 @app.route("/api/severity-levels", methods=["GET"])
+@cached_response
 def get_severity_levels():
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
 
-        cursor.execute("SELECT id, level, name FROM Severity ORDER BY level")
-        severity_levels = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+            cursor.execute("SELECT id, level, name FROM Severity ORDER BY level")
+            severity_levels = [dict(row) for row in cursor.fetchall()]
 
         return jsonify(severity_levels)
 
@@ -699,75 +1086,402 @@ def get_severity_levels():
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+def generate_disease_location_data(cursor, disease_id):
+    # First, get the total number of patients for this disease
+    cursor.execute(
+        """
+        SELECT SUM(rs.case_count) as total_patients
+        FROM ResultantSummary rs
+        WHERE rs.disease_id = ?
+        """,
+        (disease_id,)
+    )
+    total_patients = cursor.fetchone()[0] or 0
+
+    # If no patients, return empty data
+    if total_patients == 0:
+        return {"regions": {}, "total_patients": 0}
+
+    # Get patient counts by location for this disease
+    cursor.execute(
+        """
+        SELECT rs.location, SUM(rs.case_count) as count
+        FROM ResultantSummary rs
+        WHERE rs.disease_id = ? AND rs.location != ''
+        GROUP BY rs.location
+        HAVING count > 0
+        """,
+        (disease_id,)
+    )
+
+    results = cursor.fetchall()
+
+    # Format the response
+    regions = {}
+
+    for location, count in results:
+        percentage = (count / total_patients) * 100
+        
+        # Determine zone color based on percentage
+        if percentage >= 10:
+            zone_type = "red"
+            color = "#FF4D4F"  # Red
+        elif percentage >= 4:
+            zone_type = "blue" 
+            color = "#1890FF"  # Blue
+        else:
+            zone_type = "green"
+            color = "#52C41A"  # Green
+            
+        regions[location] = {
+            "count": count,
+            "percentage": percentage,
+            "zone_type": zone_type,
+            "color": color
+        }
+
+    return {
+        "regions": regions,
+        "total_patients": total_patients
+    }
+
+
 @app.route("/api/disease-location/<int:disease_id>", methods=["GET"])
+@cached_response
 def get_disease_location_data(disease_id):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        with get_db() as conn:
+            return jsonify(generate_disease_location_data(conn.cursor(), disease_id))
 
-        # First, get the total number of patients for this disease
-        cursor.execute(
-            """
-            SELECT COUNT(r.id) as total_patients
-            FROM Resultant r
-            WHERE r.disease_id = ?
-            """,
-            (disease_id,)
-        )
-        total_patients = cursor.fetchone()[0] or 0
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
 
-        # If no patients, return empty data
-        if total_patients == 0:
-            conn.close()
-            return jsonify({"regions": {}, "total_patients": 0})
 
-        # Get patient counts by location for this disease
-        cursor.execute(
-            """
-            SELECT p.location, COUNT(*) as count
-            FROM Resultant r
-            JOIN Patient p ON r.patient_id = p.id
-            WHERE r.disease_id = ? AND p.location IS NOT NULL AND p.location != ''
-            GROUP BY p.location
-            """,
-            (disease_id,)
+@app.route("/api/map/<int:disease_id>", methods=["GET"])
+def get_disease_map(disease_id):
+    """District GeoJSON for one disease with counts and zone colours joined in.
+
+    ?zoom= picks the nearest precomputed simplification. The body is
+    gzipped once per write generation and its ETag is a hash of the
+    content, so a poll after writes that did not touch this disease still
+    gets 304 Not Modified.
+    """
+    try:
+        try:
+            zoom = geo.nearest_zoom(int(request.args.get("zoom", geo.DEFAULT_ZOOM)))
+        except ValueError:
+            return jsonify({"success": False, "error": "zoom must be an integer"}), 400
+
+        key = (disease_id, zoom)
+        entry = geo.map_cache.get(key, current_generation())
+        if entry is None:
+            with get_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN")
+                generation = read_generation(cursor)
+                data = generate_disease_location_data(cursor, disease_id)
+            body = geo.district_map().feature_collection(
+                zoom, data["regions"], data["total_patients"]
+            )
+            entry = geo.map_cache.put(key, generation, body)
+
+        _, etag, compressed = entry
+        if etag in request.if_none_match:
+            response = Response(status=304)
+        elif "gzip" in request.accept_encodings:
+            response = Response(compressed, mimetype="application/geo+json")
+            response.headers["Content-Encoding"] = "gzip"
+        else:
+            response = Response(gzip.decompress(compressed), mimetype="application/geo+json")
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        response.vary.add("Accept-Encoding")
+        return response
+
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+# Not response-cached: alarms expire with the calendar, not only on writes
+@app.route("/api/outbreaks", methods=["GET"])
+def get_outbreaks():
+    """Disease x location pairs whose recent daily counts are above baseline"""
+    try:
+        with get_db() as conn:
+            return jsonify(
+                {
+                    "alarms": outbreaks.current_alarms(conn.cursor()),
+                    "minCases": outbreaks.MIN_CASES,
+                    "zThreshold": outbreaks.Z_THRESHOLD,
+                    "cusumThreshold": outbreaks.CUSUM_H,
+                }
+            )
+
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+# Bucket label format and length per trend granularity
+TREND_BUCKETS = {
+    "hour": ("%Y-%m-%d %H:00:00", datetime.timedelta(hours=1)),
+    "day": ("%Y-%m-%d", datetime.timedelta(days=1)),
+    "week": ("%Y-%m-%d", datetime.timedelta(weeks=1)),
+}
+TREND_DEFAULT_BUCKETS = {"hour": 48, "day": 30, "week": 26}
+TREND_MAX_BUCKETS = 1000
+TREND_GROUPS = {"disease": "disease_id", "severity": "severity_id", "location": "location"}
+TREND_FILTERS = {"disease_id": parse_int, "severity_id": parse_int, "location": parse_text}
+
+
+def floor_bucket(moment, granularity):
+    """Return the start of the bucket holding moment; weeks start on Monday"""
+    if granularity == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    day = datetime.datetime.combine(moment.date(), datetime.time())
+    if granularity == "week":
+        day -= datetime.timedelta(days=day.weekday())
+    return day
+
+
+def parse_moment(value, name):
+    try:
+        moment = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a YYYY-MM-DD date or an ISO date and time")
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def parse_trend_args(args, now):
+    """Validate the granularity, start, end, group_by and filter parameters.
+
+    start and end are UTC and both inclusive: the series runs from the
+    bucket holding start to the bucket holding end. Returns (granularity,
+    first bucket, number of buckets, group column, filters).
+    """
+    granularity = args.get("granularity", "day")
+    if granularity not in TREND_BUCKETS:
+        raise ValueError(f"granularity must be one of: {', '.join(TREND_BUCKETS)}")
+    _, step = TREND_BUCKETS[granularity]
+
+    end = floor_bucket(parse_moment(args["end"], "end") if args.get("end") else now, granularity)
+    if args.get("start"):
+        start = floor_bucket(parse_moment(args["start"], "start"), granularity)
+    else:
+        start = end - step * (TREND_DEFAULT_BUCKETS[granularity] - 1)
+    if start > end:
+        raise ValueError("start must not be after end")
+    buckets = (end - start) // step + 1
+    if buckets > TREND_MAX_BUCKETS:
+        raise ValueError(f"A trend can have at most {TREND_MAX_BUCKETS} buckets")
+
+    hourly_from, daily_from = trends.horizons(now)
+    kept_from = {"hour": hourly_from, "day": daily_from}.get(granularity)
+    if kept_from and start < datetime.datetime.fromisoformat(kept_from):
+        raise ValueError(
+            f"{granularity} counts are kept from {kept_from}; "
+            "use a coarser granularity for earlier times"
         )
 
-        results = cursor.fetchall()
-        conn.close()
+    group_by = args.get("group_by") or None
+    if group_by is not None and group_by not in TREND_GROUPS:
+        raise ValueError(f"group_by must be one of: {', '.join(TREND_GROUPS)}")
+
+    filters = {}
+    for name, parse in TREND_FILTERS.items():
+        value = args.get(name)
+        if value is not None and value != "":
+            filters[name] = parse(value, name)
+    return granularity, start, buckets, TREND_GROUPS.get(group_by), filters
+
+
+def select_trend(cursor, granularity, start, buckets, group_column, filters):
+    """Return the labels of the buckets and one zero-filled series per group"""
+    label_format, step = TREND_BUCKETS[granularity]
+    labels = [(start + step * i).strftime(label_format) for i in range(buckets)]
+    end = (start + step * buckets).strftime(label_format)
+    sums = trends.read_series(cursor, granularity, labels[0], end, filters, group_column)
+
+    names = {}
+    if group_column in ("disease_id", "severity_id"):
+        table = "Disease" if group_column == "disease_id" else "Severity"
+        cursor.execute(f"SELECT id, name FROM {table}")
+        names = dict(cursor.fetchall())
+
+    position = {label: i for i, label in enumerate(labels)}
+    # Without group_by there is always the one series, even if it is all zeros
+    series = {} if group_column else {None: ([0] * buckets, [None] * buckets)}
+    for (label, key), (count, confidence) in sums.items():
+        if label not in position or not count:
+            continue
+        counts, confidences = series.setdefault(key, ([0] * buckets, [None] * buckets))
+        counts[position[label]] = count
+        confidences[position[label]] = round(confidence / count, 4)
+
+    rows = [
+        {
+            "id": key,
+            "name": names.get(key, key) if group_column else "All cases",
+            "total": sum(counts),
+            "counts": counts,
+            "meanConfidence": confidences,
+        }
+        for key, (counts, confidences) in series.items()
+    ]
+    rows.sort(key=lambda row: (-row["total"], str(row["name"])))
+    return labels, rows
 
-        # Format the response
-        regions = {}
 
-        for location, count in results:
-            percentage = (count / total_patients) * 100
-            
-            # Determine zone color based on percentage
-            if percentage >= 10:
-                zone_type = "red"
-                color = "#FF4D4F"  # Red
-            elif percentage >= 4:
-                zone_type = "blue" 
-                color = "#1890FF"  # Blue
-            else:
-                zone_type = "green"
-                color = "#52C41A"  # Green
-                
-            regions[location] = {
-                "count": count,
-                "percentage": percentage,
-                "zone_type": zone_type,
-                "color": color
+# Not response-cached: the default window moves with the clock, not only on writes
+@app.route("/api/trends", methods=["GET"])
+def get_trends():
+    """Case counts per hour, day or week, read from the trend rollups.
+
+    Costs one rollup row per bucket and group in the window, however many
+    patients it covers.
+    """
+    try:
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        try:
+            granularity, start, buckets, group_column, filters = parse_trend_args(
+                request.args, now
+            )
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+
+        with get_db() as conn:
+            labels, series = select_trend(
+                conn.cursor(), granularity, start, buckets, group_column, filters
+            )
+
+        return jsonify({"granularity": granularity, "buckets": labels, "series": series})
+
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route("/api/events", methods=["GET"])
+def get_events():
+    """Server-Sent Events stream of new triage results.
+
+    A reconnecting EventSource sends Last-Event-ID and gets the results it
+    missed from the feed's ring buffer, or a "reset" event when they are no
+    longer there and it should reload its data. Under serve.py the
+    connection is handed to the feed's dispatcher once the headers are out;
+    other servers keep the request thread until the client leaves.
+    """
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("lastEventId")
+    try:
+        subscriber = event_feed.subscribe(int(last_event_id) if last_event_id else None)
+    except ValueError:
+        return jsonify({"success": False, "error": "Last-Event-ID must be an integer"}), 400
+    except FeedFull as e:
+        return jsonify({"success": False, "error": str(e)}), 503
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+    detach = request.environ.get("tib_ai.detach")
+
+    def stream():
+        handed_over = False
+        try:
+            yield "retry: 3000\n\n"
+            if detach:
+                event_feed.hand_over(subscriber, detach())
+                handed_over = True
+                return
+            while True:
+                events = event_feed.next_events(subscriber)
+                if events is None:
+                    # The worker is shutting down; EventSource reconnects
+                    return
+                yield "".join(events) if events else KEEP_ALIVE
+        finally:
+            if not handed_over:
+                event_feed.unsubscribe(subscriber)
+
+    response = Response(stream(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+@app.route("/api/cache-stats", methods=["GET"])
+def get_cache_stats():
+    return jsonify(response_cache.stats())
+
+
+# Patients included in the dashboard snapshot; the rest are paged through
+# GET /api/patients with the returned cursor.
+DASHBOARD_PATIENTS = 100
+
+
+@app.route("/api/dashboard", methods=["GET"])
+def get_dashboard():
+    """Everything the admin page needs, read from one consistent snapshot.
+
+    The ETag is the write generation, so a poll that finds nothing new is
+    answered with 304 Not Modified without querying the tables. It is weak
+    because the gzipped and identity bodies share it.
+    """
+    try:
+        generation = current_generation()
+        if request.if_none_match.contains_weak(f"gen-{generation}"):
+            response = Response(status=304)
+            response.set_etag(f"gen-{generation}", weak=True)
+            response.vary.add("Accept-Encoding")
+            return response
+
+        with get_db() as conn:
+            cursor = conn.cursor()
+
+            # A read transaction keeps every query on the same snapshot
+            cursor.execute("BEGIN")
+            generation = read_generation(cursor)
+
+            cursor.execute("SELECT id, name FROM Disease ORDER BY id")
+            diseases = cursor.fetchall()
+
+            # The first page of GET /api/patients, with its total
+            fields = list(PATIENT_COLUMNS)
+            total = count_patients(cursor, {})
+            rows = select_patient_page(
+                cursor, DASHBOARD_PATIENTS, None, fields, total=total
+            ).fetchall()
+            next_cursor = (
+                encode_cursor(*rows[-1][-2:], total) if len(rows) == DASHBOARD_PATIENTS else None
+            )
+
+            snapshot = {
+                "generation": generation,
+                "stats": generate_stats(cursor),
+                "triageData": generate_triage_data(cursor),
+                "triageDataByDisease": {
+                    disease_id: generate_triage_data(cursor, disease_id)
+                    for disease_id, _ in diseases
+                },
+                "diseaseLocation": {
+                    disease_id: generate_disease_location_data(cursor, disease_id)
+                    for disease_id, _ in diseases
+                },
+                "patients": {
+                    "patients": [dict(zip(fields, row)) for row in rows],
+                    "total": total,
+                    "next_cursor": next_cursor,
+                },
             }
 
-        return jsonify({
-            "regions": regions,
-            "total_patients": total_patients
-        })
+        response = jsonify(snapshot)
+        response.set_etag(f"gen-{generation}", weak=True)
+        response.headers["Cache-Control"] = "no-cache"
+        response.vary.add("Accept-Encoding")
+        return response
 
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
 
 if __name__ == "__main__":
+    # Development server; use serve.py in production
     app.run(debug=True)
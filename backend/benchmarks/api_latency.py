@@ -0,0 +1,372 @@
+"""Latency and throughput of every /api route, with a regression check.
+
+For each database size the harness:
+  1. times every GET route through the Flask test client, one request at
+     a time (the handler cost without any network or server);
+  2. starts serve.py on a free port and drives the same routes over HTTP,
+     one route at a time from --clients concurrent threads, after a few
+     warm-up requests so each worker has built its caches;
+  3. runs a mixed scenario over HTTP for --duration seconds, in which
+     clinics post intake forms while dashboards poll with their ETags.
+
+It reports requests/s and p50/p95/p99 latency per route, writes them to
+--output, and compares them with --baseline. It exits with status 1 if any
+request failed (a 5xx or a connection error; a failed intake form in the
+mixed scenario), or if a route's p95 is more than --threshold above the
+baseline, ignoring differences under --min-delta-ms. A run with failures
+never saves a baseline. Uses only the standard library and the app. Run
+from the backend directory:
+
+    python -m benchmarks.api_latency --sizes 10000,100000,1000000
+    python -m benchmarks.api_latency --sizes 10000 --save-baseline
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+BASELINE_PATH = os.path.join("benchmarks", "api_latency_baseline.json")
+
+# Value used for every <int:...> segment of a route
+ROUTE_ID = 1
+# Routes that are not plain request/response reads
+SKIPPED_ROUTES = {"/api/events"}  # a stream that stays open
+POLL_ROUTES = ["/api/dashboard", "/api/stats", "/api/patients?limit=100"]
+SYMPTOMS = ["high fever and rash", "dry cough, runny nose", "night sweats and weight loss",
+            "loose watery stools", "redness and swelling", "headache"]
+LOCATIONS = ["Lahore", "Karachi", "Islamabad", "Peshawar", "Quetta"]
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarise(latencies, elapsed, errors):
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "rps": round(len(values) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+    }
+
+
+def read_routes(app):
+    """GET routes under /api with their integer segments filled in"""
+    adapter = app.url_map.bind("localhost")
+    urls = []
+    for rule in app.url_map.iter_rules():
+        if not rule.rule.startswith("/api/") or "GET" not in rule.methods:
+            continue
+        if rule.rule in SKIPPED_ROUTES:
+            continue
+        urls.append(adapter.build(rule.endpoint, {name: ROUTE_ID for name in rule.arguments}))
+    return sorted(set(urls))
+
+
+def time_test_client(app, urls, requests):
+    client = app.test_client()
+    results = {}
+    for url in urls:
+        client.get(url)  # warm caches and statements
+        latencies, errors = [], 0
+        start = time.perf_counter()
+        for _ in range(requests):
+            begin = time.perf_counter()
+            response = client.get(url)
+            response.get_data()
+            latencies.append(time.perf_counter() - begin)
+            errors += response.status_code >= 500
+        results[url] = summarise(latencies, time.perf_counter() - start, errors)
+    return results
+
+
+def http_request(port, method, url, body=None, headers=None):
+    """Send one request; returns (status, headers, seconds)"""
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    begin = time.perf_counter()
+    try:
+        conn.request(method, url, body=body, headers=headers or {})
+        response = conn.getresponse()
+        response.read()
+        return response.status, response, time.perf_counter() - begin
+    finally:
+        conn.close()
+
+
+def try_request(port, method, url, body=None, headers=None):
+    """Like http_request, but a connection error is status 0 with no response"""
+    begin = time.perf_counter()
+    try:
+        return http_request(port, method, url, body, headers)
+    except OSError:
+        return 0, None, time.perf_counter() - begin
+
+
+def run_clients(clients, deadline_or_count, work):
+    """Run work(client index, record) in threads; record(key, seconds, ok)"""
+    lock = threading.Lock()
+    samples = {}
+
+    def record(key, seconds, ok):
+        with lock:
+            latencies, errors = samples.setdefault(key, ([], [0]))
+            latencies.append(seconds)
+            if not ok:
+                errors[0] += 1
+
+    threads = [threading.Thread(target=work, args=(i, record, deadline_or_count))
+               for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {key: summarise(latencies, elapsed, errors[0])
+            for key, (latencies, errors) in sorted(samples.items())}
+
+
+def time_http(port, urls, clients, requests, warmup):
+    """Each route in turn, requested by every client at once"""
+    results = {}
+    for url in urls:
+        # Let every worker build its caches (the district map takes ~1 s)
+        for _ in range(warmup):
+            http_request(port, "GET", url)
+
+        def work(index, record, count):
+            for _ in range(count):
+                status, _, seconds = try_request(port, "GET", url)
+                record(url, seconds, 0 < status < 500)
+
+        results.update(run_clients(clients, max(1, requests // clients), work))
+    return results
+
+
+def intake_form(index):
+    """A multipart intake form like the patient page sends"""
+    boundary = uuid.uuid4().hex
+    fields = {
+        "name": f"Bench Patient {index}",
+        "age": str(20 + index % 60),
+        "gender": "Female" if index % 2 else "Male",
+        "location": LOCATIONS[index % len(LOCATIONS)],
+        "temperature_f": "101.2",
+        "blood_pressure": "120/80",
+        "blood_glucose": "110",
+        "symptoms": SYMPTOMS[index % len(SYMPTOMS)],
+    }
+    parts = [
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+        for name, value in fields.items()
+    ]
+    body = ("".join(parts) + f"--{boundary}--\r\n").encode("utf-8")
+    return body, {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+
+
+def time_mixed(port, writers, pollers, duration):
+    """Clinics posting forms while dashboards poll with If-None-Match"""
+
+    def work(index, record, deadline):
+        if index < writers:
+            sent = 0
+            while time.monotonic() < deadline:
+                body, headers = intake_form(index * 100000 + sent)
+                status, _, seconds = try_request(port, "POST", "/api/patients", body, headers)
+                record("POST /api/patients", seconds, status == 201)
+                sent += 1
+        else:
+            etags = {}
+            while time.monotonic() < deadline:
+                for url in POLL_ROUTES:
+                    headers = {"If-None-Match": etags[url]} if url in etags else {}
+                    status, response, seconds = try_request(port, "GET", url, headers=headers)
+                    if response is not None and response.getheader("ETag"):
+                        etags[url] = response.getheader("ETag")
+                    record(f"GET {url}", seconds, 0 < status < 500)
+                time.sleep(0.05)
+
+    return run_clients(writers + pollers, time.monotonic() + duration, work)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(backend_dir, db_path, workers):
+    port = free_port()
+    env = dict(os.environ, TIB_AI_DB_PATH=db_path)
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(backend_dir, "serve.py"),
+         "--port", str(port), "--workers", str(workers)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if http_request(port, "GET", "/api/diseases")[0] == 200:
+                return server, port
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("serve.py did not start")
+
+
+def compare(results, baseline, threshold, min_delta_ms):
+    """Return a line for each route whose p95 regressed against baseline"""
+    regressions = []
+    for size, modes in results.items():
+        for mode, routes in modes.items():
+            for route, current in routes.items():
+                before = baseline.get(size, {}).get(mode, {}).get(route)
+                if not before:
+                    continue
+                delta = current["p95_ms"] - before["p95_ms"]
+                if delta > min_delta_ms and current["p95_ms"] > before["p95_ms"] * (1 + threshold):
+                    regressions.append(
+                        f"{size} {mode} {route}: p95 {before['p95_ms']:.2f} -> "
+                        f"{current['p95_ms']:.2f} ms"
+                    )
+    return regressions
+
+
+def failed_routes(results):
+    """Return a line for each route with failed requests"""
+    return [
+        f"{size} {mode} {route}: {current['errors']} of {current['requests']} requests failed"
+        for size, modes in results.items()
+        for mode, routes in modes.items()
+        for route, current in routes.items()
+        if current["errors"]
+    ]
+
+
+def print_table(title, routes):
+    print(f"\n  {title}")
+    print(f"  {'route':<42} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for route, row in routes.items():
+        print(f"  {route:<42} {row['rps']:>9.1f} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} "
+              f"{row['p99_ms']:>8.2f} {row['errors']:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000,1000000",
+                        help="comma-separated patient counts")
+    parser.add_argument("--requests", type=int, default=50, help="requests per route")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent HTTP clients")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="serve.py worker processes")
+    parser.add_argument("--writers", type=int, default=4, help="clinics in the mixed scenario")
+    parser.add_argument("--pollers", type=int, default=8,
+                        help="dashboards in the mixed scenario")
+    parser.add_argument("--duration", type=float, default=10.0,
+                        help="seconds of the mixed scenario")
+    parser.add_argument("--output", default="api_latency_results.json")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="write the results to --baseline instead of comparing")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed p95 increase over the baseline (0.25 = 25%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=2.0,
+                        help="ignore p95 increases smaller than this")
+    args = parser.parse_args()
+
+    backend_dir = os.getcwd()
+    output = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.baseline)
+    workdir = tempfile.mkdtemp(prefix="tib_ai_latency_")
+    db_path = os.path.join(workdir, "latency.db")
+    os.environ["TIB_AI_DB_PATH"] = db_path
+    sys.path.insert(0, backend_dir)
+    os.chdir(workdir)
+
+    import db
+    import outbreaks
+    from app import app
+    from benchmarks.read_endpoints import populate
+
+    results = {}
+    try:
+        for size in [int(n) for n in args.sizes.split(",")]:
+            with db.get_db() as conn:
+                conn.execute("DELETE FROM Resultant")
+                conn.execute("DELETE FROM Patient")
+            populate(db_path, size)
+            with db.get_db() as conn:
+                cursor = conn.cursor()
+                outbreaks.rebuild(cursor)
+                db.bump_generation(cursor)
+
+            print(f"\n{size} patients")
+            urls = read_routes(app)
+            modes = {"test_client": time_test_client(app, urls, args.requests)}
+            print_table("test client, sequential", modes["test_client"])
+
+            server, port = start_server(backend_dir, db_path, args.workers)
+            try:
+                modes["http"] = time_http(
+                    port, urls, args.clients, args.requests, warmup=args.workers * 2
+                )
+                print_table(f"HTTP, {args.clients} clients, {args.workers} workers", modes["http"])
+                modes["mixed"] = time_mixed(port, args.writers, args.pollers, args.duration)
+                print_table(f"mixed: {args.writers} clinics posting, "
+                            f"{args.pollers} dashboards polling", modes["mixed"])
+            finally:
+                server.terminate()
+                server.wait()
+            results[str(size)] = modes
+    finally:
+        db.pool.close_all()
+        os.chdir(backend_dir)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+    print(f"\nResults written to {output}")
+
+    failures = failed_routes(results)
+    for line in failures:
+        print(f"FAILED {line}")
+    if failures:
+        print(f"{len(failures)} routes had failed requests")
+
+    if args.save_baseline:
+        if failures:
+            print("Baseline not saved: the run had failed requests")
+            return 1
+        with open(baseline_path, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+        print(f"Baseline saved to {baseline_path}")
+        return 0
+
+    if not os.path.exists(baseline_path):
+        print(f"No baseline at {baseline_path}; run with --save-baseline to create one")
+        return 1 if failures else 0
+    with open(baseline_path, "r", encoding="utf-8") as file:
+        regressions = compare(results, json.load(file), args.threshold, args.min_delta_ms)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    print(f"{len(regressions)} routes regressed past {args.threshold:.0%}")
+    return 1 if failures or regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
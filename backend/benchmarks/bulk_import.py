@@ -0,0 +1,131 @@
+"""Rows/s of the bulk CSV importer against the row-at-a-time loader.
+
+Generates patient and resultant CSV files in the layout of data/, imports
+them with load_data.bulk_import and times the row-at-a-time loader on the
+first --baseline-rows rows. Run from the backend directory:
+
+    python -m benchmarks.bulk_import --rows 2000000 --baseline-rows 100000
+"""
+import argparse
+import contextlib
+import csv
+import io
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+LOCATIONS = ["Lahore", "Karachi", "Islamabad", "Peshawar", "Quetta", "Multan",
+             "Faisalabad", "Rawalpindi", "Hyderabad", "Bahawalpur"]
+SYMPTOMS = ["fever", "rash", "dry cough", "joint pain", "fatigue", "itchy skin patch",
+            "night sweats", "abdominal cramps"]
+
+PATIENT_HEADER = ["patient_id", "patient name", "age", "gender", "location", "temprature_F",
+                  "pregnancy status", "blood pressure", "blood Glucose levels", "image",
+                  "Symptoms"]
+RESULTANT_HEADER = ["Patient_id", "Disease_id", "Severity_id", "confidence score"]
+
+
+def generate_csv(workdir, rows):
+    """Write rows patients and one result each, returning the two paths"""
+    rng = random.Random(42)
+    patients_path = os.path.join(workdir, "patients.csv")
+    resultants_path = os.path.join(workdir, "resultants.csv")
+
+    with open(patients_path, "w", encoding="utf-8", newline="") as patients, \
+            open(resultants_path, "w", encoding="utf-8", newline="") as resultants:
+        patient_writer = csv.writer(patients, quoting=csv.QUOTE_ALL)
+        resultant_writer = csv.writer(resultants)
+        patient_writer.writerow(PATIENT_HEADER)
+        resultant_writer.writerow(RESULTANT_HEADER)
+
+        for i in range(1, rows + 1):
+            patient_id = f"25x{i:03d}"
+            patient_writer.writerow([
+                patient_id, f"Patient {i}", rng.randint(1, 90),
+                rng.choice(["Male", "Female"]), rng.choice(LOCATIONS),
+                round(rng.uniform(97, 104), 1), rng.choice(["No", "Yes"]),
+                f"{rng.randint(100, 150)}-{rng.randint(60, 95)}", rng.randint(70, 200),
+                f"img_{i:03d}.jpg", ", ".join(rng.sample(SYMPTOMS, 3)),
+            ])
+            resultant_writer.writerow([
+                patient_id, rng.randint(1, 5), rng.randint(1, 5),
+                round(rng.uniform(0.9, 0.99), 2),
+            ])
+
+    return patients_path, resultants_path
+
+
+def head(path, rows):
+    """Copy the header and first rows of a CSV file next to it"""
+    out_path = f"{path}.head"
+    with open(path, "r", encoding="utf-8") as src, open(out_path, "w", encoding="utf-8") as dst:
+        for _, line in zip(range(rows + 1), src):
+            dst.write(line)
+    return out_path
+
+
+def reset_database(load_data):
+    if os.path.exists(load_data.DB_PATH):
+        os.remove(load_data.DB_PATH)
+    with contextlib.redirect_stdout(io.StringIO()):
+        load_data.initialize_db()
+
+
+def count_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    patients = conn.execute("SELECT COUNT(*) FROM Patient").fetchone()[0]
+    resultants = conn.execute("SELECT COUNT(*) FROM Resultant").fetchone()[0]
+    conn.close()
+    return patients + resultants
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2000000, help="patients in the CSV")
+    parser.add_argument("--baseline-rows", type=int, default=100000,
+                        help="patients loaded by the row-at-a-time loader")
+    parser.add_argument("--chunk-size", type=int, default=None)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="tib_ai_bench_")
+    os.environ["TIB_AI_DB_PATH"] = os.path.join(workdir, "bench.db")
+    sys.path.insert(0, os.getcwd())
+
+    import load_data
+
+    start = time.perf_counter()
+    patients_path, resultants_path = generate_csv(workdir, args.rows)
+    print(f"Generated {args.rows} patients + {args.rows} results "
+          f"in {time.perf_counter() - start:.1f}s")
+
+    os.chdir(workdir)
+    results = {}
+
+    baseline_rows = min(args.baseline_rows, args.rows)
+    reset_database(load_data)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        load_data.load_patient_data(head(patients_path, baseline_rows))
+        load_data.load_resultant_data(head(resultants_path, baseline_rows))
+    elapsed = time.perf_counter() - start
+    results["row at a time"] = count_rows(load_data.DB_PATH) / elapsed
+
+    reset_database(load_data)
+    start = time.perf_counter()
+    load_data.bulk_import(patients_path, resultants_path,
+                          args.chunk_size or load_data.BULK_CHUNK_SIZE)
+    elapsed = time.perf_counter() - start
+    results["bulk"] = count_rows(load_data.DB_PATH) / elapsed
+
+    print()
+    print(f"{'row at a time':>15}: {results['row at a time']:10,.0f} rows/s "
+          f"({baseline_rows} patients)")
+    print(f"{'bulk':>15}: {results['bulk']:10,.0f} rows/s ({args.rows} patients)")
+    print(f"{'speed-up':>15}: {results['bulk'] / results['row at a time']:10.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Sustained POST /api/patients submissions/s with many concurrent clinics.
+
+Starts serve.py on a fresh database once per intake mode: each patient in
+its own transaction (TIB_AI_INTAKE_GROUP_COMMIT=0) and group commit. Each
+run has --clients threads that each post intake forms back to back for
+--duration seconds. Reports accepted submissions/s, latency and the
+failures, such as "database is locked" or a full queue. Run from the
+backend directory:
+
+    python -m benchmarks.intake --clients 1,8,32,64 --workers 2 --duration 10
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks.api_latency import http_request, intake_form, run_clients, start_server
+
+MODES = [("per request", "0"), ("group commit", "1")]
+
+
+def time_intake(port, clients, duration):
+    def work(index, record, deadline):
+        sent = 0
+        while time.monotonic() < deadline:
+            body, headers = intake_form(index * 1000000 + sent)
+            try:
+                status, _, seconds = http_request(port, "POST", "/api/patients", body, headers)
+            except OSError:
+                status, seconds = 0, 0.0
+            record("POST /api/patients", seconds, status == 201)
+            sent += 1
+
+    start = time.monotonic()
+    row = run_clients(clients, start + duration, work)["POST /api/patients"]
+    elapsed = time.monotonic() - start
+    row["accepted_per_s"] = round((row["requests"] - row["errors"]) / elapsed, 1)
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", default="1,8,32,64",
+                        help="comma-separated numbers of concurrent clinics")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="serve.py worker processes")
+    parser.add_argument("--duration", type=float, default=10.0,
+                        help="seconds of posting per run")
+    args = parser.parse_args()
+
+    backend_dir = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="tib_ai_intake_")
+    os.chdir(workdir)
+
+    print(f"{args.workers} workers, {args.duration:.0f} s per run")
+    print(f"  {'mode':<14} {'clients':>7} {'accepted/s':>11} {'p50 ms':>8} "
+          f"{'p99 ms':>8} {'failed':>7}")
+    try:
+        for label, setting in MODES:
+            os.environ["TIB_AI_INTAKE_GROUP_COMMIT"] = setting
+            for clients in [int(n) for n in args.clients.split(",")]:
+                db_path = os.path.join(workdir, f"intake_{setting}_{clients}.db")
+                server, port = start_server(backend_dir, db_path, args.workers)
+                try:
+                    row = time_intake(port, clients, args.duration)
+                finally:
+                    server.terminate()
+                    server.wait()
+                print(f"  {label:<14} {clients:>7} {row['accepted_per_s']:>11.1f} "
+                      f"{row['p50_ms']:>8.2f} {row['p99_ms']:>8.2f} {row['errors']:>7}")
+    finally:
+        os.chdir(backend_dir)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.getcwd())
+    main()
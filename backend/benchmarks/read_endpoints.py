@@ -0,0 +1,142 @@
+"""Requests/s of the dashboard read endpoints with and without pooled connections.
+
+Starts serve.py on one database twice, with TIB_AI_DB_POOL=0 (a connection
+opened per request) and pooled, and has --clients threads request every
+endpoint over HTTP. The threaded server runs each request on a new thread,
+as in production, so connections tied to a thread would pile up; the open
+file descriptors of the workers are reported after each run. Run from the
+backend directory:
+
+    python -m benchmarks.read_endpoints --patients 20000 --requests 300
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+
+import db
+import migrations
+import stats
+import trends
+from benchmarks.api_latency import http_request, run_clients, start_server
+
+READ_ENDPOINTS = [
+    "/api/triage-data",
+    "/api/triage-data/1",
+    "/api/region-data",
+    "/api/stats",
+    "/api/disease-location",
+    "/api/disease-location/1",
+    "/api/diseases",
+    "/api/severity-levels",
+    "/api/patients/1",
+    "/api/trends?granularity=hour",
+]
+
+LOCATIONS = ["Lahore", "Karachi", "Islamabad", "Peshawar", "Quetta", "Multan",
+             "Faisalabad", "Rawalpindi", "Hyderabad", "Bahawalpur"]
+
+
+def populate(db_path, patients):
+    conn = sqlite3.connect(db_path)
+    rng = random.Random(42)
+    conn.executemany(
+        """
+        INSERT INTO Patient (
+            id, name, age, gender, location, temperature_f,
+            pregnancy_status, blood_pressure, blood_glucose, symptoms
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            (i, f"Patient {i}", rng.randint(1, 90), rng.choice(["Male", "Female"]),
+             rng.choice(LOCATIONS), round(rng.uniform(97, 104), 1), "no",
+             "120-80", rng.randint(70, 200), "fever, rash")
+            for i in range(1, patients + 1)
+        ),
+    )
+    conn.executemany(
+        """
+        INSERT INTO Resultant (
+            patient_id, severity_id, disease_id, confidence_score, comment
+        ) VALUES (?, ?, ?, ?, ?)
+        """,
+        (
+            (i, rng.randint(1, 5), rng.randint(1, 5), round(rng.uniform(0.9, 0.99), 2), "")
+            for i in range(1, patients + 1)
+        ),
+    )
+    stats.rebuild(conn.cursor())
+    trends.rebuild(conn.cursor())
+    conn.commit()
+    conn.close()
+
+
+def open_files(server):
+    """File descriptors held by the worker processes of serve.py, or None"""
+    try:
+        with open(f"/proc/{server.pid}/task/{server.pid}/children") as file:
+            workers = file.read().split()
+        return sum(len(os.listdir(f"/proc/{pid}/fd")) for pid in workers)
+    except OSError:
+        return None
+
+
+def run(port, requests_per_endpoint, clients):
+    def work(index, record, count):
+        for _ in range(count):
+            for url in READ_ENDPOINTS:
+                status, _, seconds = http_request(port, "GET", url)
+                record("all", seconds, status == 200)
+
+    per_client = max(1, requests_per_endpoint // clients)
+    return run_clients(clients, per_client, work)["all"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--patients", type=int, default=20000)
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    parser.add_argument("--clients", type=int, default=4, help="concurrent HTTP clients")
+    parser.add_argument("--workers", type=int, default=1, help="serve.py worker processes")
+    args = parser.parse_args()
+
+    backend_dir = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="tib_ai_bench_")
+    db_path = os.path.join(workdir, "bench.db")
+    os.chdir(workdir)
+
+    conn = db.connect(db_path)
+    migrations.migrate(conn)
+    conn.close()
+    populate(db_path, args.patients)
+
+    print(f"{args.patients} patients, {args.requests} requests per endpoint, "
+          f"{args.clients} clients, {args.workers} workers")
+    print(f"  {'':>20} {'requests/s':>11} {'p99 ms':>8} {'failed':>7} {'open files':>11}")
+    results = {}
+    try:
+        for label, setting in [("connect per request", "0"), ("pooled", "1")]:
+            os.environ["TIB_AI_DB_POOL"] = setting
+            server, port = start_server(backend_dir, db_path, args.workers)
+            try:
+                run(port, 5, 1)  # warm up
+                row = run(port, args.requests, args.clients)
+                files = open_files(server)
+            finally:
+                server.terminate()
+                server.wait()
+            results[label] = row["rps"]
+            print(f"  {label:>20} {row['rps']:>11.1f} {row['p99_ms']:>8.2f} {row['errors']:>7} "
+                  f"{'n/a' if files is None else files:>11}")
+    finally:
+        os.chdir(backend_dir)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    gain = results["pooled"] / results["connect per request"]
+    print(f"  {'speed-up':>20} {gain:>10.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Bytes and milliseconds per GET /api/patients page in each response format.
+
+For each database size, walks the first --pages pages of --limit patients
+through the Flask test client in every ?format=, with and without gzip,
+and compares them with the old encoding (a dict and a json.dumps call per
+row). Run from the backend directory:
+
+    python -m benchmarks.response_encoding --sizes 10000,100000,1000000
+"""
+import argparse
+import gzip
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+FORMATS = ["objects", "rows", "columns"]
+
+
+def legacy_page(app_module, limit, after, fields):
+    """The page as the endpoint encoded it before, for comparison"""
+    with app_module.get_db() as conn:
+        rows = app_module.select_patient_page(conn.cursor(), limit, after, fields)
+        parts = ['{"patients": [']
+        count = 0
+        last = None
+        for row in rows:
+            parts.append(("," if count else "") + json.dumps(dict(zip(fields, row))))
+            count += 1
+            last = row[-2:]
+        next_cursor = app_module.encode_cursor(*last) if count == limit else None
+        parts.append(f'], "next_cursor": {json.dumps(next_cursor)}}}')
+        return "".join(parts).encode("utf-8"), next_cursor
+
+
+def measure_legacy(app_module, pages, limit):
+    fields = list(app_module.PATIENT_COLUMNS)
+    plain, compressed = ([], []), ([], [])
+    after = None
+    for _ in range(pages):
+        start = time.perf_counter()
+        body, next_cursor = legacy_page(app_module, limit, after, fields)
+        encoded = time.perf_counter()
+        compressed_body = gzip.compress(body, 6)
+        plain[0].append(encoded - start)
+        plain[1].append(len(body))
+        compressed[0].append(time.perf_counter() - start)
+        compressed[1].append(len(compressed_body))
+        if not next_cursor:
+            break
+        after = app_module.decode_cursor(next_cursor)
+    return plain, compressed
+
+
+def measure(client, pages, limit, page_format, accept_gzip):
+    headers = {"Accept-Encoding": "gzip"} if accept_gzip else {}
+    timings, sizes = [], []
+    cursor = None
+    for _ in range(pages):
+        url = f"/api/patients?limit={limit}&format={page_format}"
+        if cursor:
+            url += f"&cursor={cursor}"
+        start = time.perf_counter()
+        response = client.get(url, headers=headers)
+        body = response.get_data()
+        timings.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.status_code
+        sizes.append(len(body))
+        if accept_gzip:
+            body = gzip.decompress(body)
+        cursor = json.loads(body)["next_cursor"]
+        if not cursor:
+            break
+    return timings, sizes
+
+
+def report(label, timings, sizes):
+    print(f"  {label:<22} {statistics.median(timings) * 1000:>9.2f} "
+          f"{statistics.mean(sizes) / 1024:>11.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000,1000000",
+                        help="comma-separated patient counts")
+    parser.add_argument("--pages", type=int, default=20, help="pages walked per format")
+    parser.add_argument("--limit", type=int, default=1000, help="patients per page")
+    args = parser.parse_args()
+
+    backend_dir = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="tib_ai_encoding_")
+    os.environ["TIB_AI_DB_PATH"] = os.path.join(workdir, "encoding.db")
+    sys.path.insert(0, backend_dir)
+    os.chdir(workdir)
+
+    import app as app_module
+    import db
+    import responses
+    from benchmarks.read_endpoints import populate
+
+    encoder = "orjson" if responses.orjson is not None else "json (orjson not installed)"
+    print(f"Encoder: {encoder}; {args.limit} patients per page, median of {args.pages} pages")
+
+    try:
+        for size in [int(n) for n in args.sizes.split(",")]:
+            with db.get_db() as conn:
+                conn.execute("DELETE FROM Resultant")
+                conn.execute("DELETE FROM Patient")
+            populate(db.DB_PATH, size)
+
+            client = app_module.app.test_client()
+            print(f"\n{size} patients")
+            print(f"  {'format':<22} {'ms/page':>9} {'KB/page':>11}")
+            plain, compressed = measure_legacy(app_module, args.pages, args.limit)
+            report("old encoding", *plain)
+            report("old encoding + gzip", *compressed)
+            for page_format in FORMATS:
+                for accept_gzip in (False, True):
+                    label = page_format + (" + gzip" if accept_gzip else "")
+                    report(label, *measure(client, args.pages, args.limit, page_format, accept_gzip))
+    finally:
+        db.pool.close_all()
+        os.chdir(backend_dir)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Matches/s of the symptom index against a substring scan of every disease.
+
+Uses the symptom strings in data/patient data.csv, first with the seed
+disease catalogue and then with synthetic diseases added to show how both
+approaches scale with the size of the symptom vocabulary. Run from the
+backend directory:
+
+    python -m benchmarks.symptom_matching --repeat 20 --extra-diseases 0,100,1000
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+
+PATIENT_CSV = os.path.join("data", "patient data.csv")
+
+
+def substring_scan(disease_symptoms, symptoms):
+    """The old per-request check, applied to every disease"""
+    reported = symptoms.lower()
+    return {
+        disease_id: [s for s in known if s in reported]
+        for disease_id, known in disease_symptoms.items()
+    }
+
+
+def with_extra_diseases(disease_symptoms, count):
+    """The catalogue plus count synthetic diseases of six made-up symptoms each"""
+    catalogue = dict(disease_symptoms)
+    for i in range(count):
+        catalogue[1000 + i] = [f"synthetic sign {i} grade {grade}" for grade in range(6)]
+    return catalogue
+
+
+def run(match, texts, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            match(text)
+    return repeat * len(texts) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20, help="passes over the CSV")
+    parser.add_argument("--extra-diseases", default="0,100,1000",
+                        help="comma-separated synthetic catalogue sizes to add")
+    args = parser.parse_args()
+
+    with open(PATIENT_CSV, "r", encoding="utf-8") as file:
+        texts = [row["Symptoms"] for row in csv.DictReader(file)]
+
+    sys.path.insert(0, os.getcwd())
+    from catalogue import DISEASE_SEED, SYNONYM_SEED
+    from symptom_index import SymptomIndex
+
+    disease_symptoms = {disease_id: symptoms for disease_id, _, _, symptoms, _ in DISEASE_SEED}
+    seed_index = SymptomIndex(disease_symptoms, SYNONYM_SEED)
+    matched = sum(1 for text in texts if seed_index.rank(text))
+    print(f"{len(texts)} symptom strings, {matched} with at least one known symptom")
+    print("matches/s by catalogue size:")
+    print(f"{'diseases':>9} {'build ms':>9} {'substring scan':>15} {'symptom index':>15}")
+
+    for extra in [int(n) for n in args.extra_diseases.split(",")]:
+        catalogue = with_extra_diseases(disease_symptoms, extra)
+
+        start = time.perf_counter()
+        index = SymptomIndex(catalogue, SYNONYM_SEED)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        scan_rate = run(lambda text: substring_scan(catalogue, text), texts, args.repeat)
+        index_rate = run(index.rank, texts, args.repeat)
+        print(f"{len(catalogue):>9} {build_ms:>9.2f} {scan_rate:>15,.0f} {index_rate:>15,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import functools
+import os
+import threading
+from collections import OrderedDict
+
+from flask import Response, make_response, request
+
+from db import current_generation
+from responses import COMPRESSIBLE_MIMETYPES, GZIP_MIN_BYTES, accepts_gzip, gzip_bytes
+
+# Upper bound on the encoded bytes held by the response cache
+CACHE_MAX_BYTES = int(os.environ.get("TIB_AI_CACHE_BYTES", 32 * 1024 * 1024))
+
+
+class ResponseCache:
+    """LRU cache of encoded response bodies, bounded by total size.
+
+    Every entry remembers the write generation it was computed under and is
+    treated as a miss once the generation moves on. The generation only
+    changes when a write commits, so entries stay valid until the next write
+    in any process and no longer. Large JSON bodies are also kept gzipped,
+    so a hit costs neither encoding nor compression.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, generation):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != generation:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, generation, body, status, mimetype):
+        """Store a body; returns the entry, or None if it is too large to keep"""
+        # A single body this large would evict most of the cache
+        if len(body) > self.max_bytes // 4:
+            return None
+
+        compressed = None
+        if mimetype in COMPRESSIBLE_MIMETYPES and len(body) >= GZIP_MIN_BYTES:
+            compressed = gzip_bytes(body)
+        entry = (generation, body, compressed, status, mimetype)
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= entry_size(old)
+
+            self._entries[key] = entry
+            self._bytes += entry_size(entry)
+
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= entry_size(evicted)
+                self.evictions += 1
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "maxBytes": self.max_bytes,
+            }
+
+
+def entry_size(entry):
+    _, body, compressed, _, _ = entry
+    return len(body) + (len(compressed) if compressed else 0)
+
+
+def entry_response(entry):
+    """Build the response for a cache entry, gzipped if the client accepts it"""
+    _, body, compressed, status, mimetype = entry
+    if compressed is not None and accepts_gzip():
+        response = Response(compressed, status=status, mimetype=mimetype)
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = Response(body, status=status, mimetype=mimetype)
+    if mimetype in COMPRESSIBLE_MIMETYPES:
+        response.vary.add("Accept-Encoding")
+    return response
+
+
+response_cache = ResponseCache(CACHE_MAX_BYTES)
+
+
+def cached_response(view):
+    """Serve a read-only route from the response cache.
+
+    Entries are keyed by path and query arguments. Only 200 responses with
+    a fixed body are stored.
+    """
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        generation = current_generation()
+        key = (request.path, tuple(sorted(request.args.items(multi=True))))
+
+        entry = response_cache.get(key, generation)
+        if entry is not None:
+            return entry_response(entry)
+
+        response = make_response(view(*args, **kwargs))
+        if response.status_code == 200 and not response.is_streamed:
+            entry = response_cache.put(
+                key, generation, response.get_data(), response.status_code, response.mimetype
+            )
+            if entry is not None:
+                return entry_response(entry)
+        return response
+
+    return wrapper
@@ -0,0 +1,454 @@
+"""Disease and severity catalogue used by triage.
+
+The catalogue lives in the Disease, DiseaseSymptom, SymptomSynonym and
+Severity tables. Triggers on those tables bump CatalogueVersion and the
+write generation behind the cached responses. Each process keeps one
+immutable Catalogue built from them. It is rebuilt only after the version
+changes, then swapped in as a whole, so a new disease added to the tables
+is picked up without a redeploy.
+"""
+import os
+import threading
+from types import MappingProxyType
+from typing import NamedTuple, Tuple
+
+from db import connect
+from symptom_index import SymptomIndex
+
+# Seed rows for a new database:
+# (id, name, high risk, symptoms, precautions)
+DISEASE_SEED = [
+    (1, "Dengue", True,
+     ["high fever", "severe headache", "pain behind the eyes", "joint and muscle pain", "rash"],
+     "Rest, stay hydrated, and take acetaminophen for pain. Avoid aspirin and ibuprofen."),
+    (2, "Measles", False,
+     ["fever", "dry cough", "runny nose", "sore throat", "inflamed eyes", "rash"],
+     "Rest, stay hydrated, and use humidifier for cough. Isolation recommended."),
+    (3, "Melanoma", True,
+     ["irregular mole", "dark lesion", "skin discoloration", "itchy skin patch", "bleeding spot"],
+     "See a dermatologist promptly for a skin examination and biopsy. Avoid sun exposure and do not scratch or pick at the lesion."),
+    (4, "Diarrhea", False,
+     ["loose watery stools", "abdominal cramps", "nausea", "bloating", "dehydration"],
+     "Stay hydrated with water and electrolyte solutions. Eat mild foods like rice and bananas."),
+    (5, "Tuberculosis", True,
+     ["persistent cough", "chest pain", "weight loss", "night sweats", "fatigue"],
+     "Complete isolation and full course of prescribed antibiotics. Regular medical follow-up."),
+    (6, "Skin infection", False,
+     ["redness", "swelling", "warmth", "pain", "pus or drainage"],
+     "Keep area clean and dry. Apply prescribed topical medications. Cover with sterile bandage."),
+]
+
+# Names the original data/diesease data.csv gave seed diseases
+LEGACY_DISEASE_NAMES = {5: "tb"}
+
+# (id, level, name, recommended action); level 1 is the most severe
+SEVERITY_SEED = [
+    (1, 1, "Critical", "Seek immediate emergency medical attention"),
+    (2, 2, "Urgent", "Seek medical care within 24 hours"),
+    (3, 3, "Medium", "Schedule doctor appointment within 3-5 days"),
+    (4, 4, "Low",
+     "Home care with over-the-counter medications, seek medical attention if symptoms worsen"),
+    (5, 5, "Minimal", "Home care and rest, monitor symptoms"),
+]
+
+# Names the original data/severity data.csv gave severity ids 1-5. Triage
+# has always treated id 1 as the most severe, so these read backwards.
+LEGACY_SEVERITY_NAMES = {1: "minor", 2: "non-urgent", 3: "standard", 4: "urgent", 5: "critical"}
+
+# Other ways patients and clinics write the catalogue symptoms
+SYNONYM_SEED = {
+    "rash": ["skin rash", "rashes", "red spots"],
+    "high fever": ["high temperature", "very high fever"],
+    "fever": ["pyrexia", "feverish", "febrile"],
+    "severe headache": ["headache", "bad headache", "migraine"],
+    "pain behind the eyes": ["eye pain", "retro-orbital pain", "pain behind eyes"],
+    "joint and muscle pain": ["joint pain", "muscle pain", "body aches", "bone pain"],
+    "inflamed eyes": ["red eyes", "pink eyes", "conjunctivitis", "watery eyes"],
+    "runny nose": ["running nose", "nasal discharge"],
+    "swelling": ["swollen skin", "swollen area"],
+    "pus or drainage": ["pus", "discharge from wound", "oozing"],
+    "loose watery stools": ["watery stools", "loose stools", "loose motions"],
+    "abdominal cramps": ["stomach cramps", "stomach pain", "belly pain", "abdominal pain"],
+    "nausea": ["vomiting", "feeling sick", "throwing up"],
+    "dehydration": ["dry mouth", "very thirsty"],
+    "persistent cough": ["chronic cough", "coughing up blood", "cough for weeks"],
+    "night sweats": ["sweating at night"],
+    "weight loss": ["losing weight", "lost weight"],
+    "fatigue": ["tiredness", "exhaustion", "weakness"],
+    "irregular mole": ["changing mole", "new mole", "odd shaped mole"],
+    "dark lesion": ["dark spot", "black spot"],
+    "skin discoloration": ["skin discolouration", "discolored skin"],
+    "itchy skin patch": ["itchy patch", "itchy skin"],
+    "bleeding spot": ["bleeding mole"],
+}
+
+CATALOGUE_TABLES = ["Disease", "DiseaseSymptom", "SymptomSynonym", "Severity"]
+
+# Columns added to the original Disease and Severity tables
+ADDED_COLUMNS = {
+    "Disease": [
+        ("precautions", "TEXT NOT NULL DEFAULT ''"),
+        ("high_risk", "INTEGER NOT NULL DEFAULT 0"),
+    ],
+    "Severity": [
+        ("recommended_action", "TEXT NOT NULL DEFAULT ''"),
+    ],
+}
+
+CATALOGUE_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS DiseaseSymptom (
+        disease_id INTEGER NOT NULL REFERENCES Disease (id),
+        symptom TEXT NOT NULL,
+        position INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (disease_id, symptom)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS SymptomSynonym (
+        phrase TEXT PRIMARY KEY,
+        symptom TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS CatalogueVersion (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    )
+    """,
+    "INSERT OR IGNORE INTO CatalogueVersion (id, version) VALUES (1, 0)",
+]
+
+
+class Disease(NamedTuple):
+    id: int
+    name: str
+    high_risk: bool
+    symptoms: Tuple[str, ...]
+    precautions: str
+
+
+class Severity(NamedTuple):
+    id: int
+    level: int
+    name: str
+    recommended_action: str
+
+
+class Catalogue(NamedTuple):
+    version: int
+    diseases: MappingProxyType  # id -> Disease
+    severities: MappingProxyType  # id -> Severity
+    symptom_index: SymptomIndex
+
+
+def diagnosis_comment(disease, severity, confidence_score, matched_symptoms):
+    """The comment stored with a Resultant row"""
+    if matched_symptoms:
+        symptom_text = ", ".join(matched_symptoms)
+        return f"AI detected {disease.name} with {confidence_score*100:.1f}% confidence based on symptoms: {symptom_text}. Severity: {severity.name}. {disease.precautions}"
+    return f"AI detected {disease.name} with {confidence_score*100:.1f}% confidence. Severity: {severity.name}. {disease.precautions}"
+
+
+def create_tables(cursor):
+    """Create or extend the catalogue tables and seed whatever is empty.
+
+    Disease and Severity themselves are created by the first migration.
+    """
+    for table, columns in ADDED_COLUMNS.items():
+        cursor.execute(f"PRAGMA table_info({table})")
+        existing = {row[1] for row in cursor.fetchall()}
+        for name, definition in columns:
+            if name not in existing:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+    for ddl in CATALOGUE_DDL:
+        cursor.execute(ddl)
+
+    for table in CATALOGUE_TABLES:
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            cursor.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_catalogue_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE CatalogueVersion SET version = version + 1 WHERE id = 1;
+                END
+                """
+            )
+
+    seed(cursor)
+
+
+def create_generation_triggers(cursor):
+    """Make catalogue changes bump the write generation too.
+
+    The cached responses and ETags follow WriteGeneration, and the disease
+    and severity lists and every aggregate naming them are read from the
+    catalogue tables. WriteGeneration only exists from a later migration
+    than the tables, hence triggers of their own.
+    """
+    for table in CATALOGUE_TABLES:
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            cursor.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_generation_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE WriteGeneration SET generation = generation + 1 WHERE id = 1;
+                END
+                """
+            )
+
+
+def seed(cursor):
+    """Fill in the seed catalogue without overwriting rows already present"""
+    cursor.executemany(
+        "INSERT OR IGNORE INTO Disease (id, name) VALUES (?, ?)",
+        [(disease_id, name) for disease_id, name, _, _, _ in DISEASE_SEED],
+    )
+    # Like severity actions, precautions and symptoms only go to rows that
+    # carry the seed's name
+    cursor.executemany(
+        """
+        UPDATE Disease SET precautions = ?, high_risk = ?
+        WHERE id = ? AND name = ? COLLATE NOCASE AND precautions = ''
+        """,
+        [
+            (precautions, int(high_risk), disease_id, name)
+            for disease_id, name, high_risk, _, precautions in DISEASE_SEED
+        ],
+    )
+
+    # Symptoms, and their synonyms, for seed diseases that have none
+    cursor.execute("SELECT id, name FROM Disease")
+    names = {disease_id: name.lower() for disease_id, name in cursor.fetchall()}
+    cursor.execute("SELECT DISTINCT disease_id FROM DiseaseSymptom")
+    with_symptoms = {row[0] for row in cursor.fetchall()}
+    seeded = [
+        (disease_id, symptoms)
+        for disease_id, name, _, symptoms, _ in DISEASE_SEED
+        if names.get(disease_id) == name.lower() and disease_id not in with_symptoms
+    ]
+    cursor.executemany(
+        "INSERT OR IGNORE INTO DiseaseSymptom (disease_id, symptom, position) VALUES (?, ?, ?)",
+        [
+            (disease_id, symptom, position)
+            for disease_id, symptoms in seeded
+            for position, symptom in enumerate(symptoms)
+        ],
+    )
+    cursor.executemany(
+        "INSERT OR IGNORE INTO SymptomSynonym (phrase, symptom) VALUES (?, ?)",
+        [
+            (phrase, symptom)
+            for _, symptoms in seeded
+            for symptom in symptoms
+            for phrase in SYNONYM_SEED.get(symptom, ())
+        ],
+    )
+
+    cursor.executemany(
+        "INSERT OR IGNORE INTO Severity (id, level, name) VALUES (?, ?, ?)",
+        [(severity_id, level, name) for severity_id, level, name, _ in SEVERITY_SEED],
+    )
+    # Only rows that carry the seed's name: the action belongs to the name
+    cursor.executemany(
+        """
+        UPDATE Severity SET recommended_action = ?
+        WHERE id = ? AND name = ? COLLATE NOCASE AND recommended_action = ''
+        """,
+        [(action, severity_id, name) for severity_id, _, name, action in SEVERITY_SEED],
+    )
+
+
+def reconcile_severities(cursor):
+    """Bring Severity rows named on the legacy scale onto the seed's scale.
+
+    Databases loaded from the original severity CSV name ids 1-5 minor ...
+    critical, while triage picks ids 1-3 for high-risk diseases. Those rows
+    get the seed's level, name and action. Rows with the seed's name keep a
+    customised action. Any other name raises RuntimeError instead of
+    mixing two scales.
+    """
+    cursor.execute("SELECT id, level, name, recommended_action FROM Severity")
+    rows = {row[0]: row[1:] for row in cursor.fetchall()}
+
+    updates = []
+    for severity_id, level, name, action in SEVERITY_SEED:
+        if severity_id not in rows:
+            continue
+        have_level, have_name, have_action = rows[severity_id]
+        if have_name.lower() == LEGACY_SEVERITY_NAMES[severity_id]:
+            updates.append((level, name, action, severity_id))
+        elif have_name.lower() == name.lower():
+            if (have_level, have_name) != (level, name) or not have_action:
+                updates.append((level, name, have_action or action, severity_id))
+        else:
+            raise RuntimeError(
+                f"Severity {severity_id} is named {have_name!r}, expected {name!r}; "
+                "rename it to match catalogue.SEVERITY_SEED before migrating"
+            )
+    cursor.executemany(
+        "UPDATE Severity SET level = ?, name = ?, recommended_action = ? WHERE id = ?",
+        updates,
+    )
+
+
+# Tables other than Disease that hold disease ids, for move_disease()
+DISEASE_ID_TABLES = [
+    "DiseaseSymptom", "Resultant", "ResultantSummary", "OutbreakState",
+    "TrendHourly", "TrendDaily", "TrendWeekly",
+]
+
+
+def move_disease(cursor, old_id, new_id):
+    """Give disease old_id, with its symptoms, diagnoses and counts, the id new_id.
+
+    A row already at new_id is replaced if nothing was diagnosed with it.
+    """
+    cursor.execute("SELECT 1 FROM Resultant WHERE disease_id = ? LIMIT 1", (new_id,))
+    if cursor.fetchone():
+        raise RuntimeError(f"Disease {old_id} cannot move to id {new_id}, which has diagnoses")
+    cursor.execute("DELETE FROM DiseaseSymptom WHERE disease_id = ?", (new_id,))
+    cursor.execute("DELETE FROM Disease WHERE id = ?", (new_id,))
+    for table in DISEASE_ID_TABLES:
+        cursor.execute(f"UPDATE {table} SET disease_id = ? WHERE disease_id = ?", (new_id, old_id))
+    cursor.execute("UPDATE Disease SET id = ? WHERE id = ?", (new_id, old_id))
+
+
+def reconcile_diseases(cursor):
+    """Bring Disease rows, their symptoms and precautions in line with the seed.
+
+    Rows named on the legacy CSV get the seed's name. A row carrying the
+    seed name of another id moves there with its diagnoses, as a
+    "Skin infection" at id 3 does. Precautions and symptom lists that are
+    exactly another seed disease's were attached by id under the old seed
+    and are replaced; customised ones are kept. Any other name raises
+    RuntimeError instead of attaching one disease's advice to another.
+    """
+    cursor.execute("SELECT id, name FROM Disease")
+    names = dict(cursor.fetchall())
+    seed_ids = {name.lower(): disease_id for disease_id, name, _, _, _ in DISEASE_SEED}
+
+    for disease_id, name, _, _, _ in DISEASE_SEED:
+        if disease_id not in names:
+            continue
+        have_name = names[disease_id].lower()
+        if have_name == name.lower():
+            continue
+        if have_name == LEGACY_DISEASE_NAMES.get(disease_id):
+            cursor.execute("UPDATE Disease SET name = ? WHERE id = ?", (name, disease_id))
+            names[disease_id] = name
+        elif seed_ids.get(have_name, disease_id) != disease_id:
+            new_id = seed_ids[have_name]
+            move_disease(cursor, disease_id, new_id)
+            names[new_id] = names.pop(disease_id)
+        else:
+            raise RuntimeError(
+                f"Disease {disease_id} is named {names[disease_id]!r}, expected {name!r}; "
+                "rename it to match catalogue.DISEASE_SEED before migrating"
+            )
+
+    for disease_id, name, high_risk, symptoms, precautions in DISEASE_SEED:
+        if disease_id not in names:
+            continue
+        others = [entry for entry in DISEASE_SEED if entry[0] != disease_id]
+        cursor.execute("SELECT precautions FROM Disease WHERE id = ?", (disease_id,))
+        if cursor.fetchone()[0] in {entry[4] for entry in others}:
+            cursor.execute(
+                "UPDATE Disease SET precautions = ?, high_risk = ? WHERE id = ?",
+                (precautions, int(high_risk), disease_id),
+            )
+        cursor.execute(
+            "SELECT symptom FROM DiseaseSymptom WHERE disease_id = ? ORDER BY position",
+            (disease_id,),
+        )
+        if [row[0] for row in cursor.fetchall()] in [entry[3] for entry in others]:
+            cursor.execute("DELETE FROM DiseaseSymptom WHERE disease_id = ?", (disease_id,))
+
+    # Seed diseases still missing, and symptoms for those deleted above
+    seed(cursor)
+
+
+def read_version(cursor):
+    cursor.execute("SELECT version FROM CatalogueVersion WHERE id = 1")
+    return cursor.fetchone()[0]
+
+
+def load(cursor):
+    """Build a Catalogue from the tables; call inside a read transaction"""
+    version = read_version(cursor)
+
+    cursor.execute("SELECT disease_id, symptom FROM DiseaseSymptom ORDER BY disease_id, position")
+    symptoms = {}
+    for disease_id, symptom in cursor.fetchall():
+        symptoms.setdefault(disease_id, []).append(symptom)
+
+    cursor.execute("SELECT id, name, high_risk, precautions FROM Disease ORDER BY id")
+    diseases = {
+        disease_id: Disease(
+            disease_id, name, bool(high_risk), tuple(symptoms.get(disease_id, ())), precautions
+        )
+        for disease_id, name, high_risk, precautions in cursor.fetchall()
+    }
+
+    cursor.execute("SELECT id, level, name, recommended_action FROM Severity ORDER BY level")
+    severities = {row[0]: Severity(*row) for row in cursor.fetchall()}
+
+    cursor.execute("SELECT phrase, symptom FROM SymptomSynonym")
+    synonyms = {}
+    for phrase, symptom in cursor.fetchall():
+        synonyms.setdefault(symptom, []).append(phrase)
+
+    return Catalogue(
+        version=version,
+        diseases=MappingProxyType(diseases),
+        severities=MappingProxyType(severities),
+        symptom_index=SymptomIndex(
+            {disease.id: disease.symptoms for disease in diseases.values()}, synonyms
+        ),
+    )
+
+
+class CatalogueCache:
+    """The current Catalogue for this process.
+
+    Like db.GenerationWatcher, a private connection checks PRAGMA
+    data_version and reads CatalogueVersion only after some connection has
+    committed. The catalogue is rebuilt only when that version has moved.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._data_version = None
+        self._catalogue = None
+
+    def current(self):
+        with self._lock:
+            if self._conn is None or self._pid != os.getpid():
+                self._conn = connect(self.path)
+                self._pid = os.getpid()
+                self._data_version = None
+
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version != self._data_version:
+                cursor = self._conn.cursor()
+                cursor.execute("BEGIN")
+                try:
+                    if self._catalogue is None or read_version(cursor) != self._catalogue.version:
+                        self._catalogue = load(cursor)
+                finally:
+                    cursor.execute("COMMIT")
+                self._data_version = data_version
+            return self._catalogue
+
+
+catalogue_cache = CatalogueCache()
+
+
+def current_catalogue():
+    return catalogue_cache.current()
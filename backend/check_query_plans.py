@@ -0,0 +1,304 @@
+"""Fail if any SQL statement in the API falls back to a full table scan.
+
+Builds a large synthetic database and runs EXPLAIN QUERY PLAN on every SQL
+string literal found in the checked modules. Statements assembled at run
+time, such as the patient listing with its filters and sorts, are checked
+by calling their builders with representative arguments through a cursor
+that explains each statement before running it. Exits non-zero when a
+plan scans a large table without an index.
+
+The database is not ANALYZEd: production databases have no statistics, so
+the plans checked are the ones they get.
+
+    python check_query_plans.py --patients 100000
+"""
+import argparse
+import ast
+import datetime
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+# Modules whose SQL statements are checked
+CHECKED_MODULES = [
+    "app.py", "events.py", "intake.py", "stats.py", "trends.py", "search.py", "outbreaks.py",
+]
+
+# Functions and constants whose statements read whole tables on purpose:
+# the rebuilds and recounts behind the maintenance commands
+INTENDED_SCANS = {
+    "stats.py": {"rebuild", "verify", "RESULTANT_RECOUNT", "PATIENT_RECOUNT"},
+    "outbreaks.py": {"rebuild"},
+    "search.py": {"rebuild", "verify"},
+    "trends.py": {"rebuild", "verify", "recount"},
+}
+
+# Small reference and summary tables that are cheap to scan
+SCAN_ALLOWED = {
+    "Severity", "Disease", "ResultantSummary", "PatientSummary", "sqlite_sequence",
+    "sqlite_master",
+}
+
+SQL_START = re.compile(r"^\s*(SELECT|INSERT|UPDATE|DELETE)\b", re.IGNORECASE)
+TABLE_ALIAS = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+SQL_KEYWORDS = {"ON", "WHERE", "GROUP", "ORDER", "LEFT", "JOIN", "LIMIT", "INNER", "USING"}
+
+
+class AnyParameter(dict):
+    """Binds every named parameter to a dummy value"""
+
+    def __missing__(self, key):
+        return 1
+
+
+def find_statements(path):
+    """Return (line, owner, sql) for each SQL literal in a module.
+
+    owner is the top-level function, class or assigned name the literal is
+    in, so INTENDED_SCANS can name it.
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        tree = ast.parse(file.read(), filename=path)
+
+    # Skip the literal pieces of f-strings, which are never whole statements
+    fragments = {
+        id(value)
+        for node in ast.walk(tree)
+        if isinstance(node, ast.JoinedStr)
+        for value in node.values
+    }
+
+    owners = {}
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            owner = node.name
+        elif isinstance(node, ast.Assign) and isinstance(node.targets[0], ast.Name):
+            owner = node.targets[0].id
+        else:
+            continue
+        for child in ast.walk(node):
+            owners[id(child)] = owner
+
+    statements = [
+        (node.lineno, owners.get(id(node), ""), node.value)
+        for node in ast.walk(tree)
+        if isinstance(node, ast.Constant)
+        and isinstance(node.value, str)
+        and id(node) not in fragments
+        and SQL_START.match(node.value)
+    ]
+    return sorted(statements)
+
+
+def table_aliases(sql):
+    aliases = {}
+    for table, alias in TABLE_ALIAS.findall(sql):
+        aliases[table] = table
+        if alias and alias.upper() not in SQL_KEYWORDS:
+            aliases[alias] = table
+    return aliases
+
+
+def full_scans(cursor, sql, parameters=None):
+    """Return the tables the plan for sql scans without using an index"""
+    if parameters is None:
+        placeholders = sql.count("?")
+        parameters = AnyParameter() if ":" in sql else (1,) * placeholders
+    cursor.execute(f"EXPLAIN QUERY PLAN {sql}", parameters)
+    aliases = table_aliases(sql)
+
+    scans = []
+    for _, _, _, detail in cursor.fetchall():
+        match = re.match(r"SCAN (\w+)", detail)
+        if not match or "USING" in detail or detail == "SCAN CONSTANT ROW":
+            continue
+        # A virtual table scan with constraints, such as an FTS5 MATCH
+        if re.search(r"VIRTUAL TABLE INDEX \d+:\S", detail):
+            continue
+        table = aliases.get(match.group(1), match.group(1))
+        if table not in SCAN_ALLOWED:
+            scans.append(detail)
+    return scans
+
+
+class PlanningCursor:
+    """Wraps a cursor and explains every statement before running it.
+
+    Builders get this in place of a cursor, so the statements they assemble
+    are checked with the parameters they bind and then run as usual for
+    any statements that depend on the results.
+    """
+
+    def __init__(self, cursor, checks):
+        object.__setattr__(self, "_cursor", cursor)
+        object.__setattr__(self, "_checks", checks)
+        object.__setattr__(self, "label", "")
+
+    def _check(self, sql, parameters):
+        if SQL_START.match(sql):
+            self._checks.append((self.label, sql, full_scans(self._cursor, sql, parameters)))
+
+    def execute(self, sql, parameters=()):
+        self._check(sql, parameters)
+        return self._cursor.execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        rows = list(seq_of_parameters)
+        if rows:
+            self._check(sql, rows[0])
+        return self._cursor.executemany(sql, rows)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        if name == "label":
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._cursor, name, value)
+
+
+# Query parameters of GET /api/patients whose statements are checked, and
+# the cursor values that continue each sort
+PATIENT_FILTER_ARGS = [
+    {"disease_id": "1"},
+    {"location": "Lahore"},
+    {"severity_id": "2", "location": "Lahore"},
+    {"gender": "Female"},
+    {"pregnancy_status": "yes"},
+    {"age_min": "30", "age_max": "40"},
+    {"created_from": "2026-01-01", "created_to": "2026-02-01"},
+    {"disease_id": "1", "gender": "Male", "age_min": "60"},
+]
+PATIENT_SORT_AFTER = {
+    "created_at": "2026-01-01 00:00:00",
+    "age": 40,
+    "name": "Patient 5",
+    "location": "Lahore",
+    "confidence_score": 0.95,
+}
+TREND_ARGS = [
+    {"granularity": granularity, **extra}
+    for granularity in ("hour", "day", "week")
+    for extra in ({}, {"group_by": "disease"}, {"group_by": "location", "disease_id": "1"},
+                  {"severity_id": "2", "location": "Lahore"})
+]
+
+
+def check_builders(cursor, patients):
+    """Call the statement builders with representative arguments"""
+    import app
+    import intake
+    import search
+    import trends
+
+    fields = list(app.PATIENT_COLUMNS)
+
+    for key, after in PATIENT_SORT_AFTER.items():
+        for descending in (True, False):
+            for page_after in (None, (after, 100, None)):
+                cursor.label = f"app.py select_patient_page sort={key}"
+                app.select_patient_page(cursor, 100, page_after, fields, {}, (key, descending))
+                cursor.fetchall()
+
+    for args in PATIENT_FILTER_ARGS:
+        filters = app.parse_patient_filters(args)
+        cursor.label = f"app.py count_patients {args}"
+        app.count_patients(cursor, filters)
+        # Few matches and many: the two plans select_patient_page chooses from
+        for total in (10, patients):
+            for key in PATIENT_SORT_AFTER:
+                cursor.label = f"app.py select_patient_page {args} sort={key} total={total}"
+                app.select_patient_page(cursor, 100, None, fields, filters, (key, True), total)
+                cursor.fetchall()
+
+    for disease_id, severity_id in ((None, None), (1, 2)):
+        cursor.label = "app.py select_search_page"
+        app.select_search_page(
+            cursor, search.match_expression("fever rash"), disease_id, severity_id, 20, 0, fields
+        )
+
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    for args in TREND_ARGS:
+        cursor.label = f"app.py select_trend {args}"
+        app.select_trend(cursor, *app.parse_trend_args(args, now))
+
+    # Writes, rolled back: intake with its summaries, re-triage and compaction
+    cursor.label = "intake.py store_patients"
+    patient = ("Plan Check", 30, "Female", "Lahore", 99.0, "no", "120/80", 100, None, "fever")
+    intake.store_patients(cursor, [(patient, (1, 2, 0.95, ""))])
+    cursor.label = "trends.py forget_results/record_results"
+    trends.forget_results(cursor, [1])
+    trends.record_results(cursor, [1])
+    cursor.label = "trends.py compact"
+    trends.compact(cursor, now + datetime.timedelta(days=2 * trends.DAILY_DAYS))
+    cursor.connection.rollback()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check query plans for full table scans")
+    parser.add_argument("--patients", type=int, default=50000)
+    args = parser.parse_args()
+
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="tib_ai_plans_")
+    try:
+        os.environ["TIB_AI_DB_PATH"] = os.path.join(workdir, "plans.db")
+        sys.path.insert(0, backend_dir)
+        os.chdir(workdir)
+
+        import db
+        import app  # noqa: F401  creates the schema and indexes
+        from benchmarks.read_endpoints import populate
+
+        print(f"Building synthetic database with {args.patients} patients...")
+        populate(db.DB_PATH, args.patients)
+
+        conn = db.connect()
+        cursor = conn.cursor()
+
+        failures = 0
+        checked = 0
+        for module in CHECKED_MODULES:
+            intended = INTENDED_SCANS.get(module, set())
+            for lineno, owner, sql in find_statements(os.path.join(backend_dir, module)):
+                if owner in intended:
+                    continue
+                checked += 1
+                scans = full_scans(cursor, sql)
+                if scans:
+                    failures += 1
+                    statement = " ".join(sql.split())
+                    print(f"FAIL {module}:{lineno}: {statement}")
+                    for detail in scans:
+                        print(f"    {detail}")
+
+        checks = []
+        check_builders(PlanningCursor(cursor, checks), args.patients)
+        seen = set()
+        for label, sql, scans in checks:
+            statement = " ".join(sql.split())
+            if statement in seen:
+                continue
+            seen.add(statement)
+            checked += 1
+            if scans:
+                failures += 1
+                print(f"FAIL {label}: {statement}")
+                for detail in scans:
+                    print(f"    {detail}")
+
+        conn.close()
+        print(f"Checked {checked} statements, {failures} with full table scans")
+        sys.exit(1 if failures else 0)
+
+    finally:
+        # The populated database can be large
+        os.chdir(backend_dir)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import metrics
+
+# Database setup
+DB_PATH = os.environ.get("TIB_AI_DB_PATH", "tib_ai.db")
+
+# Set TIB_AI_DB_POOL=0 to open a fresh connection for every request
+POOL_ENABLED = os.environ.get("TIB_AI_DB_POOL", "1") != "0"
+# Idle connections kept open per process for the next request
+POOL_SIZE = int(os.environ.get("TIB_AI_DB_POOL_SIZE", "8"))
+
+# Prepared statements kept per connection by the sqlite3 module
+STATEMENT_CACHE_SIZE = 256
+
+# WAL mode is stored in the database file, so migrations.migrate() sets it
+# once instead of every connection asking for it
+CONNECTION_PRAGMAS = [
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -65536",  # 64 MB page cache
+    "PRAGMA mmap_size = 268435456",  # 256 MB memory-mapped I/O
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+]
+
+
+def connect(path=None):
+    """Open a new connection with the tuned pragmas applied"""
+    conn = sqlite3.connect(
+        path or DB_PATH,
+        timeout=5.0,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        check_same_thread=False,
+        factory=metrics.connection_factory(),
+    )
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class ConnectionPool:
+    """Lends connections to get_db blocks and keeps up to size idle ones.
+
+    The threaded server runs every request on a new thread, so connections
+    are checked out for the block and handed back at its end rather than
+    kept per thread. One handed back while size are already idle is closed,
+    so a process holds at most size connections plus one per block in
+    progress. The idle ones are dropped after a fork.
+    """
+
+    def __init__(self, path=None, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._lock = threading.Lock()
+        self._idle = []
+        self._pid = os.getpid()
+
+    def acquire(self):
+        if self._pid != os.getpid():
+            # Connections must never be shared with a parent process
+            self._reset_after_fork()
+
+        with self._lock:
+            if self._idle:
+                # Most recently used first: its page cache is the warmest
+                return self._idle.pop()
+        return connect(self.path)
+
+    def release(self, conn):
+        """Take back a connection with no transaction open"""
+        if self._pid == os.getpid():
+            with self._lock:
+                if len(self._idle) < self.size:
+                    self._idle.append(conn)
+                    return
+        conn.close()
+
+    def _reset_after_fork(self):
+        # Drop (never close) the inherited handles: closing them here would
+        # release the parent's file locks.
+        self._lock = threading.Lock()
+        self._idle = []
+        self._pid = os.getpid()
+
+    def close_all(self):
+        with self._lock:
+            connections, self._idle = self._idle, []
+        for conn in connections:
+            conn.close()
+
+
+pool = ConnectionPool()
+
+
+# Write generation: a counter bumped by every transaction that changes the
+# data the API serves. It is the validator behind the dashboard ETags.
+GENERATION_TABLE = """
+    CREATE TABLE IF NOT EXISTS WriteGeneration (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        generation INTEGER NOT NULL
+    )
+"""
+
+
+def create_generation_table(cursor):
+    cursor.execute(GENERATION_TABLE)
+    cursor.execute("INSERT OR IGNORE INTO WriteGeneration (id, generation) VALUES (1, 0)")
+
+
+def bump_generation(cursor):
+    """Mark the current write transaction as changing the served data"""
+    cursor.execute("UPDATE WriteGeneration SET generation = generation + 1 WHERE id = 1")
+
+
+def read_generation(cursor):
+    cursor.execute("SELECT generation FROM WriteGeneration WHERE id = 1")
+    return cursor.fetchone()[0]
+
+
+class GenerationWatcher:
+    """Caches the write generation for this process.
+
+    PRAGMA data_version on a private, read-only connection changes whenever
+    any other connection (in this process or another) commits, so the
+    counter table is only read again after a commit.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._data_version = None
+        self._generation = None
+
+    def current(self):
+        with self._lock:
+            if self._conn is None or self._pid != os.getpid():
+                self._conn = connect(self.path)
+                self._pid = os.getpid()
+                self._data_version = None
+
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version != self._data_version:
+                self._generation = read_generation(self._conn.cursor())
+                self._data_version = data_version
+            return self._generation
+
+
+generation_watcher = GenerationWatcher()
+
+
+def current_generation():
+    return generation_watcher.current()
+
+
+@contextmanager
+def get_db():
+    """Yield a connection for the current request.
+
+    A pooled connection goes back to the pool when the block exits. The
+    transaction is committed when the block exits normally and rolled
+    back if it raises.
+    """
+    if POOL_ENABLED:
+        conn = pool.acquire()
+    else:
+        conn = connect()
+
+    try:
+        yield conn
+        if conn.in_transaction:
+            conn.commit()
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        if POOL_ENABLED and not conn.in_transaction:
+            pool.release(conn)
+        else:
+            conn.close()
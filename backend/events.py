@@ -0,0 +1,397 @@
+"""Live feed of new triage results for GET /api/events.
+
+Resultant ids only grow, so they serve as the event ids. One poller thread
+per process reads the rows committed since the last id it saw, in this
+process or any other, and encodes each event once. It keeps the newest
+events in a ring buffer for Last-Event-ID resumes and fans them out to the
+subscribers. A subscriber is a bounded buffer; one that falls too far
+behind is sent a "reset" event telling it to reload instead of holding
+more memory. The poller touches the database only after PRAGMA
+data_version shows a commit, and stops when the last subscriber leaves.
+
+Under serve.py a stream does not keep its request thread: once the
+headers are sent the connection is handed to the process's dispatcher,
+one thread that writes every stream's frames and keep-alives to
+non-blocking sockets, so open streams cost a socket each, not a thread.
+"""
+import json
+import os
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+
+from db import connect
+
+# Events kept for Last-Event-ID resumes
+RING_SIZE = int(os.environ.get("TIB_AI_EVENTS_RING", 1000))
+# Events buffered for one subscriber before it is told to reload
+SUBSCRIBER_BUFFER = 256
+# Open streams allowed per process; each holds a socket
+MAX_SUBSCRIBERS = int(os.environ.get("TIB_AI_EVENTS_MAX_SUBSCRIBERS", 10000))
+# Seconds between data_version checks for commits made by other processes
+POLL_INTERVAL = 0.5
+# Seconds between keep-alive comments on an idle stream
+HEARTBEAT_INTERVAL = 15.0
+# Seconds between the dispatcher's checks for idle streams
+DISPATCH_TICK = 1.0
+
+SELECT_EVENTS = """
+    SELECT r.id, r.patient_id, d.name, s.name, p.location, r.confidence_score
+    FROM Resultant r
+    JOIN Patient p ON p.id = r.patient_id
+    JOIN Disease d ON d.id = r.disease_id
+    JOIN Severity s ON s.id = r.severity_id
+    WHERE r.id > ?
+    ORDER BY r.id
+    LIMIT ?
+"""
+
+
+class FeedFull(Exception):
+    """Raised when a process already holds MAX_SUBSCRIBERS streams"""
+
+
+def encode_event(row):
+    resultant_id, patient_id, disease, severity, location, confidence = row
+    data = json.dumps(
+        {
+            "patientId": patient_id,
+            "disease": disease,
+            "severity": severity,
+            "location": location,
+            "confidence": confidence,
+        },
+        separators=(",", ":"),
+    )
+    return resultant_id, f"id: {resultant_id}\nevent: triage\ndata: {data}\n\n"
+
+
+RESET_EVENT = 'event: reset\ndata: {"reason":"missed events, reload"}\n\n'
+# The comment keeps proxies from closing an idle stream and lets a write
+# to a closed client end it
+KEEP_ALIVE = ": keep-alive\n\n"
+
+
+class Subscriber:
+    def __init__(self):
+        self.events = deque()
+        self.lagged = False
+
+    def push(self, event):
+        if len(self.events) >= SUBSCRIBER_BUFFER:
+            self.events.clear()
+            self.lagged = True
+        else:
+            self.events.append(event)
+
+
+class Stream:
+    """A subscriber served by the dispatcher, with its unsent bytes"""
+
+    def __init__(self, subscriber, sock):
+        self.subscriber = subscriber
+        self.sock = sock
+        self.pending = b""
+        self.last_write = time.monotonic()
+        self.mask = 0
+
+
+class Dispatcher:
+    """The thread writing every handed-over stream of a process.
+
+    Each socket is registered for reading, which only happens when the
+    client hangs up, and for writing while part of a frame is left over. A
+    stream takes new events from its subscriber only once everything before
+    them is sent, so a slow client backs up into the subscriber's bounded
+    buffer and gets a reset event, as it would on a request thread.
+    """
+
+    def __init__(self, feed):
+        self.feed = feed
+        self._lock = threading.Lock()
+        self._added = []
+        self._streams = {}
+        self._running = True
+        self._selector = selectors.DefaultSelector()
+        self._wakeup, self._waker = socket.socketpair()
+        self._wakeup.setblocking(False)
+        self._waker.setblocking(False)
+        self._selector.register(self._wakeup, selectors.EVENT_READ)
+        threading.Thread(target=self._run, name="event-dispatcher", daemon=True).start()
+
+    def add(self, subscriber, sock):
+        """Serve subscriber on sock, which the dispatcher now owns"""
+        sock.setblocking(False)
+        with self._lock:
+            if self._running:
+                self._added.append(Stream(subscriber, sock))
+                sock = None
+        if sock is not None:
+            sock.close()
+            self.feed.unsubscribe(subscriber)
+        self.wake()
+
+    def wake(self):
+        try:
+            self._waker.send(b"\0")
+        except OSError:
+            # A full socket pair already holds a wake-up
+            pass
+
+    def _run(self):
+        next_tick = time.monotonic() + DISPATCH_TICK
+        try:
+            while not self.feed.closed:
+                ready = self._selector.select(max(next_tick - time.monotonic(), 0))
+                now = time.monotonic()
+                woken = now >= next_tick
+                for key, mask in ready:
+                    if key.data is None:
+                        woken = True
+                        self._drain_wakeups()
+                    elif mask & selectors.EVENT_READ:
+                        self._receive(key.data)
+                    else:
+                        self._send(key.data, now)
+                if woken:
+                    # New events, new streams or time for keep-alives
+                    with self._lock:
+                        added, self._added = self._added, []
+                    for stream in added:
+                        self._streams[stream.sock] = stream
+                    for stream in list(self._streams.values()):
+                        self._send(stream, now)
+                    if now >= next_tick:
+                        next_tick = now + DISPATCH_TICK
+        finally:
+            with self._lock:
+                self._running = False
+                added, self._added = self._added, []
+            # EventSource reconnects, to a worker that is not stopping
+            for stream in added + list(self._streams.values()):
+                stream.sock.close()
+                self.feed.unsubscribe(stream.subscriber)
+            self._streams.clear()
+            self._selector.close()
+            self._wakeup.close()
+            self._waker.close()
+
+    def _drain_wakeups(self):
+        try:
+            while self._wakeup.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _receive(self, stream):
+        try:
+            data = stream.sock.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._drop(stream)
+
+    def _send(self, stream, now):
+        while True:
+            if not stream.pending:
+                events = self.feed.take_events(stream.subscriber)
+                if events:
+                    stream.pending = "".join(events).encode()
+                elif now - stream.last_write >= HEARTBEAT_INTERVAL:
+                    stream.pending = KEEP_ALIVE.encode()
+                else:
+                    break
+            try:
+                sent = stream.sock.send(stream.pending)
+            except BlockingIOError:
+                break
+            except OSError:
+                self._drop(stream)
+                return
+            stream.pending = stream.pending[sent:]
+            stream.last_write = now
+            if stream.pending:
+                break
+
+        mask = selectors.EVENT_READ | (selectors.EVENT_WRITE if stream.pending else 0)
+        if not stream.mask:
+            self._selector.register(stream.sock, mask, stream)
+        elif mask != stream.mask:
+            self._selector.modify(stream.sock, mask, stream)
+        stream.mask = mask
+
+    def _drop(self, stream):
+        if stream.mask:
+            self._selector.unregister(stream.sock)
+        del self._streams[stream.sock]
+        stream.sock.close()
+        self.feed.unsubscribe(stream.subscriber)
+
+
+class EventFeed:
+    def __init__(self, path=None):
+        self.path = path
+        self._changed = threading.Condition()
+        self._subscribers = set()
+        self._ring = deque(maxlen=RING_SIZE)
+        self._last_id = None
+        self._poller = None
+        self._dispatcher = None
+        self._pid = None
+        self._closed = False
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def subscribe(self, last_event_id=None):
+        """Register a stream, replaying what it missed after last_event_id"""
+        if self._pid != os.getpid():
+            # Threads, locks and buffers do not survive a fork
+            self._changed = threading.Condition()
+            self._subscribers = set()
+            self._ring = deque(maxlen=RING_SIZE)
+            self._poller = None
+            self._dispatcher = None
+            self._pid = os.getpid()
+
+        with self._changed:
+            if len(self._subscribers) >= MAX_SUBSCRIBERS:
+                raise FeedFull(f"More than {MAX_SUBSCRIBERS} open event streams")
+
+            if self._poller is None:
+                self._start()
+
+            subscriber = Subscriber()
+            if last_event_id is not None and last_event_id < self._last_id:
+                oldest = self._ring[0][0] if self._ring else self._last_id + 1
+                if last_event_id < oldest - 1:
+                    subscriber.lagged = True
+                else:
+                    for event_id, event in self._ring:
+                        if event_id > last_event_id:
+                            subscriber.push(event)
+            self._subscribers.add(subscriber)
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._changed:
+            self._subscribers.discard(subscriber)
+
+    def hand_over(self, subscriber, sock):
+        """Let the dispatcher thread write subscriber's stream to sock"""
+        with self._changed:
+            if self._dispatcher is None:
+                self._dispatcher = Dispatcher(self)
+            dispatcher = self._dispatcher
+        dispatcher.add(subscriber, sock)
+
+    def close(self):
+        """End every open stream, for a worker that is shutting down"""
+        with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+            dispatcher = self._dispatcher
+        if dispatcher is not None:
+            dispatcher.wake()
+
+    def wake(self):
+        """Check for new rows now rather than at the next poll"""
+        with self._changed:
+            self._changed.notify_all()
+
+    def next_events(self, subscriber, timeout=HEARTBEAT_INTERVAL):
+        """Wait up to timeout for events: [] if none came, None once closed"""
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while not subscriber.events and not subscriber.lagged:
+                if self._closed:
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self._changed.wait(remaining)
+            return self._take(subscriber)
+
+    def take_events(self, subscriber):
+        """The events waiting for subscriber, without blocking"""
+        if not subscriber.events and not subscriber.lagged:
+            return []
+        with self._changed:
+            return self._take(subscriber)
+
+    def _take(self, subscriber):
+        if subscriber.lagged:
+            subscriber.lagged = False
+            subscriber.events.clear()
+            return [RESET_EVENT]
+        events = list(subscriber.events)
+        subscriber.events.clear()
+        return events
+
+    def _start(self):
+        conn = connect(self.path)
+        cursor = conn.cursor()
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM Resultant")
+        self._last_id = cursor.fetchone()[0]
+        cursor.execute(SELECT_EVENTS, (max(self._last_id - RING_SIZE, 0), RING_SIZE))
+        self._ring.extend(encode_event(row) for row in cursor.fetchall())
+
+        self._poller = threading.Thread(
+            target=self._poll, args=(conn,), name="event-feed", daemon=True
+        )
+        self._poller.start()
+
+    def _poll(self, conn):
+        data_version = None
+        try:
+            while True:
+                with self._changed:
+                    if not self._subscribers:
+                        self._poller = None
+                        return
+                    self._changed.wait(POLL_INTERVAL)
+                    last_id = self._last_id
+
+                current = conn.execute("PRAGMA data_version").fetchone()[0]
+                if current == data_version:
+                    continue
+                data_version = current
+
+                rows = conn.execute(SELECT_EVENTS, (last_id, RING_SIZE + 1)).fetchall()
+                overflow = len(rows) > RING_SIZE
+                if overflow:
+                    # A bulk import added more rows than any client could
+                    # catch up on: keep the newest for resumes, reset the rest
+                    newest = conn.execute("SELECT MAX(id) FROM Resultant").fetchone()[0]
+                    rows = conn.execute(SELECT_EVENTS, (newest - RING_SIZE, RING_SIZE)).fetchall()
+                if rows:
+                    self._publish([encode_event(row) for row in rows], overflow)
+        finally:
+            conn.close()
+
+    def _publish(self, events, overflow=False):
+        with self._changed:
+            if overflow:
+                self._ring.clear()
+                self._ring.extend(events)
+                for subscriber in self._subscribers:
+                    subscriber.events.clear()
+                    subscriber.lagged = True
+            else:
+                self._ring.extend(events)
+                for subscriber in self._subscribers:
+                    for _, event in events:
+                        subscriber.push(event)
+            self._last_id = events[-1][0]
+            self._changed.notify_all()
+            dispatcher = self._dispatcher
+        if dispatcher is not None:
+            dispatcher.wake()
+
+
+event_feed = EventFeed()
@@ -0,0 +1,478 @@
+"""Generate a synthetic patient population for scale testing.
+
+Streams Patient and Resultant rows drawn from configurable distributions,
+either as CSV files in the layout of data/ (for load_data.py) or straight
+into the SQLite database through load_data's bulk import. Rows are made
+GENERATION_BATCH at a time, so memory does not grow with --patients, and
+the same --seed and settings always give the same rows in both outputs.
+
+    python generate_population.py --patients 5000000 --csv out/
+    python generate_population.py --patients 5000000 --sqlite
+    python generate_population.py --patients 1100 --csv data/ --cities data/cities.txt
+    python generate_population.py --print-config > population.json
+    python generate_population.py --patients 100000 --sqlite --config population.json
+
+Creation times run from --days before --end up to --end and follow the
+clinic hours and weekday profiles in the configuration.
+"""
+import argparse
+import bisect
+import calendar
+import csv
+import itertools
+import json
+import math
+import os
+import random
+import sqlite3
+import sys
+import time
+
+from catalogue import DISEASE_SEED, SEVERITY_SEED, SYNONYM_SEED
+import load_data
+
+# Rows drawn per batch. The random stream is consumed per batch, so this is
+# part of the output: changing it changes the rows a seed gives.
+GENERATION_BATCH = 10000
+
+DEFAULT_SEED = 2025
+
+# Every distribution can be overridden with --config, a JSON object whose
+# top-level keys replace these
+DEFAULT_CONFIG = {
+    # created_at spans this many days up to --end
+    "days": 365,
+    # Relative arrivals per local hour (0-23) and weekday (Monday first)
+    "hour_weights": [
+        1, 1, 1, 1, 1, 2, 4, 7, 10, 12, 12, 11,
+        9, 9, 10, 10, 9, 8, 7, 6, 4, 3, 2, 1,
+    ],
+    "weekday_weights": [10, 10, 10, 10, 8, 9, 6],
+    # Offset of the clinics' local time from UTC (created_at is UTC)
+    "utc_offset_hours": 5,
+    # [youngest, oldest, weight] per age band
+    "age_bands": [
+        [1, 4, 9], [5, 14, 16], [15, 29, 27], [30, 44, 21], [45, 59, 15], [60, 90, 12],
+    ],
+    "gender": {"Female": 50, "Male": 50},
+    # Share of women aged 15-45 recorded as pregnant
+    "pregnancy_rate": 0.25,
+    # City -> weight, roughly by population; --cities replaces the names
+    "cities": {
+        "Karachi": 160, "Lahore": 110, "Faisalabad": 32, "Rawalpindi": 21,
+        "Peshawar": 20, "Multan": 19, "Hyderabad": 17, "Islamabad": 10,
+        "Quetta": 10, "Bahawalpur": 8,
+    },
+    # Disease id (see catalogue.DISEASE_SEED) -> weight
+    "diseases": {"1": 20, "2": 15, "3": 20, "4": 30, "5": 15},
+    # Severity id -> weight; 1 is the most severe
+    "severities": {"1": 8, "2": 15, "3": 27, "4": 28, "5": 22},
+    # [mean, standard deviation] of the temperature in F, by disease id
+    "temperature_f": {"default": [98.6, 0.5], "1": [102.2, 1.1], "2": [101.0, 1.0],
+                      "5": [99.6, 0.8]},
+    "temperature_range": [95.0, 106.0],
+    # Systolic and diastolic [mean, sd], plus mmHg added per year over 40
+    "systolic": [118, 14],
+    "diastolic": [78, 9],
+    "pressure_per_year_over_40": 0.5,
+    # Blood glucose is log-normal around the median, in mg/dL
+    "glucose_median": 105,
+    "glucose_sigma": 0.3,
+    "glucose_range": [55, 450],
+    # Symptoms per patient, from the disease's catalogue symptoms; some are
+    # written as a synonym and some patients report an unrelated symptom
+    "symptoms_min": 2,
+    "symptoms_max": 4,
+    "synonym_rate": 0.2,
+    "unrelated_symptom_rate": 0.1,
+    "confidence_range": [0.6, 0.99],
+    # Share of patients with an image file name (the files are not created)
+    "image_rate": 0.0,
+    # Extra cases of one disease in one city: [{"disease": 1, "city":
+    # "Lahore", "start_day": 300, "days": 14, "share": 0.3}] makes 30% of
+    # the patients in that window Lahore dengue cases
+    "outbreaks": [],
+}
+
+FIRST_NAMES = {
+    "Female": ["Ayesha", "Fatima", "Mariam", "Zainab", "Hira", "Sana", "Amna", "Iqra",
+               "Nimra", "Sadia", "Rabia", "Khadija", "Mehwish", "Bushra", "Saima", "Noor"],
+    "Male": ["Ali", "Ahmed", "Bilal", "Hassan", "Usman", "Hamza", "Imran", "Faisal",
+             "Asad", "Kamran", "Zubair", "Tariq", "Saad", "Omar", "Waqas", "Yasir"],
+}
+LAST_NAMES = ["Khan", "Ahmed", "Raza", "Malik", "Hussain", "Sheikh", "Qureshi", "Butt",
+              "Chaudhry", "Siddiqui", "Javed", "Iqbal", "Abbasi", "Mirza", "Baig", "Shah"]
+
+PATIENT_HEADER = [
+    "patient_id", "patient name", "age", "gender", "location", "temprature_F",
+    "pregnancy status", "blood pressure", "blood Glucose levels", "image", "Symptoms",
+    load_data.CREATED_AT_COLUMN,
+]
+RESULTANT_HEADER = [
+    "Patient_id", "Disease_id", "Severity_id", "confidence score", load_data.CREATED_AT_COLUMN,
+]
+
+INSERT_PATIENT = """
+    INSERT INTO Patient (
+        id, name, age, gender, location, temperature_f,
+        pregnancy_status, blood_pressure, blood_glucose,
+        image_path, symptoms, created_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+INSERT_RESULT = """
+    INSERT INTO Resultant (
+        patient_id, severity_id, disease_id, confidence_score, comment, created_at
+    ) VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+
+def load_config(path=None, cities_path=None):
+    config = json.loads(json.dumps(DEFAULT_CONFIG))
+    if path:
+        with open(path, "r", encoding="utf-8") as file:
+            overrides = json.load(file)
+        unknown = set(overrides) - set(config)
+        if unknown:
+            raise ValueError(f"unknown settings: {', '.join(sorted(unknown))}")
+        config.update(overrides)
+    if cities_path:
+        config["cities"] = {city: 1 for city in read_cities(cities_path)}
+    return config
+
+
+def read_cities(path):
+    """City names from a file like data/cities.txt, one quoted name per line"""
+    with open(path, "r", encoding="utf-8") as file:
+        cities = [line.strip().replace('"', "").replace(",", "") for line in file]
+    return [city for city in cities if city]
+
+
+class Weighted:
+    """A categorical distribution drawn with bisect over cumulative weights"""
+
+    def __init__(self, weights):
+        self.values = list(weights)
+        self.cumulative = list(itertools.accumulate(float(w) for w in weights.values()))
+        if not self.values or self.cumulative[-1] <= 0:
+            raise ValueError("a distribution needs at least one positive weight")
+
+    def draw(self, rng, count):
+        return rng.choices(self.values, cum_weights=self.cumulative, k=count)
+
+
+class ArrivalClock:
+    """Increasing creation times following the hourly and weekday profiles.
+
+    The span is cut into hours with a relative arrival rate each. Row i of
+    count is placed at a random point of the i-th equal slice of the total
+    rate, found by walking the hours forward, so times never go backwards
+    and nothing but the current hour is kept.
+    """
+
+    def __init__(self, config, end, count, rng):
+        self.hours = config["days"] * 24
+        # Whole hours, ending with the last full hour before end
+        self.start = (end // 3600 - self.hours) * 3600
+        # Local hours since the epoch at the start; the epoch was a Thursday
+        self.local_start = (self.start + config["utc_offset_hours"] * 3600) // 3600
+        self.hour_weights = config["hour_weights"]
+        self.weekday_weights = config["weekday_weights"]
+        self.rng = rng
+
+        total = sum(self.rate(hour) for hour in range(self.hours))
+        if total <= 0:
+            raise ValueError("hour_weights and weekday_weights allow no arrivals")
+        self.step = total / max(count, 1)
+        self._hour = 0
+        self._before = 0.0
+
+    def rate(self, hour):
+        local = self.local_start + hour
+        weekday = (local // 24 + 3) % 7
+        return float(self.hour_weights[local % 24]) * self.weekday_weights[weekday]
+
+    def at(self, index):
+        """Epoch seconds of row index; indexes must be asked for in order"""
+        target = (index + self.rng.random()) * self.step
+        rate = self.rate(self._hour)
+        while target >= self._before + rate and self._hour < self.hours - 1:
+            self._before += rate
+            self._hour += 1
+            rate = self.rate(self._hour)
+        fraction = min(1.0, (target - self._before) / rate) if rate else 0.0
+        return self.start + (self._hour + fraction) * 3600
+
+    def day(self, seconds):
+        return int((seconds - self.start) // 86400)
+
+
+class Population:
+    """Draws the patients and their triage results, batch by batch"""
+
+    def __init__(self, config, patients, seed=DEFAULT_SEED, end=None, first_id=1):
+        self.config = config
+        self.patients = patients
+        self.first_id = first_id
+        self.rng = random.Random(seed)
+        self.clock = ArrivalClock(config, int(time.time() if end is None else end),
+                                  patients, self.rng)
+
+        known = {disease_id: symptoms for disease_id, _, _, symptoms, _ in DISEASE_SEED}
+        self.diseases = Weighted({int(k): w for k, w in config["diseases"].items()})
+        for disease_id in self.diseases.values:
+            if disease_id not in known:
+                raise ValueError(f"disease {disease_id} is not in the catalogue")
+        severities = {severity_id for severity_id, _, _, _ in SEVERITY_SEED}
+        self.severities = Weighted({int(k): w for k, w in config["severities"].items()})
+        for severity_id in self.severities.values:
+            if severity_id not in severities:
+                raise ValueError(f"severity {severity_id} is not in the catalogue")
+
+        # Every choice of symptoms per disease and count, in catalogue order
+        self.symptom_sets = {
+            disease_id: {
+                count: list(itertools.combinations(symptoms, count))
+                for count in range(1, len(symptoms) + 1)
+            }
+            for disease_id, symptoms in known.items()
+        }
+        self.all_symptoms = sorted({s for symptoms in known.values() for s in symptoms})
+        self.genders = Weighted(config["gender"])
+        self.names = {
+            gender: [f"{first} {last}" for first in FIRST_NAMES.get(gender, FIRST_NAMES["Female"])
+                     for last in LAST_NAMES]
+            for gender in self.genders.values
+        }
+        self.cities = Weighted(config["cities"])
+        self.age_bands = Weighted({(low, high): w for low, high, w in config["age_bands"]})
+        temperatures = config["temperature_f"]
+        self.temperatures = {
+            disease_id: temperatures.get(str(disease_id), temperatures["default"])
+            for disease_id in known
+        }
+        self.outbreaks = sorted(
+            (o["start_day"], o["start_day"] + o["days"], o["share"], int(o["disease"]), o["city"])
+            for o in config["outbreaks"]
+        )
+        self.outbreak_starts = [start for start, *_ in self.outbreaks]
+
+    def batches(self):
+        """Yield lists of row dicts, GENERATION_BATCH (or fewer at the end) at a time"""
+        for offset in range(0, self.patients, GENERATION_BATCH):
+            count = min(GENERATION_BATCH, self.patients - offset)
+            yield self.draw_batch(offset, count)
+
+    def draw_batch(self, offset, count):
+        rng, config = self.rng, self.config
+        genders = self.genders.draw(rng, count)
+        bands = self.age_bands.draw(rng, count)
+        cities = self.cities.draw(rng, count)
+        diseases = self.diseases.draw(rng, count)
+        severities = self.severities.draw(rng, count)
+        low_temperature, high_temperature = config["temperature_range"]
+        low_glucose, high_glucose = config["glucose_range"]
+        low_confidence, high_confidence = config["confidence_range"]
+        glucose_mu = math.log(config["glucose_median"])
+
+        rows = []
+        for i in range(count):
+            index = offset + i
+            patient_id = self.first_id + index
+            created = self.clock.at(index)
+            gender, city, disease_id = genders[i], cities[i], diseases[i]
+            disease_id, city = self.apply_outbreaks(created, disease_id, city)
+
+            low, high = bands[i]
+            age = low + int(rng.random() * (high - low + 1))
+            mean, sd = self.temperatures[disease_id]
+            temperature = min(high_temperature, max(low_temperature, rng.gauss(mean, sd)))
+            pressure_shift = max(0, age - 40) * config["pressure_per_year_over_40"]
+            systolic = round(rng.gauss(*config["systolic"]) + pressure_shift)
+            diastolic = round(rng.gauss(*config["diastolic"]) + pressure_shift / 2)
+            glucose = rng.lognormvariate(glucose_mu, config["glucose_sigma"])
+            pregnant = (
+                gender == "Female" and 15 <= age <= 45
+                and rng.random() < config["pregnancy_rate"]
+            )
+            has_image = rng.random() < config["image_rate"]
+
+            rows.append({
+                "id": patient_id,
+                "name": rng.choice(self.names[gender]),
+                "age": age,
+                "gender": gender,
+                "location": city,
+                "temperature_f": round(temperature, 1),
+                "pregnant": pregnant,
+                "blood_pressure": f"{systolic}-{min(diastolic, systolic - 10)}",
+                "blood_glucose": round(min(high_glucose, max(low_glucose, glucose))),
+                "image": f"img_{patient_id:06d}.jpg" if has_image else None,
+                "symptoms": self.draw_symptoms(disease_id),
+                "created_at": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(created)),
+                "disease_id": disease_id,
+                "severity_id": severities[i],
+                "confidence": round(rng.uniform(low_confidence, high_confidence), 2),
+            })
+        return rows
+
+    def apply_outbreaks(self, created, disease_id, city):
+        if not self.outbreaks:
+            return disease_id, city
+        day = self.clock.day(created)
+        for start, end, share, outbreak_disease, outbreak_city in self.outbreaks[
+            :bisect.bisect_right(self.outbreak_starts, day)
+        ]:
+            if day < end and self.rng.random() < share:
+                return outbreak_disease, outbreak_city
+        return disease_id, city
+
+    def draw_symptoms(self, disease_id):
+        rng, config = self.rng, self.config
+        sets = self.symptom_sets[disease_id]
+        count = min(len(sets), rng.randint(config["symptoms_min"], config["symptoms_max"]))
+        symptoms = []
+        for symptom in rng.choice(sets[count]):
+            synonyms = SYNONYM_SEED.get(symptom)
+            if synonyms and rng.random() < config["synonym_rate"]:
+                symptom = rng.choice(synonyms)
+            symptoms.append(symptom)
+        if rng.random() < config["unrelated_symptom_rate"]:
+            symptoms.append(rng.choice(self.all_symptoms))
+        return ", ".join(symptoms)
+
+
+def result_comment(confidence):
+    # The comment load_data.py writes for imported results
+    return f"AI detected disease with {confidence * 100:.1f}% confidence"
+
+
+def write_csv(population, directory):
+    """Write patient data.csv and resultant data.csv into directory"""
+    os.makedirs(directory, exist_ok=True)
+    patients_path = os.path.join(directory, os.path.basename(load_data.PATIENT_CSV))
+    resultants_path = os.path.join(directory, os.path.basename(load_data.RESULTANT_CSV))
+    progress = load_data.Progress("Patients")
+
+    with open(patients_path, "w", encoding="utf-8", newline="") as patient_file, \
+            open(resultants_path, "w", encoding="utf-8", newline="") as resultant_file:
+        # The same quoting as the files in data/
+        patients = csv.writer(patient_file, quoting=csv.QUOTE_ALL)
+        resultants = csv.writer(resultant_file)
+        patients.writerow(PATIENT_HEADER)
+        resultants.writerow(RESULTANT_HEADER)
+
+        for rows in population.batches():
+            patients.writerows(
+                (
+                    f"25x{row['id']:03d}", row["name"], row["age"], row["gender"],
+                    row["location"], row["temperature_f"], "Yes" if row["pregnant"] else "No",
+                    row["blood_pressure"], row["blood_glucose"], row["image"] or "None",
+                    row["symptoms"], row["created_at"],
+                )
+                for row in rows
+            )
+            resultants.writerows(
+                (
+                    f"25x{row['id']:03d}", row["disease_id"], row["severity_id"],
+                    row["confidence"], row["created_at"],
+                )
+                for row in rows
+            )
+            progress.add(len(rows))
+    progress.report(done=True)
+    print(f"Wrote {patients_path} and {resultants_path}")
+
+
+def insert_population(cursor, population):
+    progress = load_data.Progress("Patients")
+    for rows in population.batches():
+        cursor.executemany(
+            INSERT_PATIENT,
+            (
+                (
+                    row["id"], row["name"], row["age"], row["gender"], row["location"],
+                    row["temperature_f"], "yes" if row["pregnant"] else "no",
+                    row["blood_pressure"], row["blood_glucose"],
+                    os.path.join("uploads", row["image"]) if row["image"] else None,
+                    row["symptoms"], row["created_at"],
+                )
+                for row in rows
+            ),
+        )
+        cursor.executemany(
+            INSERT_RESULT,
+            (
+                (
+                    row["id"], row["severity_id"], row["disease_id"], row["confidence"],
+                    result_comment(row["confidence"]), row["created_at"],
+                )
+                for row in rows
+            ),
+        )
+        progress.add(len(rows))
+    progress.report(done=True)
+
+
+def next_patient_id():
+    conn = sqlite3.connect(load_data.DB_PATH)
+    try:
+        return conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM Patient").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def parse_end(value):
+    """Epoch seconds of a YYYY-MM-DD or YYYY-MM-DD HH:MM:SS UTC time"""
+    for layout in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            return calendar.timegm(time.strptime(value, layout))
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f"not a date: {value}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument("--csv", metavar="DIR",
+                        help="write patient data.csv and resultant data.csv into DIR")
+    output.add_argument("--sqlite", action="store_true",
+                        help="insert into the database at TIB_AI_DB_PATH (appends after "
+                             "the existing patients)")
+    output.add_argument("--print-config", action="store_true",
+                        help="print the default distributions as JSON and exit")
+    parser.add_argument("--patients", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--config", help="JSON file overriding distributions")
+    parser.add_argument("--cities", help="file of city names, like data/cities.txt, "
+                                         "used with equal weights")
+    parser.add_argument("--end", type=parse_end,
+                        help="UTC date or time of the newest patient (default: now); "
+                             "fix it to reproduce a dataset exactly")
+    args = parser.parse_args()
+
+    if args.print_config:
+        json.dump(DEFAULT_CONFIG, sys.stdout, indent=2)
+        print()
+        return
+    if not args.csv and not args.sqlite:
+        parser.error("choose --csv DIR or --sqlite")
+    if args.patients < 1:
+        parser.error("--patients must be at least 1")
+
+    try:
+        config = load_config(args.config, args.cities)
+        if args.sqlite:
+            load_data.initialize_db()
+            population = Population(config, args.patients, args.seed, args.end,
+                                    first_id=next_patient_id())
+            load_data.bulk_load(lambda cursor: insert_population(cursor, population))
+        else:
+            population = Population(config, args.patients, args.seed, args.end)
+            write_csv(population, args.csv)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+
+if __name__ == "__main__":
+    main()
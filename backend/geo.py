@@ -0,0 +1,283 @@
+"""District geometry for the disease maps.
+
+The GADM level-3 polygons are read once per process. For each zoom level
+they are simplified with Douglas-Peucker at about half a screen pixel,
+rounded to the precision that zoom can show, and encoded to JSON text. A
+map response joins the encoded geometry with the region counts of one
+disease, and is gzipped once per write generation.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+GEOJSON_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "data", "gadm41_PAK_3.json"
+)
+
+# Zoom level -> (simplification tolerance in degrees, decimals kept)
+ZOOM_LEVELS = {
+    4: (0.04, 2),
+    5: (0.02, 3),
+    6: (0.01, 3),
+    7: (0.005, 3),
+    8: (0.0025, 4),
+}
+DEFAULT_ZOOM = 5
+
+# Suffixes GADM adds when it splits a district, as in "Karachi East"
+SPLIT_SUFFIXES = {"1", "2", "central", "east", "west", "north", "south"}
+
+# Fill of districts without cases, matching the green zone
+NO_CASES_COLOR = "#52C41A"
+
+# Joined map bodies kept per process, one per disease x zoom level
+MAP_CACHE_ENTRIES = 64
+
+
+def perpendicular_distance(point, start, end):
+    (x, y), (x1, y1), (x2, y2) = point, start, end
+    dx, dy = x2 - x1, y2 - y1
+    if dx == 0 and dy == 0:
+        return ((x - x1) ** 2 + (y - y1) ** 2) ** 0.5
+    # Distance to the segment, not the infinite line, so spikes are kept
+    t = max(0.0, min(1.0, ((x - x1) * dx + (y - y1) * dy) / (dx * dx + dy * dy)))
+    return ((x - x1 - t * dx) ** 2 + (y - y1 - t * dy) ** 2) ** 0.5
+
+
+def douglas_peucker(points, tolerance):
+    """Return the points of the line kept at the given tolerance"""
+    if len(points) < 3:
+        return list(points)
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        farthest, distance = None, tolerance
+        for i in range(first + 1, last):
+            d = perpendicular_distance(points[i], points[first], points[last])
+            if d > distance:
+                farthest, distance = i, d
+        if farthest is not None:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def simplify_ring(ring, tolerance, decimals):
+    """Simplify a closed ring; None if it shrinks below a triangle"""
+    simplified = []
+    for x, y in douglas_peucker(ring, tolerance):
+        point = [round(x, decimals), round(y, decimals)]
+        if not simplified or point != simplified[-1]:
+            simplified.append(point)
+    if len(simplified) < 4:
+        return None
+    return simplified
+
+
+def simplify_polygon(rings, tolerance, decimals):
+    exterior = simplify_ring(rings[0], tolerance, decimals)
+    if exterior is None:
+        return None
+    holes = [simplify_ring(ring, tolerance, decimals) for ring in rings[1:]]
+    return [exterior] + [hole for hole in holes if hole is not None]
+
+
+def simplify_geometry(geometry, tolerance, decimals):
+    if geometry["type"] == "Polygon":
+        polygons = [geometry["coordinates"]]
+    else:
+        polygons = geometry["coordinates"]
+
+    simplified = [simplify_polygon(rings, tolerance, decimals) for rings in polygons]
+    simplified = [polygon for polygon in simplified if polygon is not None]
+    if not simplified:
+        # Too small to draw at this zoom; keep a coarse outline so the
+        # district can still be hovered
+        ring = polygons[0][0]
+        step = max(1, (len(ring) - 1) // 3)
+        outline = [[round(x, decimals), round(y, decimals)] for x, y in ring[:-1:step][:3]]
+        simplified = [[outline + [outline[0]]]]
+
+    if len(simplified) == 1:
+        return {"type": "Polygon", "coordinates": simplified[0]}
+    return {"type": "MultiPolygon", "coordinates": simplified}
+
+
+def ring_centroid(ring):
+    """(area, [lat, lon]) of a ring, by the shoelace formula"""
+    area = cx = cy = 0.0
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+        cross = x1 * y2 - x2 * y1
+        area += cross
+        cx += (x1 + x2) * cross
+        cy += (y1 + y2) * cross
+    if area == 0:
+        x, y = ring[0]
+        return 0.0, [y, x]
+    return abs(area) / 2, [round(cy / (3 * area), 4), round(cx / (3 * area), 4)]
+
+
+def feature_center(geometry):
+    """Centroid of the largest polygon, as [lat, lon] for Leaflet"""
+    if geometry["type"] == "Polygon":
+        polygons = [geometry["coordinates"]]
+    else:
+        polygons = geometry["coordinates"]
+    return max((ring_centroid(rings[0]) for rings in polygons), key=lambda c: c[0])[1]
+
+
+def normalise_name(name):
+    return " ".join(name.lower().split())
+
+
+class DistrictMap:
+    """The district features, simplified per zoom level and indexed by name"""
+
+    def __init__(self, path=GEOJSON_PATH):
+        with open(path, "r", encoding="utf-8") as file:
+            features = json.load(file)["features"]
+
+        self.names = []
+        self.centers = []
+        for feature in features:
+            properties = feature["properties"]
+            # The same name fallback the map component used before
+            self.names.append(
+                properties.get("NAME_2") or properties.get("NAME_3") or properties.get("name")
+            )
+            self.centers.append(feature_center(feature["geometry"]))
+
+        self.geometry = {
+            zoom: [
+                json.dumps(
+                    simplify_geometry(feature["geometry"], tolerance, decimals),
+                    separators=(",", ":"),
+                )
+                for feature in features
+            ]
+            for zoom, (tolerance, decimals) in ZOOM_LEVELS.items()
+        }
+
+        # Location name -> feature positions. A district GADM splits in
+        # parts ("Karachi East", "Gujranwala 2") is also found by its plain
+        # name, unless a feature has exactly that name.
+        self.index = {}
+        for position, name in enumerate(self.names):
+            self.index.setdefault(normalise_name(name), []).append(position)
+        for position, name in enumerate(self.names):
+            words = normalise_name(name).split()
+            if len(words) > 1 and words[-1] in SPLIT_SUFFIXES:
+                base = " ".join(words[:-1])
+                if base not in self.index or all(
+                    normalise_name(self.names[p]).startswith(base + " ") for p in self.index[base]
+                ):
+                    self.index.setdefault(base, []).append(position)
+
+    def features_for(self, location):
+        return self.index.get(normalise_name(location), [])
+
+    def feature_collection(self, zoom, regions, total_patients):
+        """GeoJSON text for one zoom level with the region counts joined in.
+
+        regions maps a location name to its count, percentage, zone_type
+        and color, as returned by generate_disease_location_data().
+        """
+        joined = {}
+        red_zones = []
+        for location, region in regions.items():
+            positions = self.features_for(location)
+            for position in positions:
+                joined[position] = (location, region)
+            if region["zone_type"] == "red":
+                red_zones.append(
+                    {
+                        "name": location,
+                        "center": self.centers[positions[0]] if positions else None,
+                        "count": region["count"],
+                        "percentage": region["percentage"],
+                    }
+                )
+
+        features = []
+        for position, geometry in enumerate(self.geometry[zoom]):
+            location, region = joined.get(position, (None, None))
+            properties = {"name": self.names[position]}
+            if region:
+                properties.update(
+                    location=location,
+                    count=region["count"],
+                    percentage=round(region["percentage"], 2),
+                    zone_type=region["zone_type"],
+                    color=region["color"],
+                )
+            else:
+                properties.update(count=0, percentage=0, zone_type="green", color=NO_CASES_COLOR)
+            features.append(
+                '{"type":"Feature","properties":%s,"geometry":%s}'
+                % (json.dumps(properties, separators=(",", ":")), geometry)
+            )
+
+        return (
+            '{"type":"FeatureCollection","zoom":%d,"total_patients":%d,'
+            '"red_zones":%s,"features":[%s]}'
+        ) % (
+            zoom,
+            total_patients,
+            json.dumps(red_zones, separators=(",", ":")),
+            ",".join(features),
+        )
+
+
+_district_map = None
+_district_map_lock = threading.Lock()
+
+
+def district_map():
+    """The DistrictMap of this process, built on first use"""
+    global _district_map
+    with _district_map_lock:
+        if _district_map is None:
+            _district_map = DistrictMap()
+        return _district_map
+
+
+def nearest_zoom(zoom):
+    return min(ZOOM_LEVELS, key=lambda level: (abs(level - zoom), level))
+
+
+class MapCache:
+    """Gzipped map bodies keyed by (disease id, zoom), valid for one generation"""
+
+    def __init__(self, max_entries=MAP_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, generation):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != generation:
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, generation, body):
+        """Compress and store body; returns the (generation, etag, gzip bytes) entry"""
+        raw = body.encode("utf-8")
+        entry = (generation, hashlib.sha1(raw).hexdigest(), gzip.compress(raw, 6))
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+
+map_cache = MapCache()
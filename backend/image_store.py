@@ -0,0 +1,240 @@
+"""Content-addressed store for uploaded symptom images.
+
+Uploads are streamed to a temporary file in chunks while their SHA-256 is
+computed, then moved to uploads/<aa>/<bb>/<digest>.<ext>. A picture that is
+already stored is not written again. Thumbnails for the admin report are
+made by a background thread pool, so a request never waits for them. An
+image that cannot be made into a thumbnail is logged and marked with a
+<digest>.thumb.failed file, so it is not tried again on every view; delete
+the marker to retry.
+
+Uploads from before this store kept their own names under uploads/. They
+are moved in, and duplicates merged, by a one-off command:
+
+    python image_store.py migrate
+"""
+import hashlib
+import os
+import re
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from db import bump_generation, connect
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow missing: images are stored without thumbnails
+    Image = None
+
+UPLOAD_FOLDER = "uploads"
+
+# Largest accepted upload; set TIB_AI_UPLOAD_MAX_BYTES to change it
+UPLOAD_MAX_BYTES = int(os.environ.get("TIB_AI_UPLOAD_MAX_BYTES", 10 * 1024 * 1024))
+
+CHUNK_SIZE = 64 * 1024
+THUMBNAIL_SIZE = (320, 320)
+THUMBNAIL_WORKERS = 2
+
+
+# File name of an image already in the store
+STORED_NAME = re.compile(r"^[0-9a-f]{64}\.\w+$")
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+def log(message):
+    print(f"[image_store {os.getpid()}] {message}", file=sys.stderr, flush=True)
+
+
+def shard_path(digest, extension, root=UPLOAD_FOLDER):
+    return os.path.join(root, digest[:2], digest[2:4], f"{digest}.{extension}")
+
+
+def thumbnail_path(image_path):
+    return f"{os.path.splitext(image_path)[0]}.thumb.jpg"
+
+
+def thumbnail_failure_path(image_path):
+    return f"{os.path.splitext(image_path)[0]}.thumb.failed"
+
+
+def thumbnail_failed(image_path):
+    return os.path.exists(thumbnail_failure_path(image_path))
+
+
+def save_upload(stream, extension, root=UPLOAD_FOLDER, max_bytes=UPLOAD_MAX_BYTES):
+    """Store the stream's content and return its path under root.
+
+    Raises UploadTooLarge, leaving nothing behind, once more than max_bytes
+    have been read.
+    """
+    os.makedirs(root, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+
+    fd, temp_path = tempfile.mkstemp(dir=root, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as temp:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Image is larger than {max_bytes} bytes")
+                digest.update(chunk)
+                temp.write(chunk)
+
+        path = shard_path(digest.hexdigest(), extension.lower(), root)
+        if os.path.exists(path):
+            # Same content already stored
+            os.remove(temp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+        return path
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def make_thumbnail(image_path):
+    """Write the thumbnail of image_path if it does not exist yet.
+
+    Returns the thumbnail's path, or None when the image could not be read;
+    that failure is logged and marked so it is not retried.
+    """
+    target = thumbnail_path(image_path)
+    if Image is None or os.path.exists(target):
+        return target
+    if thumbnail_failed(image_path):
+        return None
+
+    temp_path = None
+    try:
+        with Image.open(image_path) as image:
+            image.thumbnail(THUMBNAIL_SIZE)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".part")
+            with os.fdopen(fd, "wb") as temp:
+                image.convert("RGB").save(temp, "JPEG", quality=80)
+        os.replace(temp_path, target)
+        return target
+    except Exception as e:
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+        log(f"No thumbnail for {image_path}: {type(e).__name__}: {e}")
+        with open(thumbnail_failure_path(image_path), "w", encoding="utf-8") as marker:
+            marker.write(f"{type(e).__name__}: {e}\n")
+        return None
+
+
+class ThumbnailWorkers:
+    """Thread pool for thumbnails, started lazily and again after a fork"""
+
+    def __init__(self, workers=THUMBNAIL_WORKERS):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        # Images with a thumbnail scheduled, so repeated views wait for it
+        self._pending = {}
+
+    def submit(self, image_path):
+        if Image is None:
+            return None
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="thumbnail"
+                )
+                self._pid = os.getpid()
+                self._pending = {}
+            future = self._pending.get(image_path)
+            if future is not None:
+                return future
+            future = self._executor.submit(make_thumbnail, image_path)
+            self._pending[image_path] = future
+        # Outside the lock: a future already done runs the callback right away
+        future.add_done_callback(lambda _: self._done(image_path))
+        return future
+
+    def _done(self, image_path):
+        with self._lock:
+            self._pending.pop(image_path, None)
+
+    def shutdown(self):
+        """Wait for the thumbnails already scheduled"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None and self._pid == os.getpid():
+            executor.shutdown(wait=True)
+
+
+thumbnail_workers = ThumbnailWorkers()
+
+
+def schedule_thumbnail(image_path):
+    return thumbnail_workers.submit(image_path)
+
+
+def migrate_uploads(conn, root=UPLOAD_FOLDER):
+    """Move uploads stored under their own names into the content store.
+
+    Every Patient row pointing at such a file is repointed, in one
+    transaction, and the old files are deleted after it commits. Copies of
+    the same picture end up as one stored file. Paths whose file is gone
+    are left as they are. Returns (files moved, rows updated, missing).
+    """
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        cursor.execute(
+            "SELECT id, image_path FROM Patient WHERE image_path IS NOT NULL AND image_path != ''"
+        )
+        moved = {}
+        missing = set()
+        updates = []
+        for patient_id, path in cursor.fetchall():
+            if STORED_NAME.match(os.path.basename(path)) or path in missing:
+                continue
+            if path not in moved:
+                if not os.path.isfile(path) or "." not in os.path.basename(path):
+                    missing.add(path)
+                    continue
+                with open(path, "rb") as file:
+                    extension = path.rsplit(".", 1)[1]
+                    moved[path] = save_upload(file, extension, root, max_bytes=float("inf"))
+            updates.append((moved[path], patient_id))
+
+        cursor.executemany("UPDATE Patient SET image_path = ? WHERE id = ?", updates)
+        if updates:
+            bump_generation(cursor)
+        cursor.execute("COMMIT")
+    except BaseException:
+        conn.rollback()
+        raise
+
+    for path in moved:
+        os.remove(path)
+    return len(moved), len(updates), len(missing)
+
+
+def main():
+    if sys.argv[1:] != ["migrate"]:
+        print("Usage: python image_store.py migrate")
+        sys.exit(2)
+
+    conn = connect()
+    moved, updated, missing = migrate_uploads(conn)
+    conn.close()
+    print(f"{moved} files moved into {UPLOAD_FOLDER}/, {updated} patients updated, "
+          f"{missing} image paths without a file")
+
+
+if __name__ == "__main__":
+    main()
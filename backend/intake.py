@@ -0,0 +1,172 @@
+"""Group commit for POST /api/patients.
+
+A request triages its patient, hands the finished row to the intake
+writer and waits on a Future. One writer thread per process takes
+everything queued, up to MAX_GROUP rows, and stores it in a single
+transaction, so concurrent submissions share one lock acquisition and
+one commit instead of queueing on SQLite's write lock one by one. The
+queue is bounded: when it is full, submit() raises IntakeBusy and the
+endpoint answers 503 instead of piling up waiting threads.
+
+Set TIB_AI_INTAKE_GROUP_COMMIT=0 to store each patient in its own
+transaction on the request thread instead.
+"""
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+from db import bump_generation, get_db
+from events import event_feed
+import metrics
+import outbreaks
+import stats
+import trends
+
+GROUP_COMMIT = os.environ.get("TIB_AI_INTAKE_GROUP_COMMIT", "1") != "0"
+# Patients waiting for the writer before submissions are refused
+QUEUE_SIZE = int(os.environ.get("TIB_AI_INTAKE_QUEUE", 1000))
+# Patients stored in one transaction at most
+MAX_GROUP = 256
+# Seconds a request waits for room in the queue, then for its commit
+SUBMIT_TIMEOUT = 1.0
+COMMIT_TIMEOUT = 30.0
+
+INSERT_PATIENTS = """
+    INSERT INTO Patient (
+        id, name, age, gender, location, temperature_f,
+        pregnancy_status, blood_pressure, blood_glucose,
+        image_path, symptoms
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+INSERT_RESULTS = """
+    INSERT INTO Resultant (
+        patient_id, severity_id, disease_id, confidence_score, comment
+    ) VALUES (?, ?, ?, ?, ?)
+"""
+
+
+class IntakeBusy(Exception):
+    """Raised when the intake queue stays full for SUBMIT_TIMEOUT"""
+
+
+def store_patients(cursor, patients):
+    """Store triaged patients and count them in the summary tables.
+
+    patients holds (patient, diagnosis) pairs: the Patient column values
+    from name to symptoms, and (disease_id, severity_id, confidence_score,
+    comment) from triage(). Takes the write lock and returns the new
+    patient ids, in order; the caller commits.
+    """
+    # Take the write lock first so the IDs picked here stay free
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.execute(
+        """
+        SELECT MAX(
+            COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'Patient'), 0),
+            COALESCE((SELECT MAX(id) FROM Patient), 0)
+        )
+        """
+    )
+    first_id = cursor.fetchone()[0] + 1
+    patient_ids = range(first_id, first_id + len(patients))
+
+    cursor.executemany(
+        INSERT_PATIENTS,
+        [(patient_id, *patient) for patient_id, (patient, _) in zip(patient_ids, patients)],
+    )
+    cursor.executemany(
+        INSERT_RESULTS,
+        [
+            (patient_id, severity_id, disease_id, confidence, comment)
+            for patient_id, (_, (disease_id, severity_id, confidence, comment))
+            in zip(patient_ids, patients)
+        ],
+    )
+    stats.record_patients(cursor, [patient[3] for patient, _ in patients])
+    stats.record_results(
+        cursor,
+        [
+            (disease_id, severity_id, patient[3], confidence)
+            for patient, (disease_id, severity_id, confidence, _) in patients
+        ],
+    )
+    outbreaks.record_cases(
+        cursor, [(disease_id, patient[3]) for patient, (disease_id, _, _, _) in patients]
+    )
+    trends.record_patients(cursor, patient_ids)
+    trends.compact(cursor)
+    bump_generation(cursor)
+    return patient_ids
+
+
+class IntakeWriter:
+    def __init__(self):
+        self._pid = None
+        self._lock = threading.Lock()
+        self._queue = None
+
+    def submit(self, patient, diagnosis):
+        """Store one triaged patient and return its id once committed"""
+        if not GROUP_COMMIT:
+            return self._write([(patient, diagnosis)])[0]
+
+        self._ensure_started()
+        future = Future()
+        try:
+            self._queue.put(
+                (patient, diagnosis, future, metrics.current_state()), timeout=SUBMIT_TIMEOUT
+            )
+        except queue.Full:
+            raise IntakeBusy(f"More than {QUEUE_SIZE} patients waiting to be stored")
+        return future.result(timeout=COMMIT_TIMEOUT)
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # The queue and thread of a parent process do not survive a fork
+                self._queue = queue.Queue(maxsize=QUEUE_SIZE)
+                threading.Thread(target=self._run, args=(self._queue,), daemon=True).start()
+                self._pid = os.getpid()
+
+    def _run(self, pending):
+        while True:
+            group = [pending.get()]
+            while len(group) < MAX_GROUP:
+                try:
+                    group.append(pending.get_nowait())
+                except queue.Empty:
+                    break
+            self._commit_group(group)
+
+    def _commit_group(self, group):
+        try:
+            # The statements count towards every request in the group, as
+            # they would if it had stored its patient itself
+            with metrics.charged_to([state for _, _, _, state in group]):
+                patient_ids = self._write(
+                    [(patient, diagnosis) for patient, diagnosis, _, _ in group]
+                )
+        except Exception as e:
+            if isinstance(e, sqlite3.IntegrityError) and len(group) > 1:
+                # One bad row must not fail its neighbours: store them one by one
+                for item in group:
+                    self._commit_group([item])
+            else:
+                for _, _, future, _ in group:
+                    future.set_exception(e)
+            return
+        for patient_id, (_, _, future, _) in zip(patient_ids, group):
+            future.set_result(patient_id)
+
+    def _write(self, patients):
+        with get_db() as conn:
+            patient_ids = store_patients(conn.cursor(), patients)
+        event_feed.wake()
+        return patient_ids
+
+
+intake_writer = IntakeWriter()
@@ -1,10 +1,44 @@
+"""Import the CSV files in data/ into the SQLite database.
+
+    python load_data.py                # row-at-a-time import of data/*.csv
+    python load_data.py --bulk         # bulk import, for large back-catalogues
+    python load_data.py --bulk --patients big.csv --resultants big_results.csv
+"""
+import argparse
+import itertools
 import sqlite3
 import csv
 import os
+import time
 import traceback
 
-# Define the database path directly
-DB_PATH = "tib_ai.db"
+from db import DB_PATH, bump_generation
+from schema import create_indexes, drop_indexes
+import migrations
+import outbreaks
+import search
+import stats
+import trends
+
+PATIENT_CSV = "data/patient data.csv"
+RESULTANT_CSV = "data/resultant data.csv"
+
+# Optional last column of both CSV files (generate_population.py writes it);
+# rows without it are stamped with the import time
+CREATED_AT_COLUMN = "created_at"
+
+# Rows parsed and inserted per executemany batch in bulk mode
+BULK_CHUNK_SIZE = 50000
+
+# Pragmas for the bulk import connection. Durability is traded for speed:
+# a crash mid-import can leave the database corrupt, so only bulk load
+# into a database you can rebuild.
+BULK_PRAGMAS = [
+    "PRAGMA journal_mode = MEMORY",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA cache_size = -262144",  # 256 MB page cache
+    "PRAGMA temp_store = MEMORY",
+]
 
 
 def load_disease_data():
@@ -22,6 +56,7 @@ def load_disease_data():
                     (row["Disease_id"], row["Disease name"]),
                 )
 
+        bump_generation(cursor)
         conn.commit()
         print("Disease data loaded successfully")
         conn.close()
@@ -45,6 +80,7 @@ def load_severity_data():
                     (row["Severity_id"], row["Severity_id"], row["severity_title"]),
                 )
 
+        bump_generation(cursor)
         conn.commit()
         print("Severity data loaded successfully")
         conn.close()
@@ -53,7 +89,7 @@ def load_severity_data():
         traceback.print_exc()
 
 
-def load_patient_data():
+def load_patient_data(path=PATIENT_CSV):
     try:
         print("Loading patient data...")
         conn = sqlite3.connect(DB_PATH)
@@ -62,7 +98,7 @@ def load_patient_data():
         # Create uploads directory if it doesn't exist
         os.makedirs("uploads", exist_ok=True)
 
-        with open("data/patient data.csv", "r", encoding="utf-8") as file:
+        with open(path, "r", encoding="utf-8") as file:
             csv_reader = csv.DictReader(file)
             count = 0
             for row in csv_reader:
@@ -91,7 +127,7 @@ def load_patient_data():
                         id, name, age, gender, location, temperature_f, 
                         pregnancy_status, blood_pressure, blood_glucose, 
                         image_path, symptoms, created_at
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
                     """,
                     (
                         patient_id,
@@ -105,9 +141,16 @@ def load_patient_data():
                         row["blood Glucose levels"],
                         image_path,
                         row["Symptoms"],
+                        row.get(CREATED_AT_COLUMN) or None,
                     ),
                 )
 
+        # Refresh the dashboard aggregates in the same transaction
+        stats.rebuild(cursor)
+        outbreaks.rebuild(cursor)
+        trends.rebuild(cursor)
+        bump_generation(cursor)
+
         conn.commit()
         print("Patient data loaded successfully")
         conn.close()
@@ -116,13 +159,13 @@ def load_patient_data():
         traceback.print_exc()
 
 
-def load_resultant_data():
+def load_resultant_data(path=RESULTANT_CSV):
     try:
         print("Loading resultant data...")
         conn = sqlite3.connect(DB_PATH)
         cursor = conn.cursor()
 
-        with open("data/resultant data.csv", "r", encoding="utf-8") as file:
+        with open(path, "r", encoding="utf-8") as file:
             csv_reader = csv.DictReader(file)
             count = 0
             for row in csv_reader:
@@ -138,8 +181,9 @@ def load_resultant_data():
                 cursor.execute(
                     """
                     INSERT OR IGNORE INTO Resultant (
-                        patient_id, severity_id, disease_id, confidence_score, comment
-                    ) VALUES (?, ?, ?, ?, ?)
+                        patient_id, severity_id, disease_id, confidence_score, comment,
+                        created_at
+                    ) VALUES (?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
                     """,
                     (
                         patient_id,
@@ -147,9 +191,16 @@ def load_resultant_data():
                         row["Disease_id"],
                         row["confidence score"],
                         f"AI detected disease with {float(row['confidence score'])*100:.1f}% confidence",
+                        row.get(CREATED_AT_COLUMN) or None,
                     ),
                 )
 
+        # Refresh the dashboard aggregates in the same transaction
+        stats.rebuild(cursor)
+        outbreaks.rebuild(cursor)
+        trends.rebuild(cursor)
+        bump_generation(cursor)
+
         conn.commit()
         print("Resultant data loaded successfully")
         conn.close()
@@ -158,87 +209,210 @@ def load_resultant_data():
         traceback.print_exc()
 
 
-def initialize_db():
-    try:
-        print("Initializing database...")
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-
-        # Create Patient table
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS Patient (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                age INTEGER NOT NULL,
-                gender TEXT NOT NULL,
-                location TEXT NOT NULL,
-                temperature_f REAL,
-                pregnancy_status TEXT,
-                blood_pressure TEXT,
-                blood_glucose REAL,
-                image_path TEXT,
-                symptoms TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            """
+class Progress:
+    """Prints the rows loaded so far and the rate, at most every few seconds"""
+
+    def __init__(self, label, interval=2.0):
+        self.label = label
+        self.interval = interval
+        self.rows = 0
+        self.start = time.perf_counter()
+        self._last_report = self.start
+
+    def add(self, rows):
+        self.rows += rows
+        now = time.perf_counter()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            self.report()
+
+    def report(self, done=False):
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        state = "loaded" if done else "processed"
+        print(
+            f"{self.label}: {self.rows} rows {state} in {elapsed:.1f}s "
+            f"({self.rows / elapsed:,.0f} rows/s)"
         )
 
-        # Create Severity table
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS Severity (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                level INTEGER NOT NULL,
-                name TEXT NOT NULL
-            )
-            """
-        )
 
-        # Create Disease table
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS Disease (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL
-            )
+def read_chunks(path, chunk_size):
+    """Yield the CSV file as {column name: values} dicts of chunk_size rows"""
+    with open(path, "r", encoding="utf-8", newline="") as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        while True:
+            rows = [row for _, row in zip(range(chunk_size), reader)]
+            if not rows:
+                return
+            yield dict(zip(header, zip(*rows)))
+
+
+def strip_id_prefix(ids):
+    """Remove the "25x" prefix from a whole column of patient IDs"""
+    return [pid[3:] if pid.startswith("25x") else pid for pid in ids]
+
+
+def created_at_column(columns):
+    """The chunk's creation times, or NULLs for files without the column"""
+    values = columns.get(CREATED_AT_COLUMN)
+    if values is None:
+        return itertools.repeat(None)
+    return [value or None for value in values]
+
+
+def bulk_load_patients(cursor, path, chunk_size):
+    progress = Progress("Patients")
+    # Each chunk is handled column by column rather than row by row
+    for columns in read_chunks(path, chunk_size):
+        images = [
+            os.path.join("uploads", image) if image and image != "None" else None
+            for image in columns["image"]
+        ]
+        pregnancy = [
+            status.lower() if status else "no" for status in columns["pregnancy status"]
+        ]
+
+        cursor.executemany(
             """
+            INSERT OR IGNORE INTO Patient (
+                id, name, age, gender, location, temperature_f,
+                pregnancy_status, blood_pressure, blood_glucose,
+                image_path, symptoms, created_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+            """,
+            zip(
+                strip_id_prefix(columns["patient_id"]),
+                columns["patient name"],
+                columns["age"],
+                columns["gender"],
+                columns["location"],
+                columns["temprature_F"],
+                pregnancy,
+                columns["blood pressure"],
+                columns["blood Glucose levels"],
+                images,
+                columns["Symptoms"],
+                created_at_column(columns),
+            ),
         )
+        progress.add(len(columns["patient_id"]))
+    progress.report(done=True)
 
-        # Create Resultant table
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS Resultant (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                patient_id INTEGER NOT NULL,
-                severity_id INTEGER NOT NULL,
-                disease_id INTEGER NOT NULL,
-                confidence_score REAL NOT NULL,
-                comment TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (patient_id) REFERENCES Patient (id),
-                FOREIGN KEY (severity_id) REFERENCES Severity (id),
-                FOREIGN KEY (disease_id) REFERENCES Disease (id)
-            )
+
+def bulk_load_resultants(cursor, path, chunk_size):
+    progress = Progress("Resultants")
+    for columns in read_chunks(path, chunk_size):
+        confidences = [float(score) for score in columns["confidence score"]]
+        comments = [
+            f"AI detected disease with {score*100:.1f}% confidence" for score in confidences
+        ]
+
+        cursor.executemany(
             """
+            INSERT OR IGNORE INTO Resultant (
+                patient_id, severity_id, disease_id, confidence_score, comment, created_at
+            ) VALUES (?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+            """,
+            zip(
+                strip_id_prefix(columns["Patient_id"]),
+                columns["Severity_id"],
+                columns["Disease_id"],
+                confidences,
+                comments,
+                created_at_column(columns),
+            ),
         )
+        progress.add(len(confidences))
+    progress.report(done=True)
 
-        conn.commit()
-        print("Database initialized successfully")
+
+def bulk_import(patients_path=PATIENT_CSV, resultants_path=RESULTANT_CSV,
+                chunk_size=BULK_CHUNK_SIZE):
+    """Load both CSV files in one transaction with the indexes built afterwards"""
+
+    def load(cursor):
+        if patients_path:
+            bulk_load_patients(cursor, patients_path, chunk_size)
+        if resultants_path:
+            bulk_load_resultants(cursor, resultants_path, chunk_size)
+
+    bulk_load(load)
+
+
+def bulk_load(load):
+    """Run load(cursor) in one bulk transaction, then rebuild indexes and aggregates"""
+    conn = sqlite3.connect(DB_PATH, isolation_level=None)
+    for pragma in BULK_PRAGMAS:
+        conn.execute(pragma)
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("BEGIN")
+
+        # Building each index, and the search index, once at the end is
+        # much cheaper than updating it for every inserted row
+        drop_indexes(cursor)
+        search.drop_triggers(cursor)
+
+        load(cursor)
+
+        print("Creating indexes...")
+        create_indexes(cursor)
+        search.create_triggers(cursor)
+        search.rebuild(cursor)
+
+        # Refresh the dashboard aggregates in the same transaction
+        stats.rebuild(cursor)
+        outbreaks.rebuild(cursor)
+        trends.rebuild(cursor)
+        bump_generation(cursor)
+
+        cursor.execute("COMMIT")
+        print("Bulk import committed")
+    except BaseException:
+        if conn.in_transaction:
+            cursor.execute("ROLLBACK")
+        raise
+    finally:
+        # Back to the journal mode the API connections expect
+        conn.execute("PRAGMA journal_mode = WAL")
         conn.close()
+
+
+def initialize_db():
+    try:
+        print("Initializing database...")
+        conn = sqlite3.connect(DB_PATH)
+        applied = migrations.migrate(conn)
+        conn.close()
+        if applied:
+            print(f"Database migrated to version {applied[-1]}")
+        print("Database initialized successfully")
     except Exception as e:
         print(f"Error initializing database: {e}")
         traceback.print_exc()
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Import the TIB-AI CSV data")
+    parser.add_argument("--bulk", action="store_true",
+                        help="batched single-transaction import for large files")
+    parser.add_argument("--patients", default=PATIENT_CSV, help="patient CSV file")
+    parser.add_argument("--resultants", default=RESULTANT_CSV, help="resultant CSV file")
+    parser.add_argument("--chunk-size", type=int, default=BULK_CHUNK_SIZE,
+                        help="rows per batch in bulk mode")
+    args = parser.parse_args()
+
     try:
         print("Starting data import...")
         initialize_db()
         load_disease_data()
         load_severity_data()
-        load_patient_data()
-        load_resultant_data()
+        if args.bulk:
+            bulk_import(args.patients, args.resultants, args.chunk_size)
+        else:
+            load_patient_data(args.patients)
+            load_resultant_data(args.resultants)
         print("All data imported successfully!")
     except Exception as e:
         print(f"Error in main: {e}")
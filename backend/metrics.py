@@ -0,0 +1,557 @@
+"""Request and SQL metrics, served at /metrics in the Prometheus text format.
+
+Off unless TIB_AI_METRICS=1. When off, install() adds nothing to the app
+and db.connect() opens plain sqlite3 connections, so requests pay nothing.
+
+When on, every request records its latency, response size and status per
+route, and every statement run through a TracedConnection adds its count
+and time (execute plus fetches) to the request that ran it. Work a thread
+does for waiting requests, like the intake writer's group commits, is
+added to each of them through charged_to(). A statement
+slower than TIB_AI_SLOW_QUERY_MS is written to stderr once, with its
+EXPLAIN QUERY PLAN.
+
+Each process keeps its own counters. Under serve.py every worker also
+writes them to TIB_AI_METRICS_DIR every SNAPSHOT_INTERVAL seconds, and
+/metrics adds up the files of all workers, past and present.
+"""
+import fcntl
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, request
+
+ENABLED = os.environ.get("TIB_AI_METRICS", "0") == "1"
+SLOW_QUERY_SECONDS = float(os.environ.get("TIB_AI_SLOW_QUERY_MS", 100)) / 1000
+SNAPSHOT_INTERVAL = 5.0
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# Labels of statements run outside a request (feed poller, thumbnails)
+BACKGROUND_LABELS = ("", "background")
+UNMATCHED_ROUTE = "unmatched"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+RETIRED_SNAPSHOT = "retired.json"
+LOCK_FILE = ".lock"
+
+# Plans are only asked for statements EXPLAIN QUERY PLAN accepts
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+
+def log(message):
+    print(f"[metrics {os.getpid()}] {message}", file=sys.stderr, flush=True)
+
+
+class Registry:
+    """Counters and histograms keyed by metric name and label values"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}  # name -> {labels: value}
+        self.histograms = {}  # name -> {labels: [bucket counts..., sum, count]}
+
+    def inc(self, name, labels, amount=1):
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + amount
+
+    def observe(self, name, labels, value):
+        buckets = HISTOGRAMS[name][2]
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            values = series.get(labels)
+            if values is None:
+                values = series[labels] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    values[i] += 1
+                    break
+            values[-2] += value
+            values[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": {
+                    name: [[list(labels), value] for labels, value in series.items()]
+                    for name, series in self.counters.items()
+                },
+                "histograms": {
+                    name: [[list(labels), list(values)] for labels, values in series.items()]
+                    for name, series in self.histograms.items()
+                },
+            }
+
+    def merge(self, snapshot):
+        with self._lock:
+            for name, series in snapshot["counters"].items():
+                merged = self.counters.setdefault(name, {})
+                for labels, value in series:
+                    labels = tuple(labels)
+                    merged[labels] = merged.get(labels, 0) + value
+            for name, series in snapshot["histograms"].items():
+                merged = self.histograms.setdefault(name, {})
+                for labels, values in series:
+                    labels = tuple(labels)
+                    if labels in merged:
+                        merged[labels] = [a + b for a, b in zip(merged[labels], values)]
+                    else:
+                        merged[labels] = list(values)
+
+
+# name -> (help, label names)
+COUNTERS = {
+    "tib_ai_http_requests_total": (
+        "Requests answered, by route and status", ("method", "route", "status"),
+    ),
+    "tib_ai_http_request_errors_total": (
+        "Requests answered with a 5xx status", ("method", "route"),
+    ),
+    "tib_ai_sql_queries_total": ("SQL statements executed", ("method", "route")),
+    "tib_ai_sql_seconds_total": (
+        "Seconds spent executing SQL statements and fetching their rows", ("method", "route"),
+    ),
+    "tib_ai_sql_slow_queries_total": (
+        "Statements slower than the slow query threshold", ("method", "route"),
+    ),
+}
+
+# name -> (help, label names, buckets)
+HISTOGRAMS = {
+    "tib_ai_http_request_duration_seconds": (
+        "Time from receiving a request to sending the last byte of its body",
+        ("method", "route"),
+        LATENCY_BUCKETS,
+    ),
+    "tib_ai_http_response_size_bytes": (
+        "Response body bytes as sent, after compression",
+        ("method", "route"),
+        SIZE_BUCKETS,
+    ),
+    "tib_ai_http_request_sql_queries": (
+        "SQL statements executed per request",
+        ("method", "route"),
+        QUERY_COUNT_BUCKETS,
+    ),
+}
+
+
+registry = Registry()
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values, extra=None):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def exposition(merged):
+    """The registry as Prometheus text"""
+    lines = []
+    for name, (help_text, label_names) in COUNTERS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for labels, value in sorted(merged.counters.get(name, {}).items()):
+            lines.append(f"{name}{format_labels(label_names, labels)} {format_number(value)}")
+
+    for name, (help_text, label_names, buckets) in HISTOGRAMS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for labels, values in sorted(merged.histograms.get(name, {}).items()):
+            cumulative = 0
+            for bound, count in zip(buckets, values):
+                cumulative += count
+                bucket_labels = format_labels(label_names, labels, f'le="{format_number(bound)}"')
+                lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+            bucket_labels = format_labels(label_names, labels, 'le="+Inf"')
+            lines.append(f"{name}_bucket{bucket_labels} {values[-1]}")
+            series_labels = format_labels(label_names, labels)
+            lines.append(f"{name}_sum{series_labels} {format_number(values[-2])}")
+            lines.append(f"{name}_count{series_labels} {values[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+# Snapshots shared between serve.py workers
+
+
+def metrics_dir():
+    return os.environ.get("TIB_AI_METRICS_DIR")
+
+
+def _locked(directory, mode):
+    lock = open(os.path.join(directory, LOCK_FILE), "a")
+    fcntl.flock(lock, mode)
+    return lock
+
+
+def _write_json(path, data):
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as file:
+        json.dump(data, file)
+    os.replace(temporary, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_snapshot():
+    """Write this process's counters for the other workers to read"""
+    directory = metrics_dir()
+    if directory:
+        _write_json(os.path.join(directory, f"{os.getpid()}.json"), registry.snapshot())
+
+
+def retire(pid):
+    """Fold a finished worker's snapshot into the retired totals (serve.py master)"""
+    directory = metrics_dir()
+    path = os.path.join(directory, f"{pid}.json")
+    snapshot = _read_json(path)
+    if snapshot is None:
+        return
+    with _locked(directory, fcntl.LOCK_EX):
+        retired = Registry()
+        previous = _read_json(os.path.join(directory, RETIRED_SNAPSHOT))
+        if previous:
+            retired.merge(previous)
+        retired.merge(snapshot)
+        _write_json(os.path.join(directory, RETIRED_SNAPSHOT), retired.snapshot())
+        os.unlink(path)
+
+
+def collect():
+    """This process's counters plus those of every other worker"""
+    directory = metrics_dir()
+    if not directory:
+        return registry
+
+    merged = Registry()
+    merged.merge(registry.snapshot())
+    own = f"{os.getpid()}.json"
+    with _locked(directory, fcntl.LOCK_SH):
+        for filename in os.listdir(directory):
+            if filename.endswith(".json") and filename != own:
+                snapshot = _read_json(os.path.join(directory, filename))
+                if snapshot:
+                    merged.merge(snapshot)
+    return merged
+
+
+class SnapshotWriter:
+    """Writes the worker's snapshot every SNAPSHOT_INTERVAL seconds"""
+
+    def __init__(self):
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        if self._pid == os.getpid() or not metrics_dir():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(SNAPSHOT_INTERVAL)
+            try:
+                write_snapshot()
+            except OSError as e:
+                log(f"could not write snapshot: {e}")
+
+
+snapshot_writer = SnapshotWriter()
+
+
+# Per-request accounting
+
+
+class RequestState:
+    __slots__ = ("method", "route", "status", "queries", "sql_seconds", "size")
+
+    def __init__(self, method):
+        self.method = method
+        self.route = UNMATCHED_ROUTE
+        self.status = "500"
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.size = 0
+
+
+_current = threading.local()
+
+
+def current_state():
+    """The accounting of the request on this thread, or None outside requests"""
+    return getattr(_current, "state", None)
+
+
+def current_labels():
+    state = getattr(_current, "state", None)
+    return (state.method, state.route) if state is not None else BACKGROUND_LABELS
+
+
+@contextmanager
+def charged_to(states):
+    """Add the statements run in the block to each of states.
+
+    states are current_state() values of requests waiting on this thread's
+    work, so every request a shared transaction served counts all of it.
+    Call before waking them: a request's totals are read once it resumes.
+    """
+    states = [state for state in states if state is not None]
+    if not states:
+        yield
+        return
+
+    shared = RequestState(states[0].method)
+    shared.route = states[0].route
+    previous = getattr(_current, "state", None)
+    _current.state = shared
+    try:
+        yield
+    finally:
+        _current.state = previous
+        for state in states:
+            state.queries += shared.queries
+            state.sql_seconds += shared.sql_seconds
+
+
+def record_query(seconds, new_statement):
+    state = getattr(_current, "state", None)
+    if state is not None:
+        if new_statement:
+            state.queries += 1
+        state.sql_seconds += seconds
+    else:
+        # Statements outside requests are counted as they happen
+        if new_statement:
+            registry.inc("tib_ai_sql_queries_total", BACKGROUND_LABELS)
+        registry.inc("tib_ai_sql_seconds_total", BACKGROUND_LABELS, seconds)
+
+
+def finish_request(state, elapsed):
+    labels = (state.method, state.route)
+    registry.inc("tib_ai_http_requests_total", labels + (state.status,))
+    if state.status.startswith("5"):
+        registry.inc("tib_ai_http_request_errors_total", labels)
+    registry.observe("tib_ai_http_request_duration_seconds", labels, elapsed)
+    registry.observe("tib_ai_http_response_size_bytes", labels, state.size)
+    registry.observe("tib_ai_http_request_sql_queries", labels, state.queries)
+    if state.queries:
+        registry.inc("tib_ai_sql_queries_total", labels, state.queries)
+        registry.inc("tib_ai_sql_seconds_total", labels, state.sql_seconds)
+
+
+class TimedBody:
+    """Response iterable that finishes the request's metrics when closed"""
+
+    def __init__(self, body, state, start):
+        self.body = body
+        self.state = state
+        self.start = start
+
+    def __iter__(self):
+        for chunk in self.body:
+            self.state.size += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self.body, "close"):
+                self.body.close()
+        finally:
+            finish_request(self.state, time.perf_counter() - self.start)
+            _current.state = None
+
+
+class RequestMetrics:
+    """WSGI middleware timing each request until its body is fully sent.
+
+    Streamed responses (patient pages, the event feed) are generated after
+    the view returns, so the time is taken when the server closes the body.
+    An event stream handed to the feed's dispatcher is timed up to the
+    hand-over.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        snapshot_writer.ensure_started()
+        state = RequestState(environ.get("REQUEST_METHOD", "GET"))
+        _current.state = state
+        start = time.perf_counter()
+
+        def timed_start_response(status, headers, exc_info=None):
+            state.status = status.split(" ", 1)[0]
+            return start_response(status, headers, exc_info)
+
+        try:
+            body = self.wsgi_app(environ, timed_start_response)
+        except BaseException:
+            finish_request(state, time.perf_counter() - start)
+            _current.state = None
+            raise
+        return TimedBody(body, state, start)
+
+
+def set_route():
+    """before_request hook: label the request with its URL rule"""
+    state = getattr(_current, "state", None)
+    if state is not None and request.url_rule is not None:
+        state.route = request.url_rule.rule
+
+
+def metrics_view():
+    return Response(exposition(collect()), content_type=CONTENT_TYPE)
+
+
+def install(app):
+    """Add the middleware and GET /metrics to app when metrics are enabled"""
+    if not ENABLED:
+        return
+    app.before_request(set_route)
+    app.add_url_rule("/metrics", "metrics", metrics_view, methods=["GET"])
+    app.wsgi_app = RequestMetrics(app.wsgi_app)
+
+
+# SQL tracing
+
+
+def log_slow_query(connection, sql, parameters, seconds):
+    labels = current_labels()
+    registry.inc("tib_ai_sql_slow_queries_total", labels)
+    lines = [
+        f"slow query in {' '.join(labels).strip()}: {seconds * 1000:.1f} ms",
+        "    " + " ".join(sql.split()),
+    ]
+    if parameters is not None and sql.lstrip().upper().startswith(EXPLAINABLE):
+        try:
+            # A plain cursor, so the plan itself is not traced
+            plan = sqlite3.Cursor(connection).execute("EXPLAIN QUERY PLAN " + sql, parameters)
+            lines.extend(f"    {row[-1]}" for row in plan.fetchall())
+        except sqlite3.Error as e:
+            lines.append(f"    (no plan: {e})")
+    log("\n".join(lines))
+
+
+class TracedCursor(sqlite3.Cursor):
+    """Cursor that times each statement, including the fetching of its rows"""
+
+    _sql = None
+    _parameters = None
+    _elapsed = 0.0
+    _reported = False
+
+    def _timed(self, start, new_statement):
+        elapsed = time.perf_counter() - start
+        record_query(elapsed, new_statement)
+        self._elapsed += elapsed
+        if self._elapsed > SLOW_QUERY_SECONDS and not self._reported and self._sql:
+            self._reported = True
+            log_slow_query(self.connection, self._sql, self._parameters, self._elapsed)
+
+    def _begin(self, sql, parameters):
+        self._sql = sql
+        self._parameters = parameters
+        self._elapsed = 0.0
+        self._reported = False
+
+    def execute(self, sql, parameters=()):
+        self._begin(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._timed(start, True)
+
+    def executemany(self, sql, seq_of_parameters):
+        # The plan would need one parameter set, and the sequence may be a generator
+        self._begin(sql, None)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._timed(start, True)
+
+    def executescript(self, sql_script):
+        self._begin(sql_script, None)
+        start = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            self._timed(start, True)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            self._timed(start, False)
+
+    def fetchmany(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().fetchmany(*args, **kwargs)
+        finally:
+            self._timed(start, False)
+
+    def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self._timed(start, False)
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            return super().__next__()
+        finally:
+            self._timed(start, False)
+
+
+class TracedConnection(sqlite3.Connection):
+    """Connection whose cursors, including those of execute(), are traced"""
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+def connection_factory():
+    """The sqlite3 connection class db.connect() should open"""
+    return TracedConnection if ENABLED else sqlite3.Connection
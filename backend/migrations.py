@@ -0,0 +1,96 @@
+"""Versioned schema migrations, shared by app.py, load_data.py and serve.py.
+
+PRAGMA user_version holds the number of MIGRATIONS applied to a database.
+migrate() reads it, and only when the code knows more migrations does it
+take the write lock, apply the missing ones in order in one transaction
+and store the new version. On a current database it is one PRAGMA read.
+
+The first migrations are the schema as it stood before it was versioned.
+They are idempotent (CREATE ... IF NOT EXISTS, seeding only empty tables),
+so a database from before versioning, at user_version 0, is adopted by
+running them all. Later migrations may assume the ones before them ran.
+
+    python migrations.py   # migrate the database at TIB_AI_DB_PATH
+"""
+import catalogue
+import outbreaks
+import search
+import stats
+import trends
+from db import connect, create_generation_table
+from schema import (
+    create_base_tables,
+    create_dashboard_indexes,
+    create_filter_indexes,
+    create_retriage_progress,
+)
+
+# (version, description, function taking a cursor), in order
+MIGRATIONS = [
+    (1, "Patient, Severity, Disease and Resultant", create_base_tables),
+    (2, "Symptom catalogue", catalogue.create_tables),
+    (3, "Indexes for the dashboard joins", create_dashboard_indexes),
+    (4, "Summary tables behind the dashboard", stats.create_tables),
+    (5, "Outbreak state", outbreaks.create_tables),
+    (6, "Write generation behind the ETags", create_generation_table),
+    (7, "Full-text search over patients", search.create_tables),
+    (8, "Indexes for patient filters and sorts", create_filter_indexes),
+    (9, "Hourly, daily and weekly case counts", trends.create_tables),
+    (10, "Catalogue changes bump the write generation", catalogue.create_generation_triggers),
+    (11, "Severity names and actions from the seed", catalogue.reconcile_severities),
+    (12, "Re-triage progress", create_retriage_progress),
+    (13, "Disease names, symptoms and precautions from the seed", catalogue.reconcile_diseases),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def read_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """Bring the schema on conn up to LATEST_VERSION; returns the versions applied"""
+    if read_version(conn) >= LATEST_VERSION:
+        return []
+
+    # Persistent, and refused inside a transaction, so set once here
+    conn.execute("PRAGMA journal_mode = WAL")
+    if conn.in_transaction:
+        conn.commit()
+
+    # Other processes starting at the same time wait here, then find the
+    # work done when they read the version again
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        current = read_version(conn)
+        cursor = conn.cursor()
+        applied = []
+        for version, _, apply in MIGRATIONS:
+            if version > current:
+                apply(cursor)
+                applied.append(version)
+        if applied:
+            cursor.execute(f"PRAGMA user_version = {applied[-1]}")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return applied
+
+
+def main():
+    conn = connect()
+    try:
+        before = read_version(conn)
+        applied = migrate(conn)
+    finally:
+        conn.close()
+    for version, description, _ in MIGRATIONS:
+        if version in applied:
+            print(f"Applied {version}: {description}")
+    print(f"Schema at version {applied[-1] if applied else before}")
+
+
+if __name__ == "__main__":
+    main()
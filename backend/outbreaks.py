@@ -0,0 +1,221 @@
+"""Outbreak detection per disease x location.
+
+OutbreakState keeps one row per disease x location. Each row holds the
+case count of the current day, an EWMA baseline (mean and variance) of
+earlier daily counts, and a one-sided CUSUM of their standardised excess.
+Each new case updates its row in the insert transaction. When a day
+closes, its count is folded into the baseline. So the alarm flag is always
+current, and GET /api/outbreaks only reads the flagged rows.
+
+    python outbreaks.py rebuild   # replay all of Resultant into the table
+"""
+import math
+import sys
+import time
+
+from db import bump_generation, connect
+
+# Weight of the newest day in the EWMA baseline
+EWMA_ALPHA = 0.1
+# CUSUM allowance and decision threshold, in standard deviations
+CUSUM_K = 0.5
+CUSUM_H = 4.0
+# Alarm when today's count is this many standard deviations above baseline
+Z_THRESHOLD = 3.0
+# Fewer cases than this in a day never raise an alarm
+MIN_CASES = 3
+# Days of baseline needed before a disease x location can alarm
+MIN_HISTORY_DAYS = 7
+# Quiet days folded into the baseline after a gap; later ones change nothing
+MAX_GAP_DAYS = 90
+# Alarms stay visible for the day after the one that raised them
+ALARM_DAYS = 2
+
+OUTBREAK_TABLE = """
+    CREATE TABLE IF NOT EXISTS OutbreakState (
+        disease_id INTEGER NOT NULL,
+        location TEXT NOT NULL,
+        day INTEGER NOT NULL,
+        day_count INTEGER NOT NULL,
+        mean REAL NOT NULL,
+        variance REAL NOT NULL,
+        cusum REAL NOT NULL,
+        history_days INTEGER NOT NULL,
+        z_score REAL NOT NULL,
+        alarm INTEGER NOT NULL,
+        PRIMARY KEY (disease_id, location)
+    )
+"""
+ALARM_INDEX = "CREATE INDEX IF NOT EXISTS idx_outbreak_alarm ON OutbreakState (alarm, day)"
+
+SELECT_STATE = """
+    SELECT day, day_count, mean, variance, cusum, history_days
+    FROM OutbreakState
+    WHERE disease_id = ? AND location = ?
+"""
+SAVE_STATE = """
+    INSERT OR REPLACE INTO OutbreakState (
+        disease_id, location, day, day_count, mean, variance, cusum, history_days,
+        z_score, alarm
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def today():
+    """Days since the Unix epoch, in UTC like CURRENT_TIMESTAMP"""
+    return int(time.time() // 86400)
+
+
+def create_tables(cursor):
+    """Create OutbreakState, filling it if the database already has data"""
+    cursor.execute(
+        "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'OutbreakState'"
+    )
+    missing = cursor.fetchone()[0] == 0
+
+    cursor.execute(OUTBREAK_TABLE)
+    cursor.execute(ALARM_INDEX)
+
+    if missing:
+        rebuild(cursor)
+
+
+def close_day(state, count):
+    """Fold a finished day's count into (mean, variance, cusum, history_days)"""
+    mean, variance, cusum, history_days = state
+    sd = math.sqrt(max(variance, 1.0))
+    cusum = max(0.0, cusum + (count - mean) / sd - CUSUM_K)
+    delta = count - mean
+    mean += EWMA_ALPHA * delta
+    variance = (1 - EWMA_ALPHA) * (variance + EWMA_ALPHA * delta * delta)
+    return mean, variance, cusum, history_days + 1
+
+
+def advance(row, day, cases):
+    """Return the state row after `cases` new cases on `day`"""
+    if row is None:
+        return day, cases, 0.0, 0.0, 0.0, 0
+
+    state_day, day_count, *state = row
+    if day <= state_day:
+        # Same day, or a late row for a day already closed
+        return (state_day, day_count + cases, *state)
+
+    state = close_day(state, day_count)
+    for _ in range(min(day - state_day - 1, MAX_GAP_DAYS)):
+        state = close_day(state, 0)
+    return (day, cases, *state)
+
+
+def alarm_statistics(day_count, mean, variance, cusum, history_days):
+    """(z score, CUSUM including today, alarm) for the current day"""
+    sd = math.sqrt(max(variance, 1.0))
+    z_score = (day_count - mean) / sd
+    running_cusum = max(0.0, cusum + z_score - CUSUM_K)
+    alarm = (
+        history_days >= MIN_HISTORY_DAYS
+        and day_count >= MIN_CASES
+        and (z_score > Z_THRESHOLD or running_cusum > CUSUM_H)
+    )
+    return z_score, running_cusum, alarm
+
+
+def save(cursor, disease_id, location, row):
+    z_score, _, alarm = alarm_statistics(*row[1:])
+    cursor.execute(SAVE_STATE, (disease_id, location, *row, z_score, int(alarm)))
+
+
+def record_cases(cursor, cases, day=None):
+    """Count new cases, given (disease_id, location) pairs, on day (default today)"""
+    day = today() if day is None else day
+
+    counts = {}
+    for disease_id, location in cases:
+        key = (disease_id, location or "")
+        counts[key] = counts.get(key, 0) + 1
+
+    for (disease_id, location), count in counts.items():
+        cursor.execute(SELECT_STATE, (disease_id, location))
+        save(cursor, disease_id, location, advance(cursor.fetchone(), day, count))
+
+
+def rebuild(cursor):
+    """Recompute OutbreakState by replaying every case in created_at order"""
+    cursor.execute(
+        """
+        SELECT r.disease_id, COALESCE(p.location, ''),
+               CAST(julianday(p.created_at) - 2440587.5 AS INTEGER) AS day,
+               COUNT(*)
+        FROM Resultant r
+        JOIN Patient p ON p.id = r.patient_id
+        WHERE p.created_at IS NOT NULL
+        GROUP BY r.disease_id, COALESCE(p.location, ''), day
+        ORDER BY day
+        """
+    )
+    states = {}
+    for disease_id, location, day, count in cursor.fetchall():
+        key = (disease_id, location)
+        states[key] = advance(states.get(key), day, count)
+
+    # Bring every row up to today, so quiet days count towards the baseline
+    current_day = today()
+    cursor.execute("DELETE FROM OutbreakState")
+    for (disease_id, location), row in states.items():
+        if row[0] < current_day:
+            row = advance(row, current_day, 0)
+        save(cursor, disease_id, location, row)
+
+
+def current_alarms(cursor):
+    cursor.execute(
+        """
+        SELECT o.disease_id, d.name, o.location, o.day, o.day_count,
+               o.mean, o.variance, o.cusum, o.history_days
+        FROM OutbreakState o
+        JOIN Disease d ON d.id = o.disease_id
+        WHERE o.alarm = 1 AND o.day >= ?
+        ORDER BY o.z_score DESC
+        """,
+        (today() - ALARM_DAYS + 1,),
+    )
+    alarms = []
+    for disease_id, name, location, day, *row in cursor.fetchall():
+        day_count, mean, variance = row[:3]
+        z_score, running_cusum, _ = alarm_statistics(*row)
+        alarms.append(
+            {
+                "diseaseId": disease_id,
+                "disease": name,
+                "location": location,
+                "date": time.strftime("%Y-%m-%d", time.gmtime(day * 86400)),
+                "cases": day_count,
+                "baseline": round(mean, 2),
+                "baselineSd": round(math.sqrt(max(variance, 0.0)), 2),
+                "zScore": round(z_score, 2),
+                "cusum": round(running_cusum, 2),
+            }
+        )
+    return alarms
+
+
+def main():
+    if sys.argv[1:] != ["rebuild"]:
+        print("Usage: python outbreaks.py rebuild")
+        sys.exit(2)
+
+    # migrations imports this module, so it is imported here
+    import migrations
+
+    conn = connect()
+    migrations.migrate(conn)
+    cursor = conn.cursor()
+    rebuild(cursor)
+    bump_generation(cursor)
+    conn.commit()
+    conn.close()
+    print("Outbreak state rebuilt")
+
+
+if __name__ == "__main__":
+    main()
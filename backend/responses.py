@@ -0,0 +1,91 @@
+"""JSON encoding and gzip negotiation for API responses.
+
+jsonify() here replaces Flask's and encodes with orjson when it is
+installed. compress_response() runs after every request and gzips JSON
+bodies above GZIP_MIN_BYTES for clients that accept it, including the
+streamed patient pages.
+"""
+import gzip
+import json
+import os
+import zlib
+
+from flask import Response, request
+
+try:
+    import orjson
+except ImportError:  # orjson missing: the standard library encoder is used
+    orjson = None
+
+# Smaller bodies fit in a packet or two and are not worth compressing
+GZIP_MIN_BYTES = int(os.environ.get("TIB_AI_GZIP_MIN_BYTES", 1024))
+GZIP_LEVEL = 6
+
+COMPRESSIBLE_MIMETYPES = {"application/json", "application/geo+json"}
+
+
+def dumps(obj):
+    """Encode obj as compact JSON bytes"""
+    if orjson is not None:
+        # Integer keys (disease ids) are written as strings, as json does
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def jsonify(*args, **kwargs):
+    """flask.jsonify with the faster encoder"""
+    if args and kwargs:
+        raise TypeError("jsonify() takes either arguments or keywords, not both")
+    if len(args) == 1:
+        data = args[0]
+    else:
+        data = list(args) or kwargs
+    return Response(dumps(data), mimetype="application/json")
+
+
+def encode_list_items(items):
+    """JSON for the items of a list without the brackets, for streaming"""
+    return dumps(items)[1:-1] if items else b""
+
+
+def accepts_gzip():
+    return "gzip" in request.accept_encodings
+
+
+def gzip_bytes(body):
+    return gzip.compress(body, GZIP_LEVEL)
+
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def compress_response(response):
+    """after_request hook: gzip JSON responses for clients that accept it"""
+    if (
+        response.status_code != 200
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    if not accepts_gzip():
+        return response
+
+    if response.is_streamed:
+        # The size is unknown up front, and streamed pages are the large ones
+        response.response = gzip_stream(response.response)
+        response.headers.pop("Content-Length", None)
+    else:
+        body = response.get_data()
+        if len(body) < GZIP_MIN_BYTES:
+            return response
+        response.set_data(gzip_bytes(body))
+    response.headers["Content-Encoding"] = "gzip"
+    return response
@@ -0,0 +1,376 @@
+"""Rescore every stored diagnosis against the current catalogue.
+
+Resultant rows are read in chunks of Resultant.id, scored in a process
+pool and written back in one transaction per chunk. Each transaction also
+stores the last Resultant id it covered, so an interrupted run carries on
+where it stopped unless the catalogue has changed since.
+
+Scoring is deterministic. Each patient gets the disease whose symptoms
+match best. The stored severity is kept if the new disease allows it, or
+clamped to the nearest level it does allow, and the confidence is kept.
+Rows with no matching symptom are left as they are.
+
+    python retriage.py --workers 4 --chunk-size 5000
+    python retriage.py --restart     # ignore a saved position
+"""
+import argparse
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+
+import catalogue
+import outbreaks
+import stats
+import trends
+from db import bump_generation, connect
+from load_data import Progress
+from symptom_index import stem
+
+CHUNK_SIZE = 5000
+
+SELECT_CHUNK = """
+    SELECT r.id, r.disease_id, r.severity_id, r.confidence_score, r.comment,
+           p.location, p.symptoms
+    FROM Resultant r
+    JOIN Patient p ON p.id = r.patient_id
+    WHERE r.id > ?
+    ORDER BY r.id
+    LIMIT ?
+"""
+
+# Severity levels allowed for high-risk and other diseases, as in triage()
+HIGH_RISK_LEVELS = (1, 3)
+OTHER_LEVELS = (2, 5)
+
+
+class PhraseMatcher:
+    """Finds the symptom phrases of a SymptomIndex in many texts at once.
+
+    A chunk is tokenised with one regex pass over its joined texts, and the
+    tokens become an array of vocabulary ids through one dict lookup each,
+    made in C by map(). An n-token phrase is a base-(V + 1) number of its
+    token ids, so the phrases of each length are found at every position
+    with one searchsorted. Taking the longest phrase at each position and,
+    per text, each match after the end of the one before gives the same
+    symptoms as SymptomIndex.match().
+    """
+
+    # Joins the texts of a chunk, and its id among the tokens
+    SEPARATOR = "\0"
+    SEPARATOR_ID = -1
+    SPLIT = re.compile(r"[a-z0-9]+|\0")
+
+    def __init__(self, index, symptom_columns):
+        phrases = index.phrases()
+        vocabulary = sorted({token for tokens, _ in phrases for token in tokens})
+        # Id 0 is every token no phrase uses
+        self.token_ids = {token: i + 1 for i, token in enumerate(vocabulary)}
+        self.base = len(vocabulary) + 1
+
+        # Raw tokens by id: each stem, and the plural that stem() reduces to it
+        self.raw_ids = {self.SEPARATOR: self.SEPARATOR_ID}
+        for token, token_id in self.token_ids.items():
+            self.raw_ids[token] = token_id
+            if stem(token + "s") == token:
+                self.raw_ids[token + "s"] = token_id
+        self.longest = max((len(tokens) for tokens, _ in phrases), default=0)
+        if self.base ** self.longest >= 2 ** 63:
+            raise RuntimeError("The symptom phrases are too long to number in 64 bits")
+
+        # Sorted phrase numbers and their symptom columns, by phrase length
+        self.keys = {}
+        for length in range(1, self.longest + 1):
+            entries = sorted(
+                (self.key([self.token_ids[t] for t in tokens]), symptom_columns[symptom])
+                for tokens, symptom in phrases
+                if len(tokens) == length
+            )
+            self.keys[length] = (
+                np.array([key for key, _ in entries], dtype=np.int64),
+                np.array([column for _, column in entries], dtype=np.int64),
+            )
+
+    def key(self, ids):
+        number = 0
+        for token_id in ids:
+            number = number * self.base + token_id
+        return number
+
+    def tokenise(self, texts):
+        """Return the token ids of the joined texts and the text of each token"""
+        joined = self.SEPARATOR.join(texts)
+        if joined.count(self.SEPARATOR) >= len(texts):
+            joined = self.SEPARATOR.join(t.replace(self.SEPARATOR, " ") for t in texts)
+        joined = joined.lower()
+        tokens = self.SPLIT.findall(joined)
+        ids = np.fromiter(map(self.raw_ids.get, tokens, repeat(0)), np.int64, len(tokens))
+        separators = ids == self.SEPARATOR_ID
+        ids[separators] = 0
+        return ids, np.cumsum(separators)
+
+    def match(self, texts):
+        """Return (text, symptom column) of every match, in order within each text"""
+        ids, rows = self.tokenise(texts)
+        count = len(ids)
+        lengths = np.zeros(count, dtype=np.int64)
+        columns = np.zeros(count, dtype=np.int64)
+
+        # The phrase number of the n tokens from each position; unknown
+        # tokens and the separator have id 0, which no phrase contains
+        numbers = np.zeros(count, dtype=np.int64)
+        for length in range(1, self.longest + 1):
+            if length > count:
+                break
+            numbers = numbers[: count - length + 1] * self.base + ids[length - 1:]
+            keys, key_columns = self.keys[length]
+            if not len(keys):
+                continue
+            found = np.minimum(np.searchsorted(keys, numbers), len(keys) - 1)
+            hits = np.flatnonzero(keys[found] == numbers)
+            # Longer phrases are found later and replace shorter ones
+            lengths[hits] = length
+            columns[hits] = key_columns[found[hits]]
+
+        starts = np.flatnonzero(lengths)
+        if not len(starts):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        ends = starts + lengths[starts]
+        start_rows = rows[starts]
+
+        # Each text keeps its first match, then the first match starting at
+        # or after the end of each kept one, as the left-to-right scan does
+        following = np.minimum(np.searchsorted(starts, ends), len(starts) - 1)
+        following[(starts[following] < ends) | (start_rows[following] != start_rows)] = -1
+        kept = np.zeros(len(starts), dtype=bool)
+        current = np.flatnonzero(np.r_[True, start_rows[1:] != start_rows[:-1]])
+        while len(current):
+            kept[current] = True
+            current = following[current]
+            current = current[current >= 0]
+
+        return start_rows[kept], columns[starts[kept]]
+
+
+class Scorer:
+    """Scores many symptom texts against the catalogue with matrix products.
+
+    PhraseMatcher turns each chunk into a patients x symptoms 0/1 matrix.
+    Multiplying it by the symptoms x diseases membership matrix counts the
+    matches per disease, and by its column-normalised form gives the same
+    score as SymptomIndex.rank().
+    """
+
+    def __init__(self, snapshot):
+        self.catalogue = snapshot
+        self.disease_ids = sorted(snapshot.diseases)
+        symptoms = sorted({s for d in snapshot.diseases.values() for s in d.symptoms})
+        self.symptoms = symptoms
+        self.symptom_columns = {symptom: i for i, symptom in enumerate(symptoms)}
+        self.matcher = PhraseMatcher(snapshot.symptom_index, self.symptom_columns)
+
+        membership = np.zeros((len(symptoms), len(self.disease_ids)))
+        for j, disease_id in enumerate(self.disease_ids):
+            for symptom in snapshot.diseases[disease_id].symptoms:
+                membership[self.symptom_columns[symptom], j] = 1.0
+        self.membership = membership
+        self.weights = membership / np.maximum(membership.sum(axis=0), 1.0)
+
+        self.severity_by_level = {s.level: s for s in snapshot.severities.values()}
+
+    def best_diseases(self, texts):
+        """Return the best disease id for each text (None without a match) and the matches"""
+        rows, columns = self.matcher.match(texts)
+        found = np.zeros((len(texts), len(self.symptom_columns)))
+        found[rows, columns] = 1.0
+
+        # Each text's symptoms in order of first appearance
+        _, first = np.unique(rows * len(self.symptoms) + columns, return_index=True)
+        first.sort()
+        matches = [[] for _ in texts]
+        for row, column in zip(rows[first].tolist(), columns[first].tolist()):
+            matches[row].append(self.symptoms[column])
+
+        scores = found @ self.weights
+        counts = found @ self.membership
+        # Ties on score go to more matches, then the lowest disease id
+        best = np.argmax(scores + counts * 1e-9, axis=1)
+        matched = counts.max(axis=1, initial=0) > 0
+
+        disease_ids = [
+            self.disease_ids[column] if has_match else None
+            for column, has_match in zip(best.tolist(), matched.tolist())
+        ]
+        return disease_ids, matches
+
+    def severity_for(self, disease, severity_id):
+        low, high = HIGH_RISK_LEVELS if disease.high_risk else OTHER_LEVELS
+        current = self.catalogue.severities.get(severity_id)
+        level = min(max(current.level if current else high, low), high)
+        return self.severity_by_level.get(level, current)
+
+    def rescore(self, rows):
+        """Return (resultant id, old values, new values) for the rows that change"""
+        disease_ids, matches = self.best_diseases([row[6] or "" for row in rows])
+
+        changes = []
+        for row, disease_id, symptoms in zip(rows, disease_ids, matches):
+            if disease_id is None:
+                continue
+            resultant_id, old_disease, old_severity, confidence, old_comment, location, _ = row
+            disease = self.catalogue.diseases[disease_id]
+            severity = self.severity_for(disease, old_severity)
+            matched = [s for s in symptoms if s in disease.symptoms]
+            comment = catalogue.diagnosis_comment(disease, severity, confidence, matched)
+            if (disease_id, severity.id, comment) == (old_disease, old_severity, old_comment):
+                continue
+            changes.append(
+                (
+                    resultant_id,
+                    (old_disease, old_severity, location, confidence),
+                    (disease_id, severity.id, comment),
+                )
+            )
+        return changes
+
+
+# Scorer of each pool process, built once by init_worker
+_scorer = None
+
+
+def init_worker(expected_version):
+    global _scorer
+    conn = connect()
+    cursor = conn.cursor()
+    cursor.execute("BEGIN")
+    snapshot = catalogue.load(cursor)
+    conn.rollback()
+    conn.close()
+    if snapshot.version != expected_version:
+        raise RuntimeError("The catalogue changed while the re-triage was starting")
+    _scorer = Scorer(snapshot)
+
+
+def rescore_chunk(rows):
+    return rows[-1][0], len(rows), _scorer.rescore(rows)
+
+
+def read_chunks(conn, after, chunk_size):
+    cursor = conn.cursor()
+    while True:
+        cursor.execute(SELECT_CHUNK, (after, chunk_size))
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        after = rows[-1][0]
+        yield rows
+
+
+def write_chunk(conn, version, last_id, changes):
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        if changes:
+            resultant_ids = [resultant_id for resultant_id, _, _ in changes]
+            trends.forget_results(cursor, resultant_ids)
+            cursor.executemany(
+                "UPDATE Resultant SET disease_id = ?, severity_id = ?, comment = ? WHERE id = ?",
+                [(*new, resultant_id) for resultant_id, _, new in changes],
+            )
+            stats.forget_results(cursor, [old for _, old, _ in changes])
+            stats.record_results(
+                cursor, [(new[0], new[1], old[2], old[3]) for _, old, new in changes]
+            )
+            trends.record_results(cursor, resultant_ids)
+            trends.compact(cursor)
+            bump_generation(cursor)
+        cursor.execute(
+            """
+            INSERT INTO RetriageProgress (id, catalogue_version, last_resultant_id)
+            VALUES (1, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                catalogue_version = excluded.catalogue_version,
+                last_resultant_id = excluded.last_resultant_id
+            """,
+            (version, last_id),
+        )
+        cursor.execute("COMMIT")
+    except BaseException:
+        cursor.execute("ROLLBACK")
+        raise
+
+
+def retriage(workers=None, chunk_size=CHUNK_SIZE, restart=False):
+    # migrations imports this module, so it is imported here
+    import migrations
+
+    conn = connect()
+    migrations.migrate(conn)
+    conn.isolation_level = None
+    cursor = conn.cursor()
+
+    version = catalogue.current_catalogue().version
+    cursor.execute("SELECT catalogue_version, last_resultant_id FROM RetriageProgress")
+    saved = cursor.fetchone()
+    after = 0
+    if saved and not restart:
+        if saved[0] == version:
+            after = saved[1]
+            print(f"Resuming after Resultant id {after}")
+        else:
+            print("Catalogue changed since the last run, starting from the beginning")
+
+    reader = connect()
+    progress = Progress("Re-triage")
+    changed = 0
+    workers = workers or os.cpu_count() or 1
+
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(version,)) as pool:
+        # Keep a few chunks in flight and write them back in order, so the
+        # saved position never skips a chunk that has not been written
+        pending = deque()
+        for rows in read_chunks(reader, after, chunk_size):
+            pending.append(pool.submit(rescore_chunk, rows))
+            if len(pending) >= workers * 2:
+                changed += write_result(conn, version, pending.popleft().result(), progress)
+        while pending:
+            changed += write_result(conn, version, pending.popleft().result(), progress)
+
+    # A finished run leaves nothing to resume. The outbreak baselines are
+    # replayed once here rather than corrected chunk by chunk. Saved
+    # progress means an earlier run stopped part way, possibly after
+    # changing rows of its own, so they are replayed then too.
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.execute("DELETE FROM RetriageProgress")
+    if changed or saved:
+        outbreaks.rebuild(cursor)
+        bump_generation(cursor)
+    cursor.execute("COMMIT")
+    reader.close()
+    conn.close()
+    progress.report(done=True)
+    print(f"{changed} diagnoses changed")
+
+
+def write_result(conn, version, result, progress):
+    last_id, count, changes = result
+    write_chunk(conn, version, last_id, changes)
+    progress.add(count)
+    return len(changes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rescore every stored diagnosis")
+    parser.add_argument("--workers", type=int, default=None, help="scoring processes")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--restart", action="store_true", help="ignore a saved position")
+    args = parser.parse_args()
+
+    retriage(args.workers, args.chunk_size, args.restart)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# The original tables. Later tables and columns are added by the modules
+# that own them (catalogue, stats, outbreaks, db), each as a migration in
+# migrations.py.
+BASE_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS Patient (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        age INTEGER NOT NULL,
+        gender TEXT NOT NULL,
+        location TEXT NOT NULL,
+        temperature_f REAL,
+        pregnancy_status TEXT,
+        blood_pressure TEXT,
+        blood_glucose REAL,
+        image_path TEXT,
+        symptoms TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS Severity (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        level INTEGER NOT NULL,
+        name TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS Disease (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS Resultant (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id INTEGER NOT NULL,
+        severity_id INTEGER NOT NULL,
+        disease_id INTEGER NOT NULL,
+        confidence_score REAL NOT NULL,
+        comment TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (patient_id) REFERENCES Patient (id),
+        FOREIGN KEY (severity_id) REFERENCES Severity (id),
+        FOREIGN KEY (disease_id) REFERENCES Disease (id)
+    )
+    """,
+]
+
+
+def create_base_tables(cursor):
+    for ddl in BASE_TABLES:
+        cursor.execute(ddl)
+
+
+# The position retriage.py saves after each chunk. It lives here rather
+# than in retriage.py so that migrations, which every API process imports,
+# does not import the re-triage command and numpy with it.
+RETRIAGE_PROGRESS = """
+    CREATE TABLE IF NOT EXISTS RetriageProgress (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        catalogue_version INTEGER NOT NULL,
+        last_resultant_id INTEGER NOT NULL
+    )
+"""
+
+
+def create_retriage_progress(cursor):
+    cursor.execute(RETRIAGE_PROGRESS)
+
+
+# Secondary indexes, as (name, table, columns). Each list is what one
+# migration in migrations.py creates, so a list is never changed once
+# released: a new index goes in a new list with a migration of its own.
+
+# Migration 3: the dashboard joins and groupings. The trailing columns make
+# the indexes covering for the queries in app.py so the Patient/Resultant
+# joins never touch the tables.
+DASHBOARD_INDEXES = [
+    ("idx_resultant_patient", "Resultant", "patient_id, disease_id, severity_id, confidence_score"),
+    ("idx_resultant_disease_severity", "Resultant", "disease_id, severity_id, patient_id"),
+    ("idx_resultant_severity", "Resultant", "severity_id, confidence_score"),
+    ("idx_patient_location", "Patient", "location"),
+    ("idx_patient_created_at", "Patient", "created_at"),
+]
+
+# Migration 8: GET /api/patients filters and sorts. idx_patient_filters
+# holds every Patient filter column, so a filtered total is counted from the
+# index; the text filters ignore case
+FILTER_INDEXES = [
+    (
+        "idx_patient_filters",
+        "Patient",
+        "location COLLATE NOCASE, gender COLLATE NOCASE, pregnancy_status COLLATE NOCASE,"
+        " age, created_at",
+    ),
+    ("idx_patient_age", "Patient", "age"),
+    ("idx_patient_name", "Patient", "name"),
+    ("idx_resultant_confidence", "Resultant", "confidence_score, patient_id"),
+]
+
+# Every index of the current schema, which the bulk import drops and rebuilds
+INDEXES = DASHBOARD_INDEXES + FILTER_INDEXES
+
+
+def create_index_list(cursor, indexes):
+    for name, table, columns in indexes:
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+
+
+def create_dashboard_indexes(cursor):
+    create_index_list(cursor, DASHBOARD_INDEXES)
+
+
+def create_filter_indexes(cursor):
+    create_index_list(cursor, FILTER_INDEXES)
+
+
+def create_indexes(cursor):
+    create_index_list(cursor, INDEXES)
+
+
+def drop_indexes(cursor):
+    for name, _, _ in INDEXES:
+        cursor.execute(f"DROP INDEX IF EXISTS {name}")
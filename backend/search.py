@@ -0,0 +1,125 @@
+"""Full-text index behind GET /api/patients/search.
+
+PatientSearch is an external-content FTS5 table over Patient's name,
+location and symptoms: it stores only the index and reads the text back
+from Patient. Triggers on Patient keep it in step with every insert,
+update and delete, in the same transaction as the change. Bulk loads drop
+the triggers and rebuild the index once at the end instead.
+
+    python search.py rebuild   # reindex all of Patient
+    python search.py verify    # check the index against Patient
+"""
+import re
+import sys
+
+from db import connect
+
+SEARCH_TABLE = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS PatientSearch USING fts5(
+        name, location, symptoms,
+        content = 'Patient', content_rowid = 'id',
+        tokenize = 'porter unicode61 remove_diacritics 2'
+    )
+"""
+
+# An external-content table is told the old text to remove, so the update
+# and delete triggers pass the row as it was
+SEARCH_TRIGGERS = {
+    "patient_search_insert": """
+        CREATE TRIGGER IF NOT EXISTS patient_search_insert AFTER INSERT ON Patient
+        BEGIN
+            INSERT INTO PatientSearch (rowid, name, location, symptoms)
+            VALUES (new.id, new.name, new.location, new.symptoms);
+        END
+    """,
+    "patient_search_delete": """
+        CREATE TRIGGER IF NOT EXISTS patient_search_delete AFTER DELETE ON Patient
+        BEGIN
+            INSERT INTO PatientSearch (PatientSearch, rowid, name, location, symptoms)
+            VALUES ('delete', old.id, old.name, old.location, old.symptoms);
+        END
+    """,
+    "patient_search_update": """
+        CREATE TRIGGER IF NOT EXISTS patient_search_update
+        AFTER UPDATE OF id, name, location, symptoms ON Patient
+        BEGIN
+            INSERT INTO PatientSearch (PatientSearch, rowid, name, location, symptoms)
+            VALUES ('delete', old.id, old.name, old.location, old.symptoms);
+            INSERT INTO PatientSearch (rowid, name, location, symptoms)
+            VALUES (new.id, new.name, new.location, new.symptoms);
+        END
+    """,
+}
+
+SEARCH_TERM = re.compile(r"\w+")
+
+
+def create_tables(cursor):
+    """Create the index and its triggers, indexing the patients already stored"""
+    cursor.execute(SEARCH_TABLE)
+    create_triggers(cursor)
+    rebuild(cursor)
+
+
+def create_triggers(cursor):
+    for ddl in SEARCH_TRIGGERS.values():
+        cursor.execute(ddl)
+
+
+def drop_triggers(cursor):
+    for name in SEARCH_TRIGGERS:
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+def rebuild(cursor):
+    """Reindex every Patient row"""
+    cursor.execute("INSERT INTO PatientSearch (PatientSearch) VALUES ('rebuild')")
+
+
+def verify(cursor):
+    """Raise sqlite3.DatabaseError if the index differs from Patient"""
+    cursor.execute(
+        "INSERT INTO PatientSearch (PatientSearch, rank) VALUES ('integrity-check', 1)"
+    )
+
+
+def match_expression(text):
+    """Turn free text into an FTS5 query matching rows with every word.
+
+    Each word is quoted, so user input never reaches the FTS5 query syntax,
+    and the last one matches as a prefix for searches typed as they go.
+    Raises ValueError when the text has no words.
+    """
+    terms = SEARCH_TERM.findall(text)
+    if not terms:
+        raise ValueError("q must contain at least one word")
+    return " ".join(f'"{term}"' for term in terms) + "*"
+
+
+def main():
+    if sys.argv[1:] not in (["rebuild"], ["verify"]):
+        print("Usage: python search.py rebuild|verify")
+        sys.exit(2)
+
+    # migrations imports this module, so it is imported here
+    import migrations
+
+    conn = connect()
+    migrations.migrate(conn)
+    cursor = conn.cursor()
+    if sys.argv[1] == "rebuild":
+        rebuild(cursor)
+        conn.commit()
+        print("Search index rebuilt")
+    else:
+        try:
+            verify(cursor)
+        except Exception as e:
+            print(f"Search index differs from Patient: {e}")
+            sys.exit(1)
+        print("Search index matches Patient")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
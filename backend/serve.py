@@ -0,0 +1,336 @@
+"""Pre-forked production server for the API.
+
+The master process binds the listening socket and creates or upgrades the
+database once, in a short-lived child. It then forks --workers processes
+that each import the app and serve the shared socket with a threaded
+Werkzeug server. The master itself never imports the app or opens the
+database, so no SQLite handle crosses a fork.
+
+    python serve.py --workers 4 --port 5000
+
+Signals to the master:
+    TERM, INT   stop accepting, let requests finish (up to --graceful-timeout)
+    HUP         graceful reload: prepare the database with the current code,
+                then replace the workers one at a time
+Workers are also replaced after --max-requests requests (10000 by
+default), plus up to --max-requests-jitter so they do not all restart
+together; a slow leak in a worker then never outlives it. Each request
+hands its database connection back to db.pool, so a worker holds at most
+the pool's idle connections plus one per request in progress.
+
+A GET /api/events stream takes its thread only until the headers are
+sent: the handler then passes the connection to the event feed's
+dispatcher thread, so open streams do not hold the worker's threads.
+
+With TIB_AI_METRICS=1 the workers share their /metrics counters through
+TIB_AI_METRICS_DIR (a temporary directory unless set), and the master
+folds in the counters of each worker that exits.
+"""
+import argparse
+import os
+import random
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+from werkzeug.serving import ThreadedWSGIServer, WSGIRequestHandler
+
+import metrics
+
+# A worker that exits sooner than this after starting is respawned only
+# after a pause, so a broken deploy does not fork in a tight loop
+MIN_WORKER_LIFETIME = 1.0
+RESPAWN_DELAY = 1.0
+MASTER_TICK = 0.5
+LISTEN_BACKLOG = 1024
+
+
+def log(message):
+    print(f"[serve {os.getpid()}] {message}", file=sys.stderr, flush=True)
+
+
+class WorkerRequestHandler(WSGIRequestHandler):
+    """Request handler whose connection the app can take over"""
+
+    def make_environ(self):
+        environ = super().make_environ()
+        environ["tib_ai.detach"] = self.detach
+        return environ
+
+    def detach(self):
+        """Return a duplicate of the connection's socket for the caller to
+        own; the server then closes its own without ending the connection"""
+        self.server.detached.add(self.request)
+        return self.request.dup()
+
+
+class WorkerServer(ThreadedWSGIServer):
+    """Threaded server whose close waits for requests in progress"""
+
+    daemon_threads = False
+    block_on_close = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, handler=WorkerRequestHandler, **kwargs)
+        self.detached = set()
+
+    def shutdown_request(self, request):
+        if request in self.detached:
+            self.detached.discard(request)
+            # A shutdown would end the connection for the duplicate too
+            self.close_request(request)
+        else:
+            super().shutdown_request(request)
+
+
+class RequestLimit:
+    """WSGI middleware that calls on_limit once after `limit` requests"""
+
+    def __init__(self, app, limit, on_limit):
+        self.app = app
+        self.limit = limit
+        self.on_limit = on_limit
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self._count += 1
+            reached = self._count == self.limit
+        if reached:
+            self.on_limit()
+        return self.app(environ, start_response)
+
+
+def prepare_database():
+    """Create or upgrade the schema in a child process; True on success"""
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            import app  # noqa: F401  runs the pending migrations
+            import db
+
+            db.pool.close_all()
+            status = 0
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            os._exit(status)
+    _, status = os.waitpid(pid, 0)
+    return os.waitstatus_to_exitcode(status) == 0
+
+
+def run_worker(listener, args):
+    """Body of a forked worker; never returns"""
+    # The master coordinates Ctrl-C and reloads; until the server is up a
+    # TERM simply ends the worker
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    status = 1
+    try:
+        # The master has already prepared the database
+        os.environ["TIB_AI_INIT_DB"] = "0"
+        import db
+        from app import app
+        from events import event_feed
+        from image_store import thumbnail_workers
+
+        stopping = threading.Event()
+
+        def stop(*_):
+            if not stopping.is_set():
+                stopping.set()
+                # Event streams never end on their own; the dispatcher
+                # closes them, and streams still on a request thread end
+                event_feed.close()
+                # shutdown() waits for serve_forever(), so not from its thread
+                threading.Thread(target=server.shutdown, daemon=True).start()
+
+        application = app
+        if args.max_requests:
+            limit = args.max_requests + random.randint(0, args.max_requests_jitter)
+            application = RequestLimit(app, limit, stop)
+
+        server = WorkerServer(args.host, args.port, application, fd=listener.fileno())
+        signal.signal(signal.SIGTERM, stop)
+        # Returns after server_close(), which waits for requests in progress
+        server.serve_forever(poll_interval=MASTER_TICK)
+
+        thumbnail_workers.shutdown()
+        db.pool.close_all()
+        if metrics.ENABLED:
+            metrics.write_snapshot()
+        status = 0
+    except BaseException:  # a worker must never return into the master's loop
+        traceback.print_exc()
+    finally:
+        os._exit(status)
+
+
+class Master:
+    def __init__(self, args):
+        self.args = args
+        self.listener = None
+        self.workers = {}  # pid -> (generation, start time)
+        self.generation = 0
+        self.stopping = False
+        self.reloading = False
+        self.last_quick_exit = 0.0
+        self.temporary_metrics_dir = None
+
+    def bind(self):
+        family = socket.AF_INET6 if ":" in self.args.host else socket.AF_INET
+        listener = socket.socket(family, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((self.args.host, self.args.port))
+        listener.listen(LISTEN_BACKLOG)
+        # Every worker polls the same socket; non-blocking accepts let the
+        # ones that lose the race go back to polling
+        listener.setblocking(False)
+        self.listener = listener
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            run_worker(self.listener, self.args)
+        self.workers[pid] = (self.generation, time.monotonic())
+
+    def spawn_missing(self):
+        current = [g for g, _ in self.workers.values() if g == self.generation]
+        for _ in range(self.args.workers - len(current)):
+            self.spawn()
+
+    def reap(self):
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            _, started = self.workers.pop(pid, (None, time.monotonic()))
+            self.retire_metrics(pid)
+            code = os.waitstatus_to_exitcode(status)
+            if code != 0 and not self.stopping:
+                log(f"worker {pid} exited with status {code}")
+            if time.monotonic() - started < MIN_WORKER_LIFETIME:
+                self.last_quick_exit = time.monotonic()
+
+    def prepare_metrics(self):
+        if not metrics.ENABLED:
+            return
+        directory = metrics.metrics_dir()
+        if directory:
+            # Counters left by an earlier run belong to processes long gone
+            os.makedirs(directory, exist_ok=True)
+            for filename in os.listdir(directory):
+                if filename.endswith(".json"):
+                    os.unlink(os.path.join(directory, filename))
+        else:
+            directory = self.temporary_metrics_dir = tempfile.mkdtemp(prefix="tib_ai_metrics_")
+            os.environ["TIB_AI_METRICS_DIR"] = directory
+
+    def retire_metrics(self, pid):
+        if metrics.ENABLED:
+            try:
+                metrics.retire(pid)
+            except OSError as e:
+                log(f"could not keep the metrics of worker {pid}: {e}")
+
+    def reload(self):
+        log("reloading")
+        if not prepare_database():
+            log("database preparation failed, keeping the current workers")
+            return
+        old = [pid for pid, (g, _) in self.workers.items() if g == self.generation]
+        self.generation += 1
+        # Each replacement starts before the worker it replaces is told to
+        # stop; connections wait in the shared socket's backlog meanwhile
+        for pid in old:
+            self.spawn()
+            self.signal_worker(pid, signal.SIGTERM)
+        self.spawn_missing()
+
+    def signal_worker(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def stop(self):
+        log("stopping")
+        for pid in list(self.workers):
+            self.signal_worker(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.args.graceful_timeout
+        while self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in list(self.workers):
+            log(f"worker {pid} did not stop in time, killing it")
+            self.signal_worker(pid, signal.SIGKILL)
+        while self.workers:
+            pid, _ = os.waitpid(-1, 0)
+            self.workers.pop(pid, None)
+        self.listener.close()
+        if self.temporary_metrics_dir:
+            shutil.rmtree(self.temporary_metrics_dir, ignore_errors=True)
+
+    def run(self):
+        self.bind()
+        self.prepare_metrics()
+        if not prepare_database():
+            log("database preparation failed")
+            sys.exit(1)
+
+        def request_stop(*_):
+            self.stopping = True
+
+        def request_reload(*_):
+            self.reloading = True
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+        signal.signal(signal.SIGHUP, request_reload)
+
+        log(f"listening on {self.args.host}:{self.args.port} with {self.args.workers} workers")
+        while not self.stopping:
+            self.reap()
+            if self.reloading:
+                self.reloading = False
+                self.reload()
+            # Workers that die at once (bad code, port trouble) are retried slowly
+            if time.monotonic() - self.last_quick_exit >= RESPAWN_DELAY:
+                self.spawn_missing()
+            time.sleep(MASTER_TICK)
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API with pre-forked workers")
+    parser.add_argument("--host", default=os.environ.get("TIB_AI_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("TIB_AI_PORT", 5000)))
+    parser.add_argument("--workers", type=int,
+                        default=int(os.environ.get("TIB_AI_WORKERS", os.cpu_count() or 1)),
+                        help="worker processes (default: one per core)")
+    parser.add_argument("--max-requests", type=int, default=10000,
+                        help="replace a worker after this many requests (0: never)")
+    parser.add_argument("--max-requests-jitter", type=int, default=1000,
+                        help="random extra requests added to --max-requests per worker")
+    parser.add_argument("--graceful-timeout", type=float, default=30.0,
+                        help="seconds a stopping worker gets to finish its requests")
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    Master(args).run()
+
+
+if __name__ == "__main__":
+    main()
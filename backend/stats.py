@@ -0,0 +1,208 @@
+"""Aggregate tables behind the dashboard endpoints.
+
+ResultantSummary holds case counts and confidence sums per
+disease x severity x location, and PatientSummary holds patient counts per
+location. Both are updated in the same transaction as the Patient and
+Resultant inserts, so the dashboard reads cost O(number of groups).
+
+    python stats.py rebuild   # recompute both tables from scratch
+    python stats.py verify    # compare the stored tables with a recount
+"""
+import sys
+
+from db import bump_generation, connect
+
+SUMMARY_TABLES = {
+    "ResultantSummary": """
+        CREATE TABLE IF NOT EXISTS ResultantSummary (
+            disease_id INTEGER NOT NULL,
+            severity_id INTEGER NOT NULL,
+            location TEXT NOT NULL,
+            case_count INTEGER NOT NULL DEFAULT 0,
+            confidence_sum REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (disease_id, severity_id, location)
+        )
+    """,
+    "PatientSummary": """
+        CREATE TABLE IF NOT EXISTS PatientSummary (
+            location TEXT PRIMARY KEY,
+            patient_count INTEGER NOT NULL DEFAULT 0
+        )
+    """,
+}
+
+# Recount queries used by rebuild() and verify(). Results whose patient is
+# missing are grouped under an empty location, like the endpoints that skip
+# empty locations expect.
+RESULTANT_RECOUNT = """
+    SELECT r.disease_id, r.severity_id, COALESCE(p.location, '') AS location,
+           COUNT(*) AS case_count, SUM(r.confidence_score) AS confidence_sum
+    FROM Resultant r
+    LEFT JOIN Patient p ON p.id = r.patient_id
+    GROUP BY r.disease_id, r.severity_id, COALESCE(p.location, '')
+"""
+PATIENT_RECOUNT = """
+    SELECT location, COUNT(*) AS patient_count
+    FROM Patient
+    GROUP BY location
+"""
+
+RECORD_PATIENT = """
+    INSERT INTO PatientSummary (location, patient_count) VALUES (?, 1)
+    ON CONFLICT (location) DO UPDATE SET patient_count = patient_count + 1
+"""
+RECORD_RESULT = """
+    INSERT INTO ResultantSummary (
+        disease_id, severity_id, location, case_count, confidence_sum
+    ) VALUES (?, ?, ?, 1, ?)
+    ON CONFLICT (disease_id, severity_id, location) DO UPDATE SET
+        case_count = case_count + 1,
+        confidence_sum = confidence_sum + excluded.confidence_sum
+"""
+
+FORGET_RESULT = """
+    UPDATE ResultantSummary SET
+        case_count = case_count - 1,
+        confidence_sum = confidence_sum - ?
+    WHERE disease_id = ? AND severity_id = ? AND location = ?
+"""
+
+
+def create_tables(cursor):
+    """Create the summary tables, filling them if the database already has data"""
+    cursor.execute(
+        "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN (?, ?)",
+        tuple(SUMMARY_TABLES),
+    )
+    missing = cursor.fetchone()[0] < len(SUMMARY_TABLES)
+
+    for ddl in SUMMARY_TABLES.values():
+        cursor.execute(ddl)
+
+    if missing:
+        rebuild(cursor)
+
+
+def record_patients(cursor, locations):
+    """Count new Patient rows, given their locations"""
+    cursor.executemany(RECORD_PATIENT, ((location or "",) for location in locations))
+
+
+def record_results(cursor, results):
+    """Count new Resultant rows.
+
+    results holds (disease_id, severity_id, location, confidence_score) tuples.
+    """
+    cursor.executemany(
+        RECORD_RESULT,
+        (
+            (disease_id, severity_id, location or "", confidence)
+            for disease_id, severity_id, location, confidence in results
+        ),
+    )
+
+
+def forget_results(cursor, results):
+    """Uncount Resultant rows that are being changed or removed.
+
+    results holds (disease_id, severity_id, location, confidence_score) tuples.
+    """
+    cursor.executemany(
+        FORGET_RESULT,
+        (
+            (confidence, disease_id, severity_id, location or "")
+            for disease_id, severity_id, location, confidence in results
+        ),
+    )
+
+
+def rebuild(cursor):
+    """Recompute both summary tables from Patient and Resultant"""
+    cursor.execute("DELETE FROM ResultantSummary")
+    cursor.execute(
+        f"""
+        INSERT INTO ResultantSummary (
+            disease_id, severity_id, location, case_count, confidence_sum
+        ) {RESULTANT_RECOUNT}
+        """
+    )
+    cursor.execute("DELETE FROM PatientSummary")
+    cursor.execute(
+        f"INSERT INTO PatientSummary (location, patient_count) {PATIENT_RECOUNT}"
+    )
+
+
+def verify(cursor):
+    """Return a list of differences between the stored and recounted tables.
+
+    Call inside a read transaction, so the recount and the stored tables are
+    read from one snapshot and a concurrent insert is not reported as drift.
+    """
+    problems = []
+
+    cursor.execute(RESULTANT_RECOUNT)
+    expected = {row[:3]: (row[3], row[4]) for row in cursor.fetchall()}
+    cursor.execute(
+        """
+        SELECT disease_id, severity_id, location, case_count, confidence_sum
+        FROM ResultantSummary
+        WHERE case_count != 0
+        """
+    )
+    stored = {row[:3]: (row[3], row[4]) for row in cursor.fetchall()}
+    for key in sorted(set(expected) | set(stored), key=repr):
+        want_count, want_sum = expected.get(key, (0, 0.0))
+        have_count, have_sum = stored.get(key, (0, 0.0))
+        if want_count != have_count or abs(want_sum - have_sum) > 1e-6:
+            problems.append(
+                f"ResultantSummary {key}: stored ({have_count}, {have_sum:.4f}), "
+                f"expected ({want_count}, {want_sum:.4f})"
+            )
+
+    cursor.execute(PATIENT_RECOUNT)
+    expected = dict(cursor.fetchall())
+    cursor.execute("SELECT location, patient_count FROM PatientSummary WHERE patient_count != 0")
+    stored = dict(cursor.fetchall())
+    for location in sorted(set(expected) | set(stored)):
+        if expected.get(location, 0) != stored.get(location, 0):
+            problems.append(
+                f"PatientSummary {location!r}: stored {stored.get(location, 0)}, "
+                f"expected {expected.get(location, 0)}"
+            )
+
+    return problems
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command not in ("rebuild", "verify"):
+        print("Usage: python stats.py rebuild|verify")
+        sys.exit(2)
+
+    # migrations imports this module, so it is imported here
+    import migrations
+
+    conn = connect()
+    migrations.migrate(conn)
+    cursor = conn.cursor()
+
+    if command == "rebuild":
+        rebuild(cursor)
+        bump_generation(cursor)
+        conn.commit()
+        print("Summary tables rebuilt")
+    else:
+        cursor.execute("BEGIN")
+        problems = verify(cursor)
+        conn.rollback()
+        for problem in problems:
+            print(problem)
+        print(f"Summary tables {'differ' if problems else 'match'} ({len(problems)} differences)")
+        conn.close()
+        sys.exit(1 if problems else 0)
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Symptom matching for triage.
+
+A SymptomIndex is built once per version of the disease catalogue. Symptom
+phrases and their synonyms are normalised into a token trie, so one
+left-to-right pass over a patient's free-text symptoms finds every known
+phrase (longest match first) and scores all diseases at once through a
+symptom -> diseases inverted index.
+"""
+import re
+from types import MappingProxyType
+
+TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def stem(token):
+    """A lower-case token with a trailing plural "s" removed"""
+    return token[:-1] if len(token) > 3 and token[-1] == "s" and token[-2] != "s" else token
+
+
+def normalise(text):
+    """Lower-case word tokens with a trailing plural "s" removed"""
+    return [stem(token) for token in TOKEN.findall(text.lower())]
+
+
+class SymptomIndex:
+    """Immutable matcher over a disease catalogue.
+
+    diseases maps disease id -> symptoms; synonyms maps a symptom to other
+    phrases for it.
+    """
+
+    # Key marking the end of a phrase in the trie
+    _END = ""
+
+    def __init__(self, diseases, synonyms=None):
+        trie = {}
+        symptom_diseases = {}
+
+        def add(phrase, symptom):
+            node = trie
+            for token in normalise(phrase):
+                node = node.setdefault(token, {})
+            if node is not trie:
+                node[self._END] = symptom
+
+        for disease_id, symptoms in diseases.items():
+            for symptom in symptoms:
+                add(symptom, symptom)
+                symptom_diseases.setdefault(symptom, []).append(disease_id)
+        for symptom, phrases in (synonyms or {}).items():
+            if symptom in symptom_diseases:
+                for phrase in phrases:
+                    add(phrase, symptom)
+
+        self._trie = self._freeze(trie)
+        self._symptom_diseases = MappingProxyType(
+            {symptom: tuple(ids) for symptom, ids in symptom_diseases.items()}
+        )
+        self._symptom_counts = MappingProxyType(
+            {disease_id: len(symptoms) for disease_id, symptoms in diseases.items()}
+        )
+
+    @classmethod
+    def _freeze(cls, node):
+        return MappingProxyType(
+            {
+                key: child if key == cls._END else cls._freeze(child)
+                for key, child in node.items()
+            }
+        )
+
+    def phrases(self):
+        """Return (normalised tokens, symptom) for every phrase the index knows"""
+        found = []
+        stack = [((), self._trie)]
+        while stack:
+            tokens, node = stack.pop()
+            for key, child in node.items():
+                if key == self._END:
+                    found.append((tokens, child))
+                else:
+                    stack.append((tokens + (key,), child))
+        return found
+
+    def match(self, text):
+        """Return the catalogue symptoms found in text, in order of appearance"""
+        tokens = normalise(text or "")
+        found = []
+        i = 0
+        while i < len(tokens):
+            node = self._trie
+            longest = None
+            j = i
+            while j < len(tokens) and tokens[j] in node:
+                node = node[tokens[j]]
+                j += 1
+                if self._END in node:
+                    longest = (j, node[self._END])
+
+            if longest:
+                i, symptom = longest
+                if symptom not in found:
+                    found.append(symptom)
+            else:
+                i += 1
+        return found
+
+    def rank(self, text):
+        """Score every disease against text, best first.
+
+        Returns (disease_id, score, matched symptoms) for each disease with
+        at least one match. The score is the share of the disease's
+        symptoms that were found.
+        """
+        matched = {}
+        for symptom in self.match(text):
+            for disease_id in self._symptom_diseases[symptom]:
+                matched.setdefault(disease_id, []).append(symptom)
+
+        ranking = [
+            (disease_id, len(symptoms) / self._symptom_counts[disease_id], symptoms)
+            for disease_id, symptoms in matched.items()
+        ]
+        ranking.sort(key=lambda entry: (-entry[1], -len(entry[2]), entry[0]))
+        return ranking
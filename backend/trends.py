@@ -0,0 +1,303 @@
+"""Time-bucketed case counts behind GET /api/trends.
+
+Cases (Resultant rows, at their patient's created_at) are counted per
+disease x severity x location in three tiers:
+
+    TrendHourly   hours of the last HOURLY_DAYS days
+    TrendDaily    days of the last DAILY_DAYS days, from a Monday
+    TrendWeekly   weeks, starting on Mondays, before that
+
+New cases are counted into TrendHourly in the same transaction as their
+insert. compact() folds hours that have aged out into TrendDaily and days
+into TrendWeekly, so the tables grow with the number of buckets, not of
+patients, and a series costs one row per bucket and group it covers.
+Times are UTC, like CURRENT_TIMESTAMP.
+
+    python trends.py rebuild   # recount every tier from Patient and Resultant
+    python trends.py verify    # compare the stored tiers with a recount
+"""
+import datetime
+import sys
+
+from db import connect
+
+HOURLY_DAYS = 3
+DAILY_DAYS = 92
+
+# Granularity: (table, bucket column, SQL expression giving the bucket of a
+# timestamp or of a finer bucket), from the finest to the coarsest
+TIERS = {
+    "hour": ("TrendHourly", "hour", "strftime('%Y-%m-%d %H:00:00', {})"),
+    "day": ("TrendDaily", "day", "date({})"),
+    "week": ("TrendWeekly", "week", "date({}, 'weekday 0', '-6 days')"),
+}
+
+TIER_TABLE = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        {column} TEXT NOT NULL,
+        disease_id INTEGER NOT NULL,
+        severity_id INTEGER NOT NULL,
+        location TEXT NOT NULL,
+        case_count INTEGER NOT NULL DEFAULT 0,
+        confidence_sum REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY ({column}, disease_id, severity_id, location)
+    )
+"""
+
+ADD_COUNTS = """
+    ON CONFLICT ({column}, disease_id, severity_id, location) DO UPDATE SET
+        case_count = case_count + excluded.case_count,
+        confidence_sum = confidence_sum + excluded.confidence_sum
+"""
+
+# Count the cases of the patients with ids in a range into TrendHourly
+RECORD_PATIENTS = f"""
+    INSERT INTO TrendHourly (
+        hour, disease_id, severity_id, location, case_count, confidence_sum
+    )
+    SELECT strftime('%Y-%m-%d %H:00:00', p.created_at), r.disease_id, r.severity_id,
+           p.location, COUNT(*), SUM(r.confidence_score)
+    FROM Patient p
+    JOIN Resultant r ON r.patient_id = p.id
+    WHERE p.id BETWEEN ? AND ? AND p.created_at IS NOT NULL
+    GROUP BY 1, 2, 3, 4
+    {ADD_COUNTS.format(column="hour")}
+"""
+
+# Add one Resultant row into TrendHourly, times a sign of 1 or -1. Rows of
+# hours already folded are folded again by the next compact(); a case moved
+# out of a group and another moved in leave a count of 0 but a confidence
+# difference, which is folded too
+RECORD_RESULT = f"""
+    INSERT INTO TrendHourly (
+        hour, disease_id, severity_id, location, case_count, confidence_sum
+    )
+    SELECT strftime('%Y-%m-%d %H:00:00', p.created_at), r.disease_id, r.severity_id,
+           p.location, ?, ? * r.confidence_score
+    FROM Resultant r
+    JOIN Patient p ON p.id = r.patient_id
+    WHERE r.id = ? AND p.created_at IS NOT NULL
+    {ADD_COUNTS.format(column="hour")}
+"""
+
+
+def create_tables(cursor):
+    """Create the tiers, filling them if the database already has data"""
+    cursor.execute(
+        "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN (?, ?, ?)",
+        tuple(table for table, _, _ in TIERS.values()),
+    )
+    missing = cursor.fetchone()[0] < len(TIERS)
+
+    for table, column, _ in TIERS.values():
+        cursor.execute(TIER_TABLE.format(table=table, column=column))
+
+    if missing:
+        rebuild(cursor)
+
+
+def horizons(now=None):
+    """Return the first day kept hourly and the first Monday kept daily, as text"""
+    today = (now or datetime.datetime.now(datetime.timezone.utc)).date()
+    hourly_from = today - datetime.timedelta(days=HOURLY_DAYS)
+    daily_from = today - datetime.timedelta(days=DAILY_DAYS)
+    daily_from -= datetime.timedelta(days=daily_from.weekday())
+    return str(hourly_from), str(daily_from)
+
+
+def record_patients(cursor, patient_ids):
+    """Count the cases of new patients, given a range of their ids"""
+    if patient_ids:
+        cursor.execute(RECORD_PATIENTS, (patient_ids[0], patient_ids[-1]))
+
+
+def record_results(cursor, resultant_ids):
+    """Count Resultant rows as they are now"""
+    cursor.executemany(RECORD_RESULT, ((1, 1, resultant_id) for resultant_id in resultant_ids))
+
+
+def forget_results(cursor, resultant_ids):
+    """Uncount Resultant rows, as they are now, before they are changed or removed"""
+    cursor.executemany(RECORD_RESULT, ((-1, -1, resultant_id) for resultant_id in resultant_ids))
+
+
+def compact(cursor, now=None):
+    """Fold hours older than HOURLY_DAYS into days and days older than DAILY_DAYS into weeks.
+
+    Checks each tier with one index lookup, so it is cheap to call after
+    every write.
+    """
+    hourly_from, daily_from = horizons(now)
+    folds = [("hour", "day", hourly_from), ("day", "week", daily_from)]
+    for source, target, cutoff in folds:
+        source_table, source_column, _ = TIERS[source]
+        target_table, target_column, bucket = TIERS[target]
+        cursor.execute(
+            f"SELECT 1 FROM {source_table} WHERE {source_column} < ? LIMIT 1", (cutoff,)
+        )
+        if cursor.fetchone() is None:
+            continue
+        cursor.execute(
+            f"""
+            INSERT INTO {target_table} (
+                {target_column}, disease_id, severity_id, location, case_count, confidence_sum
+            )
+            SELECT {bucket.format(source_column)}, disease_id, severity_id, location,
+                   SUM(case_count), SUM(confidence_sum)
+            FROM {source_table}
+            WHERE {source_column} < ?
+            GROUP BY 1, 2, 3, 4
+            HAVING SUM(case_count) != 0 OR ABS(SUM(confidence_sum)) > 1e-9
+            {ADD_COUNTS.format(column=target_column)}
+            """,
+            (cutoff,),
+        )
+        cursor.execute(f"DELETE FROM {source_table} WHERE {source_column} < ?", (cutoff,))
+
+
+def recount(tier, since=None, before=None):
+    """Return a SELECT counting every case into tier buckets, and its parameters"""
+    _, _, bucket = TIERS[tier]
+    conditions = ["p.created_at IS NOT NULL"]
+    parameters = []
+    if since:
+        conditions.append("p.created_at >= ?")
+        parameters.append(since)
+    if before:
+        conditions.append("p.created_at < ?")
+        parameters.append(before)
+    sql = f"""
+        SELECT {bucket.format("p.created_at")}, r.disease_id, r.severity_id, p.location,
+               COUNT(*), SUM(r.confidence_score)
+        FROM Patient p
+        JOIN Resultant r ON r.patient_id = p.id
+        WHERE {" AND ".join(conditions)}
+        GROUP BY 1, 2, 3, 4
+    """
+    return sql, parameters
+
+
+def tier_ranges(now=None):
+    """Return (tier, since, before) for the times each tier holds"""
+    hourly_from, daily_from = horizons(now)
+    return [("hour", hourly_from, None), ("day", daily_from, hourly_from), ("week", None, daily_from)]
+
+
+def rebuild(cursor, now=None):
+    """Recount every tier from Patient and Resultant"""
+    for tier, since, before in tier_ranges(now):
+        table, column, _ = TIERS[tier]
+        cursor.execute(f"DELETE FROM {table}")
+        sql, parameters = recount(tier, since, before)
+        cursor.execute(
+            f"""
+            INSERT INTO {table} (
+                {column}, disease_id, severity_id, location, case_count, confidence_sum
+            ) {sql}
+            """,
+            parameters,
+        )
+
+
+def verify(cursor, now=None):
+    """Return a list of differences between the stored tiers and a recount.
+
+    Compacts first, so rows waiting to be folded are compared in the tier
+    they belong to; the caller decides whether to keep that. Call inside a
+    transaction, so every tier and its recount are read from one snapshot.
+    """
+    compact(cursor, now)
+    problems = []
+    for tier, since, before in tier_ranges(now):
+        table, column, _ = TIERS[tier]
+        sql, parameters = recount(tier, since, before)
+        cursor.execute(sql, parameters)
+        expected = {row[:4]: (row[4], row[5]) for row in cursor.fetchall()}
+        cursor.execute(
+            f"""
+            SELECT {column}, disease_id, severity_id, location, case_count, confidence_sum
+            FROM {table}
+            WHERE case_count != 0
+            """
+        )
+        stored = {row[:4]: (row[4], row[5]) for row in cursor.fetchall()}
+        for key in sorted(set(expected) | set(stored), key=repr):
+            want_count, want_sum = expected.get(key, (0, 0.0))
+            have_count, have_sum = stored.get(key, (0, 0.0))
+            if want_count != have_count or abs(want_sum - have_sum) > 1e-6:
+                problems.append(
+                    f"{table} {key}: stored ({have_count}, {have_sum:.4f}), "
+                    f"expected ({want_count}, {want_sum:.4f})"
+                )
+    return problems
+
+
+def read_series(cursor, granularity, start, end, filters, group_by=None):
+    """Sum the cases in [start, end) per bucket of granularity.
+
+    start and end are bucket labels of the granularity; filters maps
+    disease_id, severity_id and location to the value they must have, and
+    group_by names one of those columns to split the series by. Rows still
+    in a finer tier are summed into their bucket. Returns
+    {(bucket, group): (case_count, confidence_sum)}, with group None when
+    group_by is.
+    """
+    conditions = ["{column} >= ?", "{column} < ?"]
+    parameters = [start, end]
+    for name, value in filters.items():
+        conditions.append(f"{name} = ? COLLATE NOCASE" if name == "location" else f"{name} = ?")
+        parameters.append(value)
+    where = " AND ".join(conditions)
+    group = group_by or "NULL"
+
+    _, _, bucket = TIERS[granularity]
+    tiers = list(TIERS)
+    sums = {}
+    for tier in tiers[: tiers.index(granularity) + 1]:
+        table, column, _ = TIERS[tier]
+        cursor.execute(
+            f"""
+            SELECT {bucket.format(column)}, {group}, SUM(case_count), SUM(confidence_sum)
+            FROM {table}
+            WHERE {where.format(column=column)}
+            GROUP BY 1, 2
+            """,
+            parameters,
+        )
+        for label, key, count, confidence in cursor.fetchall():
+            have_count, have_confidence = sums.get((label, key), (0, 0.0))
+            sums[(label, key)] = (have_count + count, have_confidence + confidence)
+    return sums
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command not in ("rebuild", "verify"):
+        print("Usage: python trends.py rebuild|verify")
+        sys.exit(2)
+
+    # migrations imports this module, so it is imported here
+    import migrations
+
+    conn = connect()
+    migrations.migrate(conn)
+    cursor = conn.cursor()
+    if command == "rebuild":
+        rebuild(cursor)
+        conn.commit()
+        print("Trend tiers rebuilt")
+    else:
+        cursor.execute("BEGIN")
+        problems = verify(cursor)
+        conn.rollback()
+        for problem in problems:
+            print(problem)
+        print(f"Trend tiers {'differ' if problems else 'match'} ({len(problems)} differences)")
+        conn.close()
+        sys.exit(1 if problems else 0)
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,21 @@
 import React, { useEffect, useState } from "react";
 import styled from "styled-components";
-import { MapContainer, TileLayer, GeoJSON, Circle, Popup } from "react-leaflet";
+import { MapContainer, TileLayer, GeoJSON, Circle, Popup, useMapEvents } from "react-leaflet";
 import "leaflet/dist/leaflet.css";
 import { FaMapMarkedAlt } from "react-icons/fa";
-import pakistanGeoJson from "../../data/gadm41_PAK_3.json";
 import L from "leaflet";
 
+const PAKISTAN_CENTER = [30.3753, 69.3451];
+const INITIAL_ZOOM = 5;
+
+// Reports zoom changes so the map can ask for geometry simplified for them
+const ZoomWatcher = ({ onZoom }) => {
+  useMapEvents({
+    zoomend: (event) => onZoom(event.target.getZoom()),
+  });
+  return null;
+};
+
 const MapSection = styled.div`
   background-color: white;
   border-radius: var(--border-radius-md);
@@ -74,7 +84,8 @@ const LoadingIndicator = styled.div`
 `;
 
 const PakistanMap = ({ disease }) => {
-  const [regionData, setRegionData] = useState(null);
+  const [mapData, setMapData] = useState(null);
+  const [zoom, setZoom] = useState(INITIAL_ZOOM);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
   const [redZones, setRedZones] = useState([]);
@@ -143,17 +154,25 @@ const PakistanMap = ({ disease }) => {
     const fetchRegionData = async () => {
       try {
         setLoading(true);
-        // Fetch location data specific to the selected disease
-        const response = await fetch(`http://localhost:5000/api/disease-location/${disease.id}`);
+        // District outlines with this disease's counts and zone colours joined in
+        const response = await fetch(
+          `http://localhost:5000/api/map/${disease.id}?zoom=${zoom}`
+        );
         if (!response.ok) {
           throw new Error("Failed to fetch region data");
         }
         const data = await response.json();
-        setRegionData(data.regions);
-        
-        // Extract red zones and calculate their centers
-        extractRedZones(data.regions);
-        
+        setMapData(data);
+
+        // Place red zones on the city when known, else the district centre
+        setRedZones(
+          data.red_zones.map((zone) => ({
+            name: zone.name,
+            center: cityCoordinates[zone.name] || zone.center || PAKISTAN_CENTER,
+            data: zone,
+          }))
+        );
+
         setError(null);
       } catch (err) {
         console.error("Error fetching region data:", err);
@@ -164,160 +183,29 @@ const PakistanMap = ({ disease }) => {
     };
 
     fetchRegionData();
-  }, [disease.id]); // Refetch when disease changes
-
-  // Get city coordinates from lookup or fallback to GeoJSON calculation
-  const findRegionCenter = (regionName) => {
-    // First check if we have pre-defined coordinates for this city
-    if (cityCoordinates[regionName]) {
-      return cityCoordinates[regionName];
-    }
-    
-    // Fallback to calculating from GeoJSON if we don't have pre-defined coordinates
-    const feature = pakistanGeoJson.features.find(feature => {
-      const name = feature.properties.NAME_2 || feature.properties.NAME_3 || feature.properties.name;
-      return name === regionName;
-    });
-    
-    if (feature && feature.geometry) {
-      try {
-        if (feature.geometry.type === "MultiPolygon" && feature.geometry.coordinates.length > 0) {
-          // Try to find a more central point by averaging multiple coordinates
-          let latSum = 0;
-          let lonSum = 0;
-          let count = 0;
-          
-          // Sample multiple points from the first polygon
-          const firstPoly = feature.geometry.coordinates[0][0];
-          const step = Math.max(1, Math.floor(firstPoly.length / 10)); // Sample about 10 points
-          
-          for (let i = 0; i < firstPoly.length; i += step) {
-            latSum += firstPoly[i][1]; // Latitude
-            lonSum += firstPoly[i][0]; // Longitude
-            count++;
-          }
-          
-          if (count > 0) {
-            return [latSum / count, lonSum / count];
-          }
-          
-          // Fallback to first point if averaging fails
-          return [firstPoly[0][1], firstPoly[0][0]];
-        } else if (feature.geometry.type === "Polygon" && feature.geometry.coordinates.length > 0) {
-          // Same approach for Polygon type
-          const coords = feature.geometry.coordinates[0];
-          let latSum = 0;
-          let lonSum = 0;
-          let count = 0;
-          
-          const step = Math.max(1, Math.floor(coords.length / 10));
-          
-          for (let i = 0; i < coords.length; i += step) {
-            latSum += coords[i][1];
-            lonSum += coords[i][0];
-            count++;
-          }
-          
-          if (count > 0) {
-            return [latSum / count, lonSum / count];
-          }
-          
-          return [coords[0][1], coords[0][0]];
-        }
-      } catch (err) {
-        console.error("Error calculating region center:", err);
-      }
-    }
-    
-    // Default to center of Pakistan if we can't find the region
-    return [30.3753, 69.3451];
-  };
-  
-  // Extract red zones and calculate their centers
-  const extractRedZones = (regions) => {
-    if (!regions) return;
-    
-    const zones = [];
-    
-    for (const [regionName, regionData] of Object.entries(regions)) {
-      if (regionData.zone_type === "red") {
-        const center = findRegionCenter(regionName);
-        zones.push({
-          name: regionName,
-          center: center,
-          data: regionData
-        });
-      }
-    }
-    
-    setRedZones(zones);
-  };
+  }, [disease.id, zoom]); // Refetch when disease or zoom level changes
 
-  const style = (feature) => {
-    if (!regionData) {
-      return {
-        fillColor: "#CCCCCC",
-        weight: 2,
-        opacity: 1,
-        color: "white",
-        dashArray: "3",
-        fillOpacity: 0.7,
-      };
-    }
-
-    // Try to find region data for this feature
-    const regionName = feature.properties.NAME_2 || feature.properties.NAME_3 || feature.properties.name;
-    const region = regionData[regionName];
-
-    // If no data for this region, color it green (less than 4%)
-    if (!region) {
-      return {
-        fillColor: "#52C41A", // Green for regions with zero entries
-        weight: 2,
-        opacity: 1,
-        color: "white",
-        dashArray: "3",
-        fillOpacity: 0.5,
-      };
-    }
-
-    return {
-      fillColor: region.color,
-      weight: 2,
-      opacity: 1,
-      color: "white",
-      dashArray: "3",
-      fillOpacity: 0.7,
-    };
-  };
+  const style = (feature) => ({
+    fillColor: feature.properties.color,
+    weight: 2,
+    opacity: 1,
+    color: "white",
+    dashArray: "3",
+    // Districts without cases are drawn lighter
+    fillOpacity: feature.properties.count > 0 ? 0.7 : 0.5,
+  });
 
   const onEachFeature = (feature, layer) => {
-    const regionName = feature.properties.NAME_2 || feature.properties.NAME_3 || feature.properties.name;
-    
-    if (regionName) {
-      const region = regionData ? regionData[regionName] : null;
-      if (region) {
-        layer.bindTooltip(
-          `<div>
-            <strong>${regionName}</strong><br />
-            Zone: ${region.zone_type}<br />
-            Percentage: ${region.percentage.toFixed(2)}%<br />
-            Patient Cases: ${region.count || 0}
-          </div>`,
-          { sticky: true }
-        );
-      } else {
-        layer.bindTooltip(
-          `<div>
-            <strong>${regionName}</strong><br />
-            Zone: green (0%)<br />
-            Percentage: 0%<br />
-            Patient Cases: 0
-          </div>`,
-          { sticky: true }
-        );
-      }
-    }
+    const { name, zone_type, percentage, count } = feature.properties;
+    layer.bindTooltip(
+      `<div>
+        <strong>${name}</strong><br />
+        Zone: ${zone_type}<br />
+        Percentage: ${percentage.toFixed(2)}%<br />
+        Patient Cases: ${count}
+      </div>`,
+      { sticky: true }
+    );
   };
 
   // Custom radar style for red zones
@@ -333,7 +221,7 @@ const PakistanMap = ({ disease }) => {
     className: 'radar-pulse'
   };
 
-  if (loading) {
+  if (loading && !mapData) {
     return (
       <MapSection>
         <MapHeader>
@@ -399,16 +287,18 @@ const PakistanMap = ({ disease }) => {
       </style>
 
       <StyledMapContainer
-        center={[30.3753, 69.3451]}
-        zoom={5}
+        center={PAKISTAN_CENTER}
+        zoom={zoom}
         scrollWheelZoom={false}
       >
         <TileLayer
           attribution='&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors'
           url="https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png"
         />
+        <ZoomWatcher onZoom={setZoom} />
         <GeoJSON
-          data={pakistanGeoJson}
+          key={`${disease.id}-${mapData.zoom}`}
+          data={mapData}
           style={style}
           onEachFeature={onEachFeature}
         />
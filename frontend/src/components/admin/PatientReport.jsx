@@ -1,4 +1,4 @@
-import React from 'react';
+import React, { useState } from 'react';
 import styled, { keyframes } from 'styled-components';
 import { FaExclamationTriangle, FaCheckCircle, FaPrint, FaDownload, FaTimes } from 'react-icons/fa';
 import html2canvas from 'html2canvas';
@@ -172,6 +172,15 @@ const ConfidenceScore = styled.div`
   color: ${props => props.score >= 0.9 ? 'var(--success-color)' : 'var(--warning-color)'};
 `;
 
+const SymptomImage = styled.img`
+  display: block;
+  max-width: 320px;
+  max-height: 320px;
+  margin-top: var(--space-3);
+  border-radius: var(--border-radius-md);
+  border: 1px solid var(--neutral-300);
+`;
+
 const ActionBar = styled.div`
   display: flex;
   gap: var(--space-3);
@@ -199,6 +208,8 @@ const ActionButton = styled.button`
 `;
 
 const PatientReport = ({ patient, onClose }) => {
+  const [showImage, setShowImage] = useState(Boolean(patient.image_path));
+
   const handlePrint = () => {
     window.print();
   };
@@ -315,6 +326,14 @@ const PatientReport = ({ patient, onClose }) => {
             <ReportSection>
               <SectionTitle>Symptoms</SectionTitle>
               <InfoValue>{patient.symptoms || 'No symptoms recorded'}</InfoValue>
+              {showImage && (
+                <SymptomImage
+                  src={`http://localhost:5000/api/patients/${patient.id}/thumbnail`}
+                  alt="Symptom"
+                  crossOrigin="anonymous"
+                  onError={() => setShowImage(false)}
+                />
+              )}
             </ReportSection>
             
             <ReportSection>
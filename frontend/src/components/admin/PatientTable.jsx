@@ -1,15 +1,14 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import styled from 'styled-components';
 import {
   createColumnHelper,
   flexRender,
   getCoreRowModel,
-  getSortedRowModel,
-  getPaginationRowModel,
   useReactTable,
 } from '@tanstack/react-table';
 import { FaSort, FaSortUp, FaSortDown, FaEye, FaChevronLeft, FaChevronRight } from 'react-icons/fa';
 import PatientReport from './PatientReport';
+import { useAppContext } from '../../context/AppContext';
 
 const TableContainer = styled.div`
   background-color: white;
@@ -146,85 +145,221 @@ const PaginationButton = styled.button`
   }
 `;
 
+const FilterBar = styled.form`
+  display: flex;
+  flex-wrap: wrap;
+  align-items: flex-end;
+  gap: var(--space-3);
+  margin-bottom: var(--space-4);
+`;
+
+const FilterField = styled.label`
+  display: flex;
+  flex-direction: column;
+  gap: var(--space-1);
+  color: var(--neutral-700);
+  font-size: var(--font-size-sm);
+`;
+
+const FilterInput = styled.input`
+  border: 1px solid var(--neutral-400);
+  border-radius: var(--border-radius-md);
+  padding: var(--space-2);
+  font-size: var(--font-size-sm);
+  width: ${props => props.narrow ? '70px' : '140px'};
+`;
+
+const FilterSelect = styled.select`
+  border: 1px solid var(--neutral-400);
+  border-radius: var(--border-radius-md);
+  padding: var(--space-2);
+  font-size: var(--font-size-sm);
+`;
+
+const API_URL = 'http://localhost:5000/api';
+const PAGE_SIZE = 10;
+
+// Query parameters of GET /api/patients that the filter bar sets
+const EMPTY_FILTERS = {
+  disease_id: '',
+  severity_id: '',
+  location: '',
+  gender: '',
+  pregnancy_status: '',
+  age_min: '',
+  age_max: '',
+  created_from: '',
+  created_to: '',
+};
+
+// Provide a fallback with mock data in case the API is not available
+const MOCK_PATIENTS = [
+  {
+    id: 1,
+    name: "Ahmed Khan",
+    age: 35,
+    gender: "male",
+    location: "Islamabad",
+    temperature_f: 102.1,
+    blood_pressure: "140/90",
+    blood_glucose: 110,
+    disease: "Dengue",
+    severity: "Critical",
+    confidence_score: 0.95,
+    comment: "Patient shows classic dengue symptoms with high fever and joint pain."
+  },
+  {
+    id: 2,
+    name: "Fatima Ali",
+    age: 27,
+    gender: "female",
+    location: "Lahore",
+    temperature_f: 99.5,
+    blood_pressure: "110/70",
+    blood_glucose: 95,
+    disease: "Skin infection",
+    severity: "Medium",
+    confidence_score: 0.88,
+    comment: "Localized skin infection requiring antibiotic treatment."
+  },
+  {
+    id: 3,
+    name: "Muhammad Saeed",
+    age: 62,
+    gender: "male",
+    location: "Karachi",
+    temperature_f: 100.2,
+    blood_pressure: "160/95",
+    blood_glucose: 180,
+    disease: "Tuberculosis",
+    severity: "Urgent",
+    confidence_score: 0.91,
+    comment: "Advanced TB infection requiring immediate isolation and treatment."
+  }
+];
+
 const PatientTable = () => {
   const [patients, setPatients] = useState([]);
   const [loading, setLoading] = useState(true);
   const [viewMode, setViewMode] = useState('all'); // 'all', 'basic', or 'diagnosis'
   const [selectedPatient, setSelectedPatient] = useState(null);
+  // Filtering, sorting and paging happen on the server: draftFilters is
+  // what the filter bar shows, filters what the table was asked for
+  const [draftFilters, setDraftFilters] = useState(EMPTY_FILTERS);
+  const [filters, setFilters] = useState(EMPTY_FILTERS);
+  const [sorting, setSorting] = useState([]);
+  // cursors[i] is the keyset cursor of page i; the first page has none
+  const [cursors, setCursors] = useState([null]);
+  const [pageIndex, setPageIndex] = useState(0);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [total, setTotal] = useState(0);
+  const [reloads, setReloads] = useState(0);
+  const [diseases, setDiseases] = useState([]);
+  const [severities, setSeverities] = useState([]);
+  const { appState } = useAppContext();
+  const { recentTriage, feedResets } = appState;
+  const lastEventId = useRef(0);
+
+  useEffect(() => {
+    const fetchOptions = async () => {
+      try {
+        const [diseaseResponse, severityResponse] = await Promise.all([
+          fetch(`${API_URL}/diseases`),
+          fetch(`${API_URL}/severity-levels`),
+        ]);
+        if (diseaseResponse.ok) setDiseases(await diseaseResponse.json());
+        if (severityResponse.ok) setSeverities(await severityResponse.json());
+      } catch (error) {
+        console.error('Error fetching filter options:', error);
+      }
+    };
+
+    fetchOptions();
+  }, []);
 
   useEffect(() => {
     const fetchPatients = async () => {
+      const params = new URLSearchParams({ limit: PAGE_SIZE });
+      Object.entries(filters).forEach(([name, value]) => {
+        if (value !== '') params.set(name, value);
+      });
+      if (sorting.length > 0) {
+        params.set('sort', sorting[0].id);
+        params.set('order', sorting[0].desc ? 'desc' : 'asc');
+      }
+      if (cursors[pageIndex]) params.set('cursor', cursors[pageIndex]);
+
       try {
         setLoading(true);
-        // Provide a fallback with mock data in case the API is not available
-        try {
-          const response = await fetch('http://localhost:5000/api/patients');
-          if (response.ok) {
-            const data = await response.json();
-            setPatients(data);
-            setLoading(false);
-            return;
-          }
-        } catch (error) {
-          console.error('Error fetching real patient data:', error);
+        const response = await fetch(`${API_URL}/patients?${params}`);
+        const page = await response.json();
+        if (!response.ok) {
+          // A rejected filter, such as an age out of range: show no rows
+          console.error('Error fetching patients:', page.error);
+          setPatients([]);
+          setTotal(0);
+          setNextCursor(null);
+          return;
         }
-        
-        // Fallback to mock data
-        const mockPatients = [
-          {
-            id: 1,
-            name: "Ahmed Khan",
-            age: 35,
-            gender: "male",
-            location: "Islamabad",
-            temperature_f: 102.1,
-            blood_pressure: "140/90",
-            blood_glucose: 110,
-            disease: "Dengue",
-            severity: "Critical",
-            confidence_score: 0.95,
-            comment: "Patient shows classic dengue symptoms with high fever and joint pain."
-          },
-          {
-            id: 2,
-            name: "Fatima Ali",
-            age: 27,
-            gender: "female",
-            location: "Lahore",
-            temperature_f: 99.5,
-            blood_pressure: "110/70",
-            blood_glucose: 95,
-            disease: "Skin infection",
-            severity: "Medium",
-            confidence_score: 0.88,
-            comment: "Localized skin infection requiring antibiotic treatment."
-          },
-          {
-            id: 3,
-            name: "Muhammad Saeed",
-            age: 62,
-            gender: "male",
-            location: "Karachi",
-            temperature_f: 100.2,
-            blood_pressure: "160/95",
-            blood_glucose: 180,
-            disease: "Tuberculosis",
-            severity: "Urgent",
-            confidence_score: 0.91,
-            comment: "Advanced TB infection requiring immediate isolation and treatment."
-          }
-        ];
-        
-        setPatients(mockPatients);
+        setPatients(page.patients);
+        setTotal(page.total);
+        setNextCursor(page.next_cursor);
       } catch (error) {
-        console.error('Error fetching patients:', error);
+        console.error('Error fetching real patient data:', error);
+        setPatients(MOCK_PATIENTS);
+        setTotal(MOCK_PATIENTS.length);
+        setNextCursor(null);
       } finally {
         setLoading(false);
       }
     };
 
     fetchPatients();
-  }, []);
+  }, [filters, sorting, pageIndex, feedResets, reloads]);
+
+  // Newly triaged patients belong on the first page: reload it when they arrive
+  useEffect(() => {
+    const fresh = recentTriage.filter((event) => event.id > lastEventId.current);
+    if (fresh.length === 0) return;
+    lastEventId.current = fresh[fresh.length - 1].id;
+    if (pageIndex === 0) setReloads((count) => count + 1);
+  }, [recentTriage]);
+
+  const firstPage = () => {
+    setCursors([null]);
+    setPageIndex(0);
+  };
+
+  const applyFilters = (event) => {
+    event.preventDefault();
+    setFilters(draftFilters);
+    firstPage();
+  };
+
+  const clearFilters = () => {
+    setDraftFilters(EMPTY_FILTERS);
+    setFilters(EMPTY_FILTERS);
+    firstPage();
+  };
+
+  const updateDraft = (event) => {
+    const { name, value } = event.target;
+    setDraftFilters((current) => ({ ...current, [name]: value }));
+  };
+
+  const handleSortingChange = (updater) => {
+    setSorting((current) => (typeof updater === 'function' ? updater(current) : updater));
+    firstPage();
+  };
+
+  const nextPage = () => {
+    setCursors((current) => [...current.slice(0, pageIndex + 1), nextCursor]);
+    setPageIndex(pageIndex + 1);
+  };
+
+  const previousPage = () => {
+    setPageIndex(pageIndex - 1);
+  };
 
   const handleViewReport = (patient) => {
     setSelectedPatient(patient);
@@ -241,6 +376,7 @@ const PatientTable = () => {
     const baseColumns = [
       columnHelper.accessor('id', {
         header: 'ID',
+        enableSorting: false,
         cell: info => info.getValue()
       }),
       columnHelper.accessor('name', {
@@ -256,6 +392,7 @@ const PatientTable = () => {
       }),
       columnHelper.accessor('gender', {
         header: 'Gender',
+        enableSorting: false,
         cell: info => info.getValue().charAt(0).toUpperCase() + info.getValue().slice(1)
       }),
       columnHelper.accessor('location', {
@@ -264,10 +401,12 @@ const PatientTable = () => {
       }),
       columnHelper.accessor('temperature_f', {
         header: 'Temperature (°F)',
+        enableSorting: false,
         cell: info => info.getValue()
       }),
       columnHelper.accessor('blood_pressure', {
         header: 'Blood Pressure',
+        enableSorting: false,
         cell: info => info.getValue()
       }),
     ];
@@ -275,10 +414,12 @@ const PatientTable = () => {
     const diagnosisColumns = [
       columnHelper.accessor('disease', {
         header: 'Disease',
+        enableSorting: false,
         cell: info => info.getValue()
       }),
       columnHelper.accessor('severity', {
         header: 'Severity',
+        enableSorting: false,
         cell: info => info.getValue()
       }),
       columnHelper.accessor('confidence_score', {
@@ -308,22 +449,19 @@ const PatientTable = () => {
     }
   };
 
+  // Only name, age, location and confidence have a server-side sort
   const columns = React.useMemo(() => getColumns(), [viewMode]);
   
   const table = useReactTable({
     data: patients,
     columns,
+    state: { sorting },
+    onSortingChange: handleSortingChange,
+    manualSorting: true,
     getCoreRowModel: getCoreRowModel(),
-    getSortedRowModel: getSortedRowModel(),
-    getPaginationRowModel: getPaginationRowModel(),
-    initialState: {
-      pagination: {
-        pageSize: 10
-      }
-    }
   });
 
-  if (loading) {
+  if (loading && patients.length === 0) {
     return <TableContainer>Loading patient data...</TableContainer>;
   }
 
@@ -354,6 +492,73 @@ const PatientTable = () => {
           </ViewOptions>
         </TableHeader>
 
+        <FilterBar onSubmit={applyFilters}>
+          <FilterField>
+            Disease
+            <FilterSelect name="disease_id" value={draftFilters.disease_id} onChange={updateDraft}>
+              <option value="">All</option>
+              {diseases.map(disease => (
+                <option key={disease.id} value={disease.id}>{disease.name}</option>
+              ))}
+            </FilterSelect>
+          </FilterField>
+          <FilterField>
+            Severity
+            <FilterSelect name="severity_id" value={draftFilters.severity_id} onChange={updateDraft}>
+              <option value="">All</option>
+              {severities.map(severity => (
+                <option key={severity.id} value={severity.id}>{severity.name}</option>
+              ))}
+            </FilterSelect>
+          </FilterField>
+          <FilterField>
+            Location
+            <FilterInput name="location" value={draftFilters.location} onChange={updateDraft} />
+          </FilterField>
+          <FilterField>
+            Gender
+            <FilterSelect name="gender" value={draftFilters.gender} onChange={updateDraft}>
+              <option value="">All</option>
+              <option value="male">Male</option>
+              <option value="female">Female</option>
+            </FilterSelect>
+          </FilterField>
+          <FilterField>
+            Pregnant
+            <FilterSelect
+              name="pregnancy_status"
+              value={draftFilters.pregnancy_status}
+              onChange={updateDraft}
+            >
+              <option value="">All</option>
+              <option value="yes">Yes</option>
+              <option value="no">No</option>
+            </FilterSelect>
+          </FilterField>
+          <FilterField>
+            Age from
+            <FilterInput narrow type="number" min="0" max="150" name="age_min"
+              value={draftFilters.age_min} onChange={updateDraft} />
+          </FilterField>
+          <FilterField>
+            to
+            <FilterInput narrow type="number" min="0" max="150" name="age_max"
+              value={draftFilters.age_max} onChange={updateDraft} />
+          </FilterField>
+          <FilterField>
+            Seen from
+            <FilterInput type="date" name="created_from"
+              value={draftFilters.created_from} onChange={updateDraft} />
+          </FilterField>
+          <FilterField>
+            to
+            <FilterInput type="date" name="created_to"
+              value={draftFilters.created_to} onChange={updateDraft} />
+          </FilterField>
+          <ViewButton type="submit" active>Apply</ViewButton>
+          <ViewButton type="button" onClick={clearFilters}>Clear</ViewButton>
+        </FilterBar>
+
         <StyledTable>
           <TableHead>
             {table.getHeaderGroups().map(headerGroup => (
@@ -396,18 +601,19 @@ const PatientTable = () => {
         
         <PaginationContainer>
           <PaginationInfo>
-            Page {table.getState().pagination.pageIndex + 1} of {table.getPageCount()}
+            Page {pageIndex + 1} of {Math.max(1, Math.ceil(total / PAGE_SIZE))}
+            {' '}({total} patients)
           </PaginationInfo>
           <PaginationButtons>
             <PaginationButton 
-              onClick={() => table.previousPage()} 
-              disabled={!table.getCanPreviousPage()}
+              onClick={previousPage} 
+              disabled={loading || pageIndex === 0}
             >
               <FaChevronLeft />
             </PaginationButton>
             <PaginationButton 
-              onClick={() => table.nextPage()}
-              disabled={!table.getCanNextPage()}
+              onClick={nextPage}
+              disabled={loading || !nextCursor}
             >
               <FaChevronRight />
             </PaginationButton>
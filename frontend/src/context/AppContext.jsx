@@ -1,5 +1,11 @@
 import React, { createContext, useContext, useReducer, useEffect } from "react";
 
+// Wait this long after a live triage event before refreshing the stats,
+// so a burst of intake forms costs one request
+const STATS_REFRESH_DELAY_MS = 1000;
+// Live triage events kept in state for components that render them
+const RECENT_TRIAGE_LIMIT = 100;
+
 // Define initial state
 const initialState = {
   patientData: [],
@@ -16,6 +22,10 @@ const initialState = {
       datasets: [],
     },
   },
+  // Newest results from the /api/events feed, oldest first, and a counter
+  // bumped when the feed says events were missed and data should be reloaded
+  recentTriage: [],
+  feedResets: 0,
 };
 
 // Define reducer
@@ -33,6 +43,13 @@ function appReducer(state, action) {
       return { ...state, diagnosis: action.payload, loading: false };
     case "SET_ADMIN_STATS":
       return { ...state, adminStats: action.payload };
+    case "TRIAGE_EVENT":
+      return {
+        ...state,
+        recentTriage: [...state.recentTriage, action.payload].slice(-RECENT_TRIAGE_LIMIT),
+      };
+    case "FEED_RESET":
+      return { ...state, feedResets: state.feedResets + 1 };
     default:
       return state;
   }
@@ -41,25 +58,25 @@ function appReducer(state, action) {
 // Create context
 const AppContext = createContext();
 
+async function fetchAdminStats(dispatch) {
+  try {
+    const response = await fetch("http://localhost:5000/api/stats");
+    if (response.ok) {
+      const data = await response.json();
+      dispatch({ type: "SET_ADMIN_STATS", payload: data });
+    }
+  } catch (error) {
+    console.error("Error fetching admin stats:", error);
+  }
+}
+
 // Create provider component
 export function AppProvider({ children }) {
   const [appState, dispatch] = useReducer(appReducer, initialState);
 
   // Fetch admin stats on initial load
   useEffect(() => {
-    const fetchAdminStats = async () => {
-      try {
-        const response = await fetch("http://localhost:5000/api/stats");
-        if (response.ok) {
-          const data = await response.json();
-          dispatch({ type: "SET_ADMIN_STATS", payload: data });
-        }
-      } catch (error) {
-        console.error("Error fetching admin stats:", error);
-      }
-    };
-
-    fetchAdminStats();
+    fetchAdminStats(dispatch);
   }, []);
 
   return (
@@ -73,3 +90,40 @@ export function AppProvider({ children }) {
 export function useAppContext() {
   return useContext(AppContext);
 }
+
+// Follow new results as they are committed instead of polling. The feed
+// carries every patient's diagnosis and location and holds a server thread
+// while open, so only admin views subscribe, and only while mounted.
+export function useTriageFeed() {
+  const { dispatch } = useAppContext();
+
+  useEffect(() => {
+    let refreshTimer = null;
+    const scheduleStatsRefresh = () => {
+      if (!refreshTimer) {
+        refreshTimer = setTimeout(() => {
+          refreshTimer = null;
+          fetchAdminStats(dispatch);
+        }, STATS_REFRESH_DELAY_MS);
+      }
+    };
+
+    const events = new EventSource("http://localhost:5000/api/events");
+    events.addEventListener("triage", (event) => {
+      dispatch({
+        type: "TRIAGE_EVENT",
+        payload: { id: Number(event.lastEventId), ...JSON.parse(event.data) },
+      });
+      scheduleStatsRefresh();
+    });
+    events.addEventListener("reset", () => {
+      dispatch({ type: "FEED_RESET" });
+      scheduleStatsRefresh();
+    });
+
+    return () => {
+      events.close();
+      clearTimeout(refreshTimer);
+    };
+  }, [dispatch]);
+}
@@ -6,7 +6,7 @@ import PakistanMap from '../components/admin/PakistanMap';
 import OverallHistogram from '../components/admin/OverallHistogram';
 import TriageChart from '../components/admin/TriageChart';
 import PatientTable from '../components/admin/PatientTable';
-import { useAppContext } from '../context/AppContext';
+import { useAppContext, useTriageFeed } from '../context/AppContext';
 import { FaChartLine, FaUserInjured } from 'react-icons/fa';
 
 const AdminPageContainer = styled.div`
@@ -121,6 +121,8 @@ const TabIcon = styled.span`
 
 const AdminPage = () => {
   const { appState } = useAppContext();
+  // Live results refresh the stats and the patient table while this page is open
+  useTriageFeed();
   const [activeDiseaseId, setActiveDiseaseId] = useState(null);
   const [activeTab, setActiveTab] = useState('dashboard'); // 'dashboard' or 'patients'
   